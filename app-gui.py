@@ -1,137 +1,74 @@
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
-import redis
-import subprocess
-import pkg_resources
-import os
-import sys
-from dotenv import load_dotenv
-import bcrypt  # Added bcrypt for password hashing
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Define Redis connection parameters from environment variables
-redis_host = os.getenv("REDIS_HOST")
-redis_port = int(os.getenv("REDIS_PORT"))
-redis_password = os.getenv("REDIS_PASSWORD")
-
-# Validate environment variables
-if not redis_host or not redis_port:
-    raise ValueError("REDIS_HOST and REDIS_PORT must be set.")
-
-# Initialize the Redis connection
-redis_client = redis.StrictRedis(
-    host=redis_host,
-    port=redis_port,
-    password=redis_password,
-    db=0,
-    decode_responses=True
-)
-
-class User:
-    def __init__(self, username):
-        self.username = username
-
-    def check_password(self, password):
-        stored_password = redis_client.hget('users', self.username)
-        return stored_password and bcrypt.checkpw(password.encode(), stored_password.encode())
-
-    def set_password(self, password):
-        hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-        redis_client.hset('users', self.username, hashed_password)
-
-class UserManager:
-    def login(self, username, password):
-        user = User(username)
-        if user.check_password(password):
-            return user
-        return None
-
-    def signup(self, username, password):
-        if not redis_client.hexists('users', username):
-            user = User(username)
-            user.set_password(password)
-            return user
-        return None
-
-class PackageManager:
-    @staticmethod
-    def get_local_pip_list():
-        try:
-            installed_packages = pkg_resources.working_set
-            installed_packages_list = sorted(["%s==%s" % (i.key, i.version) for i in installed_packages])
-            return installed_packages_list
-        except Exception as e:
-            print(f"Failed to get local pip list: {e}")
-            return []
-
-    @staticmethod
-    def get_local_pip_list_using_pip():
-        try:
-            result = subprocess.run(
-                [sys.executable, '-m', 'pip', 'list', '--format=freeze'],
-                capture_output=True,
-                text=True
-            )
-            if result.returncode == 0:
-                return result.stdout.strip().split('\n')
-            else:
-                print(f"Failed to run pip list: {result.stderr}")
-                return []
-        except Exception as e:
-            print(f"Failed to get local pip list using pip: {e}")
-            return []
-
-    @staticmethod
-    def upload_pip(user, packages):
-        if not packages:
-            print("No packages selected for upload.")
-            return False
-
-        pip_list = '\n'.join(packages)
-        redis_client.set(user.username, pip_list)
-        print("Pip list uploaded successfully.")
-        return True
-
-    @staticmethod
-    def upload_all_pip(user):
-        pip_list = PackageManager.get_local_pip_list_using_pip()
-        success = PackageManager.upload_pip(user, pip_list)
-        return success
-
-    @staticmethod
-    def download_pip(user, packages, progress_callback):
-        if not packages:
-            print("No packages selected for download.")
-            return False
 
+import metrics
+from core import PackageManager, UserManager
+from installer import InstallMonitor
+
+# How often the Tk loop drains progress events from the background job, in milliseconds
+POLL_INTERVAL = 100
+
+# Rows inserted into the package table per Tk event loop tick
+INSERT_CHUNK_SIZE = 250
+
+# Delay before the package filter is applied while typing, in milliseconds
+FILTER_DELAY = 150
+
+class PackageTableModel:
+    """
+    Package rows and their selection state, kept on the Python side.
+
+    Rows are indexed by position; the selection is a bitset (one byte per row)
+    so selecting or clearing thousands of rows never touches Tcl.
+    """
+
+    def __init__(self):
+        self.set_packages([])
+
+    def set_packages(self, packages):
+        self.rows = []
         for package in packages:
-            package_info = package.strip().split('==')
-            if len(package_info) >= 1:
-                package_name = package_info[0]
-                progress_callback(f"Downloading and installing {package_name}...")
-                subprocess.call([sys.executable, '-m', 'pip', 'install', package_name])
-                progress_callback(f"{package_name} has been downloaded and installed.")
-        return True
-
-    @staticmethod
-    def download_all_packages(user, progress_callback):
-        pip_list = redis_client.get(user.username)
-
-        if pip_list:
-            packages = pip_list.split('\n')
-            for line in packages:
-                package_info = line.strip().split('==')
-                if len(package_info) >= 1:
-                    package_name = package_info[0]
-                    progress_callback(f"Downloading and installing {package_name}...")
-                    subprocess.call([sys.executable, '-m', 'pip', 'install', package_name])
-                    progress_callback(f"{package_name} has been downloaded and installed.")
-            return True
-        else:
-            print("No pip data found for the user.")
-            return False
+            package_info = package.split('==')
+            self.rows.append((package_info[0], package_info[1] if len(package_info) > 1 else ''))
+        self.names = [name.lower() for name, _ in self.rows]
+        self.selected = bytearray(len(self.rows))
+        self.query = ''
+        self.matches = list(range(len(self.rows)))
+
+    def filter(self, query):
+        """
+        Return the indexes of the rows whose name contains `query`.
+
+        When the query extends the previous one only the previous matches are searched.
+        """
+        query = query.strip().lower()
+        candidates = self.matches if self.query in query else range(len(self.rows))
+        self.matches = [index for index in candidates if query in self.names[index]]
+        self.query = query
+        return self.matches
+
+    def toggle(self, index):
+        self.selected[index] ^= 1
+        return self.selected[index]
+
+    def select_all(self):
+        self.selected = bytearray(b'\x01' * len(self.rows))
+
+    def select_none(self):
+        self.selected = bytearray(len(self.rows))
+
+    def select_matching(self):
+        for index in self.matches:
+            self.selected[index] = 1
+
+    def selected_indexes(self):
+        return [index for index, selected in enumerate(self.selected) if selected]
+
+    def selected_packages(self):
+        return [f"{self.rows[index][0]}=={self.rows[index][1]}" for index in self.selected_indexes()]
 
 class App:
     def __init__(self, root):
@@ -140,8 +77,15 @@ class App:
         self.user_manager = UserManager()
         self.package_manager = PackageManager()
         self.user = None
+        self.job = None
+        self.events = queue.Queue()
+        self.package_model = PackageTableModel()
+        self.inserted_rows = []
+        self.render_generation = 0
+        self.filter_job = None
 
         self.setup_gui()
+        self.root.after_idle(self.resume_session)
 
     def setup_gui(self):
         # Set up the main frame
@@ -177,14 +121,25 @@ class App:
         self.logout_button = tk.Button(button_frame, text="Logout", command=self.logout, state='disabled')
         self.logout_button.grid(row=0, column=6, padx=5, pady=5)
 
-        # Treeview setup
-        self.package_tree = ttk.Treeview(self.frame, columns=('Select', 'Package', 'Version'), show='headings', selectmode='extended')
-        self.package_tree.heading('Select', text='Select')
+        # Filter and selection controls
+        filter_frame = tk.Frame(self.frame)
+        filter_frame.pack(fill='x')
+
+        tk.Label(filter_frame, text="Filter:").pack(side='left')
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add('write', self.schedule_filter)
+        tk.Entry(filter_frame, textvariable=self.filter_var).pack(side='left', fill='x', expand=True, padx=5)
+
+        tk.Button(filter_frame, text="Select None", command=self.select_none).pack(side='right', padx=2)
+        tk.Button(filter_frame, text="Select Matching", command=self.select_matching).pack(side='right', padx=2)
+        tk.Button(filter_frame, text="Select All", command=self.select_all).pack(side='right', padx=2)
+
+        # Treeview setup; the highlighted rows mirror the selection bitset of the model
+        self.package_tree = ttk.Treeview(self.frame, columns=('Package', 'Version'), show='headings', selectmode='none')
         self.package_tree.heading('Package', text='Package Name')
         self.package_tree.heading('Version', text='Version')
 
         # Center-align text
-        self.package_tree.column('Select', anchor='center', width=60)
         self.package_tree.column('Package', anchor='center', width=150)
         self.package_tree.column('Version', anchor='center', width=100)
 
@@ -195,7 +150,7 @@ class App:
         self.vsb.pack(side='right', fill='y')
         self.package_tree.configure(yscrollcommand=self.vsb.set)
 
-        # Bind click event to toggle checkboxes
+        # Bind click event to toggle the selection of a row
         self.package_tree.bind('<Button-1>', self.toggle_checkbox)
 
     def toggle_checkbox(self, event):
@@ -204,12 +159,58 @@ class App:
             return
 
         row_id = self.package_tree.identify_row(event.y)
-        column_id = self.package_tree.identify_column(event.x)
+        if row_id:
+            self.package_model.toggle(int(row_id))
+            self.package_tree.selection_toggle(row_id)
+
+    def select_all(self):
+        self.package_model.select_all()
+        self.package_tree.selection_set(self.inserted_rows)
+
+    def select_none(self):
+        self.package_model.select_none()
+        self.package_tree.selection_set([])
+
+    def select_matching(self):
+        self.package_model.select_matching()
+        self.package_tree.selection_add(self.inserted_rows)
+
+    def schedule_filter(self, *args):
+        if self.filter_job is not None:
+            self.root.after_cancel(self.filter_job)
+        self.filter_job = self.root.after(FILTER_DELAY, self.apply_filter)
+
+    def apply_filter(self):
+        self.filter_job = None
+        self.render_rows(self.package_model.filter(self.filter_var.get()))
+
+    def render_rows(self, indexes):
+        """
+        Replace the table contents with the given model rows.
+
+        The first chunk is inserted right away and the rest on later event loop
+        ticks, so the window stays interactive with thousands of packages.
+        """
+        self.render_generation += 1
+        self.package_tree.delete(*self.inserted_rows)
+        self.inserted_rows = []
+        self.insert_chunk(indexes, 0, self.render_generation)
+
+    def insert_chunk(self, indexes, start, generation):
+        if generation != self.render_generation:
+            return
+
+        chunk = [str(index) for index in indexes[start:start + INSERT_CHUNK_SIZE]]
+        for row_id in chunk:
+            self.package_tree.insert('', tk.END, iid=row_id, values=self.package_model.rows[int(row_id)])
+        self.inserted_rows.extend(chunk)
+
+        selected = [row_id for row_id in chunk if self.package_model.selected[int(row_id)]]
+        if selected:
+            self.package_tree.selection_add(selected)
 
-        if column_id == '#1':  # Select column
-            current_value = self.package_tree.set(row_id, "Select")
-            new_value = 'True' if current_value == 'False' else 'False'
-            self.package_tree.set(row_id, "Select", new_value)
+        if start + INSERT_CHUNK_SIZE < len(indexes):
+            self.root.after_idle(self.insert_chunk, indexes, start + INSERT_CHUNK_SIZE, generation)
 
     def login(self):
         username = simpledialog.askstring("Login", "Enter username:")
@@ -224,10 +225,21 @@ class App:
         else:
             messagebox.showerror("Login", "Invalid username or password.")
 
+    def resume_session(self):
+        user = self.user_manager.resume_session()
+        if user:
+            self.user = user
+            self.toggle_buttons(True)
+            self.populate_package_tree()
+
     def signup(self):
         username = simpledialog.askstring("Signup", "Enter new username:")
         password = simpledialog.askstring("Signup", "Enter new password:", show='*')
-        user = self.user_manager.signup(username, password)
+        try:
+            user = self.user_manager.signup(username, password)
+        except ValueError as e:
+            messagebox.showerror("Signup", str(e))
+            return
 
         if user:
             self.user = user
@@ -238,110 +250,215 @@ class App:
             messagebox.showerror("Signup", "Username already exists.")
 
     def populate_package_tree(self):
-        self.package_tree.delete(*self.package_tree.get_children())
-        packages = self.package_manager.get_local_pip_list_using_pip()
-        for package in packages:
-            package_name, version = package.split('==')
-            self.package_tree.insert('', tk.END, values=('False', package_name, version))
+        self.package_model.set_packages(self.package_manager.get_local_pip_list())
+        self.render_rows(self.package_model.filter(self.filter_var.get()))
+
+    def run_job(self, title, work, success_message, failure_message, show_progress=True):
+        """
+        Run `work(progress_callback, monitor)` on a background thread.
+
+        Progress, pip output and the result are passed back through a queue
+        that the Tk loop drains with `after()`, so the window stays responsive.
+        """
+        if self.job is not None:
+            messagebox.showwarning(title, "Another operation is still running.")
+            return
+
+        monitor = InstallMonitor(
+            output_callback=lambda line: self.events.put(('output', line)),
+            step_callback=lambda done, total: self.events.put(('step', done, total)),
+        )
+        self.job = {
+            'title': title,
+            'monitor': monitor,
+            'success_message': success_message,
+            'failure_message': failure_message,
+            'start': time.monotonic(),
+            'window': self.create_progress_window(title, monitor) if show_progress else None,
+        }
+        self.toggle_buttons(True, busy=True)
+
+        def run():
+            try:
+                event = ('done', work(lambda message: self.events.put(('status', message)), monitor))
+            except Exception as e:
+                event = ('error', str(e))
+            # The queue is no longer drained after the final event, so the metrics summary travels with it.
+            summary = []
+            metrics.finish(summary.append)
+            self.events.put(event + ('\n'.join(summary),))
+
+        threading.Thread(target=run, daemon=True).start()
+        self.root.after(POLL_INTERVAL, self.poll_job)
+
+    def create_progress_window(self, title, monitor):
+        window = tk.Toplevel(self.root)
+        window.title(title)
+        window.geometry("560x360")
+        window.protocol("WM_DELETE_WINDOW", monitor.cancel)
+
+        self.progress_label = tk.Label(window, text="Starting...", anchor='w', padx=10, pady=5)
+        self.progress_label.pack(fill='x')
+
+        self.progress_bar = ttk.Progressbar(window, mode='indeterminate')
+        self.progress_bar.pack(fill='x', padx=10)
+        self.progress_bar.start()
+
+        self.progress_stats = tk.Label(window, text="", anchor='w', padx=10, pady=5)
+        self.progress_stats.pack(fill='x')
+
+        output_frame = tk.Frame(window)
+        output_frame.pack(fill='both', expand=True, padx=10)
+        self.progress_output = tk.Text(output_frame, height=12, state='disabled', wrap='none')
+        output_scrollbar = ttk.Scrollbar(output_frame, orient="vertical", command=self.progress_output.yview)
+        self.progress_output.configure(yscrollcommand=output_scrollbar.set)
+        output_scrollbar.pack(side='right', fill='y')
+        self.progress_output.pack(side='left', fill='both', expand=True)
+
+        self.cancel_button = tk.Button(window, text="Cancel", command=lambda: self.cancel_job(monitor))
+        self.cancel_button.pack(pady=5)
+        return window
+
+    def cancel_job(self, monitor):
+        monitor.cancel()
+        self.cancel_button.config(state='disabled')
+        self.progress_label.config(text="Cancelling...")
+
+    def poll_job(self):
+        output_lines = []
+        finished = None
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] in ('done', 'error'):
+                finished = event
+                break
+            if self.job['window'] is None:
+                continue
+            if event[0] == 'status':
+                self.progress_label.config(text=event[1])
+            elif event[0] == 'output':
+                output_lines.append(event[1])
+            elif event[0] == 'step':
+                self.update_progress_bar(*event[1:])
+
+        if output_lines:
+            self.progress_output.config(state='normal')
+            self.progress_output.insert(tk.END, '\n'.join(output_lines) + '\n')
+            self.progress_output.see(tk.END)
+            self.progress_output.config(state='disabled')
+
+        if finished is None:
+            self.root.after(POLL_INTERVAL, self.poll_job)
+            return
+
+        job, self.job = self.job, None
+        if job['window'] is not None:
+            job['window'].destroy()
+        self.toggle_buttons(self.user is not None)
+
+        summary = f"\n\n{finished[2]}" if finished[2] else ""
+        if finished[0] == 'error':
+            messagebox.showerror(job['title'], f"{job['failure_message']}\n{finished[1]}{summary}")
+        elif job['monitor'].cancelled:
+            messagebox.showwarning(job['title'], f"Operation cancelled.{summary}")
+        elif finished[1]:
+            messagebox.showinfo(job['title'], f"{job['success_message']}{summary}")
+        else:
+            messagebox.showerror(job['title'], f"{job['failure_message']}{summary}")
+
+    def update_progress_bar(self, done, total):
+        if not total:
+            return
+        if self.progress_bar['mode'] != 'determinate':
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate', maximum=total)
+        self.progress_bar['value'] = done
+
+        elapsed = time.monotonic() - self.job['start']
+        stats = f"{done} of {total} packages, elapsed {elapsed:.0f}s"
+        if done:
+            stats += f", ETA {elapsed / done * (total - done):.0f}s"
+        self.progress_stats.config(text=stats)
 
     def upload_all_pip(self):
         if not self.user:
             messagebox.showwarning("Upload", "Please log in first.")
             return
 
-        success = self.package_manager.upload_all_pip(self.user)
-
-        if success:
-            messagebox.showinfo("Upload", "All packages uploaded successfully.")
-        else:
-            messagebox.showerror("Upload", "Failed to upload packages.")
+        user = self.user
+        self.run_job(
+            "Upload",
+            lambda progress_callback, monitor: self.package_manager.upload_all_pip(user),
+            "All packages uploaded successfully.",
+            "Failed to upload packages.",
+            show_progress=False,
+        )
 
     def upload_pip(self):
-        selected_items = [self.package_tree.item(item, 'values') for item in self.package_tree.get_children() if self.package_tree.set(item, 'Select') == 'True']
-        if not selected_items:
+        selected_packages = self.package_model.selected_packages()
+        if not selected_packages:
             messagebox.showwarning("Upload", "No packages selected for upload.")
             return
 
-        selected_packages = [f"{package[1]}=={package[2]}" for package in selected_items]
-        success = self.package_manager.upload_pip(self.user, selected_packages)
-
-        if success:
-            messagebox.showinfo("Upload", "Selected packages uploaded successfully.")
-        else:
-            messagebox.showerror("Upload", "Failed to upload selected packages.")
+        user = self.user
+        self.run_job(
+            "Upload",
+            lambda progress_callback, monitor: self.package_manager.upload_pip(user, selected_packages),
+            "Selected packages uploaded successfully.",
+            "Failed to upload selected packages.",
+            show_progress=False,
+        )
 
     def download_all_pip(self):
         if not self.user:
             messagebox.showwarning("Download", "Please log in first.")
             return
 
-        # Create and show the progress window
-        self.progress_window = tk.Toplevel(self.root)
-        self.progress_window.title("Progress")
-        self.progress_window.geometry("300x100")
-
-        self.progress_label = tk.Label(self.progress_window, text="Downloading and installing packages...", padx=10, pady=10)
-        self.progress_label.pack()
-
-        self.root.update_idletasks()  # Update the GUI to show the progress window
-
-        def update_progress(message):
-            self.progress_label.config(text=message)
-            self.root.update_idletasks()
-
-        success = self.package_manager.download_all_packages(self.user, update_progress)
-
-        if success:
-            messagebox.showinfo("Download", "All packages downloaded and installed.")
-        else:
-            messagebox.showerror("Download", "No pip data found for the user.")
-
-        # Close the progress window
-        self.progress_window.destroy()
+        user = self.user
+        self.run_job(
+            "Download",
+            lambda progress_callback, monitor: self.package_manager.download_all_packages(
+                user, progress_callback, monitor=monitor),
+            "All packages downloaded and installed.",
+            "Failed to download and install all packages.",
+        )
 
     def download_selected_pip(self):
         if not self.user:
             messagebox.showwarning("Download", "Please log in first.")
             return
 
-        selected_items = [self.package_tree.item(item, 'values') for item in self.package_tree.get_children() if self.package_tree.set(item, 'Select') == 'True']
-        if not selected_items:
+        selected_packages = self.package_model.selected_packages()
+        if not selected_packages:
             messagebox.showwarning("Download", "No packages selected for download.")
             return
 
-        selected_packages = [f"{package[1]}=={package[2]}" for package in selected_items]
-
-        # Create and show the progress window
-        self.progress_window = tk.Toplevel(self.root)
-        self.progress_window.title("Progress")
-        self.progress_window.geometry("300x100")
-
-        self.progress_label = tk.Label(self.progress_window, text="Downloading and installing selected packages...", padx=10, pady=10)
-        self.progress_label.pack()
-
-        self.root.update_idletasks()  # Update the GUI to show the progress window
-
-        def update_progress(message):
-            self.progress_label.config(text=message)
-            self.root.update_idletasks()
-
-        success = self.package_manager.download_pip(self.user, selected_packages, update_progress)
-
-        if success:
-            messagebox.showinfo("Download", "Selected packages downloaded and installed.")
-        else:
-            messagebox.showerror("Download", "Failed to download selected packages.")
-
-        # Close the progress window
-        self.progress_window.destroy()
+        user = self.user
+        self.run_job(
+            "Download",
+            lambda progress_callback, monitor: self.package_manager.download_pip(
+                user, selected_packages, progress_callback, monitor=monitor),
+            "Selected packages downloaded and installed.",
+            "Failed to download selected packages.",
+        )
 
     def logout(self):
+        self.user_manager.logout(self.user)
         self.user = None
         messagebox.showinfo("Logout", "Logged out successfully.")
         self.toggle_buttons(False)
 
-    def toggle_buttons(self, logged_in):
-        if logged_in:
+    def toggle_buttons(self, logged_in, busy=False):
+        if busy:
+            self.upload_all_button.config(state='disabled')
+            self.upload_selected_button.config(state='disabled')
+            self.download_all_button.config(state='disabled')
+            self.download_selected_button.config(state='disabled')
+            self.logout_button.config(state='disabled')
+        elif logged_in:
             self.upload_all_button.config(state='normal')
             self.upload_selected_button.config(state='normal')
             self.download_all_button.config(state='normal')
@@ -357,7 +474,8 @@ class App:
             self.logout_button.config(state='disabled')
             self.login_button.config(state='normal')
             self.signup_button.config(state='normal')
-            self.package_tree.delete(*self.package_tree.get_children())
+            self.package_model.set_packages([])
+            self.render_rows([])
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -1,52 +1,36 @@
-import redis
+import argparse
+import contextlib
 import getpass
-import subprocess
-import pkg_resources
+import json
 import os
 import sys
-from dotenv import load_dotenv
-import bcrypt  # Added bcrypt for password hashing
-
-load_dotenv()
-# Define Redis connection parameters
-redis_host = os.getenv("REDIS_HOST")
-redis_port = os.getenv("REDIS_PORT")
-redis_password = os.getenv("REDIS_PASSWORD")
-
-# Validate environment variables
-if not redis_host or not redis_port:
-    raise ValueError("REDIS_HOST and REDIS_PORT must be set.")
-
-redis_port = int(redis_port)
-
-# Initialize the Redis connection
-redis_client = redis.StrictRedis(
-    host=redis_host,
-    port=redis_port,
-    password=redis_password,
-    db=0,
-    decode_responses=True
-)
-
-class User:
-    def __init__(self, username):
-        self.username = username
-
-    def check_password(self, password):
-        stored_password = redis_client.hget('users', self.username)
-        return stored_password and bcrypt.checkpw(password.encode(), stored_password.encode())
-
-    def set_password(self, password):
-        hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-        redis_client.hset('users', self.username, hashed_password)
-
-class UserManager:
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import core
+import metrics
+from core import PackageManager
+from installer import InstallMonitor, empty_report
+from lockfile import LOCK_FILENAME, format_entry, read_lock, read_requirements, requirement, write_lock
+from scanner import resolve_interpreter
+from storage import DEFAULT_PROFILE, check_name
+
+# Exit codes of the batch subcommands
+EXIT_OK = 0
+EXIT_FAILED = 1  # some packages failed to install, or `diff` found differences
+EXIT_USAGE = 2  # invalid arguments (argparse)
+EXIT_AUTH = 3
+EXIT_NO_DATA = 4
+EXIT_ERROR = 5
+
+
+class UserManager(core.UserManager):
     def login(self):
         while True:
             username = input("Enter your username: ")
             password = getpass.getpass("Enter your password: ")
-            user = User(username)
-            if user.check_password(password):
+            user = super().login(username, password)
+            if user:
                 return user
             else:
                 print("Invalid username or password. Try again.")
@@ -56,87 +40,23 @@ class UserManager:
             username = input("Enter a new username: ")
             password = getpass.getpass("Enter a password: ")
 
-            if not redis_client.hexists('users', username):
-                user = User(username)
-                user.set_password(password)
+            try:
+                user = super().signup(username, password)
+            except ValueError as e:
+                print(e)
+                continue
+            if user:
                 print("Signup successful. You can now log in.")
                 return user
             else:
                 print("Username already exists. Try a different one.")
 
-class PackageManager:
-    @staticmethod
-    def get_local_pip_list():
-        """
-        Retrieve the list of installed packages using pkg_resources.
-        """
-        try:
-            installed_packages = pkg_resources.working_set
-            installed_packages_list = sorted(["%s==%s" % (i.key, i.version) for i in installed_packages])
-            return '\n'.join(installed_packages_list)
-        except Exception as e:
-            print(f"Failed to get local pip list: {e}")
-            return None
-
-    @staticmethod
-    def get_local_pip_list_using_pip():
-        """
-        Retrieve the list of installed packages using pip module.
-        """
-        try:
-            result = subprocess.run(
-                [sys.executable, '-m', 'pip', 'list', '--format=freeze'],
-                capture_output=True,
-                text=True
-            )
-            if result.returncode == 0:
-                return result.stdout.strip()
-            else:
-                print(f"Failed to run pip list: {result.stderr}")
-                return None
-        except Exception as e:
-            print(f"Failed to get local pip list using pip: {e}")
-            return None
-
-    @staticmethod
-    def upload_pip(user, use_pip_module=False):
-        """
-        Upload the list of installed packages to Redis.
-        """
-        if use_pip_module:
-            pip_list = PackageManager.get_local_pip_list_using_pip()
-        else:
-            pip_list = PackageManager.get_local_pip_list()
-
-        if pip_list is not None:
-            redis_client.set(user.username, pip_list)
-            print("Pip list uploaded successfully.")
-        else:
-            print("Failed to retrieve pip list.")
-
-    @staticmethod
-    def download_all_packages(user):
-        """
-        Download and install all packages from the stored pip list in Redis.
-        """
-        pip_list = redis_client.get(user.username)
-
-        if pip_list:
-            for line in pip_list.split('\n'):
-                if line:
-                    package_info = line.strip().split('==')
-                    if len(package_info) >= 1:
-                        package_name = package_info[0]
-                        print(f"Downloading and installing {package_name}...")
-                        subprocess.call([sys.executable, '-m', 'pip', 'install', package_name])
-                        print(f"{package_name} has been downloaded and installed.")
-        else:
-            print("No pip data found for the user.")
-
 def main():
     user_manager = UserManager()
     package_manager = PackageManager()
-    user = None
+    user = user_manager.resume_session()
+    if user is not None:
+        print(f"Resumed saved session of {user.username}.")
 
     while True:
         if user is None:
@@ -152,16 +72,20 @@ def main():
         elif choice == '3':
             if user is not None:
                 use_pip_module = input("Use pip module to get pip list? (yes/no): ").strip().lower() == 'yes'
-                package_manager.upload_pip(user, use_pip_module)
+                package_manager.upload_all_pip(user, use_pip_module)
+                metrics.finish()
             else:
                 print("Please log in first.")
         elif choice == '4':
             if user is not None:
-                package_manager.download_all_packages(user)
+                dry_run = input("Dry run (only show the restore plan)? (yes/no): ").strip().lower() == 'yes'
+                package_manager.download_all_packages(user, dry_run=dry_run)
+                metrics.finish()
             else:
                 print("Please log in first.")
         elif choice == '5':
             if user is not None:
+                user_manager.logout(user)
                 user = None
                 print("Signed out.")
             else:
@@ -169,5 +93,393 @@ def main():
         else:
             print("Invalid choice. Please try again.")
 
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Upload and restore pip package lists stored in Redis. Without a subcommand the interactive menu starts.",
+        epilog="Credentials are taken from --token / PIP_LIST_TOKEN, the cached session, "
+               "or PIP_LIST_USERNAME and PIP_LIST_PASSWORD, in that order. Results are printed as JSON."
+    )
+    parser.add_argument('--token', default=os.getenv("PIP_LIST_TOKEN"), help="session token to log in with")
+    subparsers = parser.add_subparsers(dest='command')
+
+    upload = subparsers.add_parser('upload', help="upload the installed packages")
+    upload.add_argument('--python', help="interpreter whose packages are uploaded (default: this one)")
+    upload.add_argument('--use-pip', action='store_true', help="list packages with `pip list` instead of the scanner")
+    upload.add_argument('--profile', type=profile_name, default=DEFAULT_PROFILE,
+                        help="profile to store the packages in")
+
+    for name, help_text in (('restore', "install the stored packages"),
+                            ('diff', "compare the stored packages with the installed ones, or two snapshots")):
+        command = subparsers.add_parser(name, help=help_text)
+        command.add_argument('--python', dest='pythons', action='append', metavar='PATH[=WORKERS]',
+                             help="target interpreter or virtual environment, may be repeated (default: this one); "
+                                  "restore installs into at most WORKERS packages of a target at a time")
+        command.add_argument('--profile', type=profile_name, dest='profiles', action='append',
+                             help=f"stored profile, may be repeated (default: {DEFAULT_PROFILE})")
+        command.add_argument('--jobs', type=int,
+                             help="number of interpreters restored concurrently (default: all of them)")
+        if name == 'restore':
+            command.add_argument('--dry-run', action='store_true', help="only compute the restore plan")
+            command.add_argument('--chunk-size', type=int, help="packages per pip run")
+            command.add_argument('--locked', action='store_true',
+                                 help="install exactly the stored lock entries with --no-deps --require-hashes")
+            command.add_argument('--lock-file', metavar='PATH',
+                                 help=f"install exactly the entries of a {LOCK_FILENAME} file instead of a profile")
+        else:
+            command.add_argument('--from', dest='old', metavar='REF', type=snapshot_ref,
+                                 help="snapshot id, 'current' or 'live' to compare from (default: current)")
+            command.add_argument('--to', dest='new', metavar='REF', type=snapshot_ref,
+                                 help="snapshot id, 'current' or 'live' to compare to (default: live)")
+
+    history = subparsers.add_parser('history', help="list the stored profiles and their snapshots")
+    history.add_argument('--profile', type=profile_name, help="only list this profile")
+
+    export = subparsers.add_parser('export', help="export the stored packages as a requirements file")
+    export.add_argument('--profile', type=profile_name, default=DEFAULT_PROFILE, help="profile to export")
+    export.add_argument('--snapshot', type=int, help="snapshot id to export (default: the current list)")
+    export.add_argument('--output', help="file to write (default: include the packages in the JSON output)")
+    export.add_argument('--lock', action='store_true',
+                        help=f"export the stored lock entries in {LOCK_FILENAME} format, with hashes")
+
+    import_ = subparsers.add_parser('import', help=f"store the packages of a {LOCK_FILENAME} or requirements file")
+    import_.add_argument('file', help="file to read")
+    import_.add_argument('--profile', type=profile_name, default=DEFAULT_PROFILE,
+                         help="profile to store the packages in")
+
+    top = subparsers.add_parser('top', help="list the packages stored by the most users")
+    top.add_argument('--count', type=int, default=10, help="number of packages to list")
+    top.add_argument('--versions', action='store_true', help="rank name==version pins instead of package names")
+
+    who_uses = subparsers.add_parser('who-uses', help="list the users storing a package")
+    who_uses.add_argument('package', help="package name")
+    who_uses.add_argument('--version', help="only list the users storing this version")
+
+    subparsers.add_parser('reindex', help="rebuild the package popularity index from all stored lists")
+
+    prefetch = subparsers.add_parser('prefetch', help="fetch the wheels of the most used packages into the cache")
+    prefetch.add_argument('--top', type=int, default=10, help="number of name==version pins to fetch")
+    prefetch.add_argument('--wheelhouse', help="directory to fetch into (default: WHEELHOUSE_DIR)")
+    prefetch.add_argument('--jobs', type=int, default=4, help="number of concurrent pip wheel runs")
+    prefetch.add_argument('--python', help="interpreter to fetch wheels for (default: this one)")
+
+    watch = subparsers.add_parser('watch', help="keep a profile in sync with the installed packages until Ctrl+C")
+    watch.add_argument('--python', help="interpreter whose packages are watched (default: this one)")
+    watch.add_argument('--profile', type=profile_name, default=DEFAULT_PROFILE, help="profile to store the packages in")
+    watch.add_argument('--interval', type=float, default=1.0, help="seconds between checks for changes")
+    watch.add_argument('--debounce', type=float, default=2.0,
+                       help="seconds without further changes before they are uploaded")
+
+    follow = subparsers.add_parser('follow', help="print the updates of a profile as they happen until Ctrl+C")
+    follow.add_argument('--profile', type=profile_name, default=DEFAULT_PROFILE, help="profile to follow")
+    follow.add_argument('--restore', action='store_true', help="install the added and upgraded packages")
+    follow.add_argument('--python', help="interpreter to install into with --restore (default: this one)")
+    return parser
+
+
+def profile_name(value):
+    try:
+        check_name(value, 'profile')
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def snapshot_ref(value):
+    if value not in ('current', 'live') and not value.isdigit():
+        raise argparse.ArgumentTypeError(f"invalid REF {value!r}: expected a snapshot id, 'current' or 'live'")
+    return value
+
+
+def authenticate(token=None):
+    user_manager = core.UserManager()
+    if token:
+        return user_manager.resume_session(token)
+
+    # The cached session may belong to another account than the one named in the environment.
+    username = os.getenv("PIP_LIST_USERNAME")
+    password = os.getenv("PIP_LIST_PASSWORD")
+    user = user_manager.resume_session()
+    if user is not None and (not username or user.username == username):
+        return user
+
+    if username and password:
+        # Keep another account's cached session instead of replacing it.
+        return user_manager.login(username, password, remember=user is None)
+    return None
+
+
+def log(label, message):
+    print(f"[{label}] {message}", file=sys.stderr)
+
+
+def command_upload(user, args):
+    if args.use_pip:
+        packages = PackageManager.get_local_pip_list_using_pip(args.python)
+    else:
+        packages = PackageManager.get_local_pip_list(args.python)
+    if not packages:
+        return EXIT_FAILED, {'error': "no installed packages found"}
+
+    result = PackageManager.store_pip_list(user, packages, args.profile)
+    lock = PackageManager.get_local_lock(args.python)
+    PackageManager.store_lock(user, lock, args.profile)
+    summary = {'profile': args.profile, 'packages': len(packages),
+               'hashed': sum(1 for entry in lock if entry['sha256'])}
+    if result is None:
+        return EXIT_OK, {**summary, 'unchanged': True}
+    return EXIT_OK, {**summary, 'unchanged': False, **result}
+
+
+def parse_target(value):
+    """
+    Split a `--python PATH[=WORKERS]` value into the interpreter (a virtual environment
+    directory stands for its interpreter) and the number of concurrent installs into it.
+    """
+    path, _, workers = value.rpartition('=')
+    if not path or not workers.isdigit():
+        path, workers = value, None
+    return resolve_interpreter(path), int(workers) if workers else None
+
+
+def restore_target(packages, profile, python, args, dry_run, lock=None):
+    label = f"{profile} -> {python or sys.executable}"
+    monitor = InstallMonitor(output_callback=lambda line: log(label, line))
+    outcome = PackageManager.restore(packages, lambda message: log(label, message),
+                                     getattr(args, 'chunk_size', None), dry_run, monitor, python, lock)
+    return target_result(profile, python, outcome)
+
+
+def restore_shared(packages, profile, pythons, args):
+    """
+    Restore a profile into several interpreters at once, sharing one wheelhouse between them.
+    """
+    outcomes = PackageManager.restore_targets(packages, dict(pythons), lambda message: log(profile, message),
+                                              args.jobs)
+    return [target_result(profile, python, outcome) for python, outcome in outcomes.items()]
+
+
+def target_result(profile, python, outcome):
+    plan = outcome['plan']
+    report = outcome['report'] or empty_report()
+    return {
+        'profile': profile,
+        'python': python or sys.executable,
+        'plan': {action: requirements for action, requirements in plan.items() if action != 'unchanged'},
+        'unchanged': len(plan['unchanged']),
+        'installed': report['installed'],
+        'failed': report['failed'],
+        'total_time': round(report['total_time'], 3),
+    }
+
+
+def run_targets(user, args, dry_run):
+    if getattr(args, 'lock_file', None):
+        locks = {args.lock_file: read_lock(args.lock_file)}
+        stored = {args.lock_file: [requirement(entry) for entry in locks[args.lock_file]]}
+    else:
+        profiles = args.profiles or [DEFAULT_PROFILE]
+        stored = {profile: PackageManager.get_stored_pip_list(user, profile) for profile in profiles}
+        if getattr(args, 'locked', False):
+            locks = {profile: PackageManager.get_stored_lock(user, profile) for profile in profiles}
+        else:
+            locks = {profile: None for profile in profiles}
+    if not all(stored.values()) or any(lock == [] for lock in locks.values()):
+        return None
+
+    pythons = [parse_target(value) for value in args.pythons or []] or [(None, None)]
+    if len(pythons) > 1 and not dry_run and not any(locks.values()):
+        return [result for profile in stored for result in restore_shared(stored[profile], profile, pythons, args)]
+
+    # Only different interpreters are restored concurrently: the profiles of one interpreter
+    # go one after the other, as their pip runs would write to the same site-packages.
+    interpreters = list(dict.fromkeys(python for python, _ in pythons))
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs or len(interpreters))) as executor:
+        results = dict(zip(interpreters, executor.map(
+            lambda python: [restore_target(stored[profile], profile, python, args, dry_run, locks[profile])
+                            for profile in stored],
+            interpreters)))
+    return [results[python][index] for index in range(len(stored)) for python in interpreters]
+
+
+def command_restore(user, args):
+    results = run_targets(user, args, args.dry_run)
+    if results is None:
+        return EXIT_NO_DATA, {'error': "no pip data found for the user"}
+    failed = any(result['failed'] for result in results)
+    return EXIT_FAILED if failed else EXIT_OK, {'targets': results}
+
+
+def parse_ref(ref):
+    if ref is None or ref == 'current':
+        return None
+    if ref == 'live':
+        return ref
+    return int(ref)
+
+
+def command_diff(user, args):
+    if args.old or args.new:
+        old, new = parse_ref(args.old), parse_ref(args.new or 'live')
+        python = parse_target(args.pythons[0])[0] if args.pythons else None
+        try:
+            results = [{'profile': profile, 'from': args.old or 'current', 'to': args.new or 'live',
+                        **PackageManager.diff(user, old, new, profile, python)}
+                       for profile in args.profiles or [DEFAULT_PROFILE]]
+        except ValueError as e:
+            return EXIT_USAGE, {'error': str(e)}
+        differs = any(result['added'] or result['removed'] or result['changed'] for result in results)
+        return EXIT_FAILED if differs else EXIT_OK, {'diffs': results}
+
+    results = run_targets(user, args, True)
+    if results is None:
+        return EXIT_NO_DATA, {'error': "no pip data found for the user"}
+    for result in results:
+        del result['installed'], result['failed'], result['total_time']
+    differs = any(any(result['plan'].values()) for result in results)
+    return EXIT_FAILED if differs else EXIT_OK, {'targets': results}
+
+
+def command_history(user, args):
+    profiles = [args.profile] if args.profile else PackageManager.get_profiles(user)
+    history = {}
+    for profile in profiles:
+        history[profile] = [
+            {'snapshot': snapshot, 'time': datetime.fromtimestamp(timestamp, timezone.utc).isoformat()}
+            for snapshot, timestamp in PackageManager.get_snapshots(user, profile)
+        ]
+    return EXIT_OK, {'profiles': history}
+
+
+def command_export(user, args):
+    if args.lock:
+        if args.snapshot is not None:
+            return EXIT_USAGE, {'error': "snapshots are stored without lock entries"}
+        entries = PackageManager.get_stored_lock(user, args.profile)
+        if not entries:
+            return EXIT_NO_DATA, {'error': "no lock entries found for the user"}
+        if not args.output:
+            return EXIT_OK, {'lock': [format_entry(entry) for entry in entries]}
+        write_lock(args.output, entries)
+        return EXIT_OK, {'output': args.output, 'count': len(entries),
+                         'hashed': sum(1 for entry in entries if entry['sha256'])}
+
+    try:
+        packages = PackageManager.get_stored_pip_list(user, args.profile, args.snapshot)
+    except ValueError as e:
+        return EXIT_USAGE, {'error': str(e)}
+    if not packages:
+        return EXIT_NO_DATA, {'error': "no pip data found for the user"}
+    if not args.output:
+        return EXIT_OK, {'packages': packages}
+
+    with open(args.output, 'w') as output:
+        output.write('\n'.join(packages) + '\n')
+    return EXIT_OK, {'output': args.output, 'count': len(packages)}
+
+
+def command_import(user, args):
+    try:
+        entries, skipped = read_requirements(args.file)
+    except ValueError as e:
+        return EXIT_USAGE, {'error': str(e)}
+    if not entries:
+        return EXIT_NO_DATA, {'error': f"no packages found in {args.file}"}
+
+    result = PackageManager.store_pip_list(user, [requirement(entry) for entry in entries], args.profile)
+    PackageManager.store_lock(user, entries, args.profile)
+    summary = {'profile': args.profile, 'packages': len(entries),
+               'hashed': sum(1 for entry in entries if entry['sha256']),
+               'unpinned': [entry['name'] for entry in entries if not entry['version']], 'skipped': skipped}
+    if result is None:
+        return EXIT_OK, {**summary, 'unchanged': True}
+    return EXIT_OK, {**summary, 'unchanged': False, **result}
+
+
+def command_top(user, args):
+    packages = PackageManager.get_top_packages(args.count, args.versions)
+    return EXIT_OK, {'packages': [{'package': package, 'users': users} for package, users in packages]}
+
+
+def command_who_uses(user, args):
+    users = PackageManager.get_package_users(args.package, args.version)
+    if not users:
+        return EXIT_NO_DATA, {'error': f"no stored list uses {args.package}"}
+    return EXIT_OK, {'package': args.package, 'version': args.version, 'users': users}
+
+
+def command_reindex(user, args):
+    return EXIT_OK, {'lists': PackageManager.rebuild_index()}
+
+
+def command_prefetch(user, args):
+    result = PackageManager.prefetch_popular(args.top, args.wheelhouse, args.jobs, print, args.python)
+    return EXIT_FAILED if result['failed'] else EXIT_OK, result
+
+
+def command_watch(user, args):
+    pushes = PackageManager.watch(user, args.python, args.profile, args.interval, args.debounce,
+                                  progress_callback=lambda message: log('watch', message))
+    return EXIT_OK, {'profile': args.profile, 'pushes': pushes}
+
+
+def command_follow(user, args):
+    failed = []
+
+    def on_change(message, report):
+        log('change', json.dumps(message))
+        if report:
+            failed.extend(report['failed'])
+
+    updates = PackageManager.follow(user, args.profile, args.restore, args.python,
+                                    progress_callback=lambda message: log('follow', message),
+                                    change_callback=on_change)
+    return EXIT_FAILED if failed else EXIT_OK, {'profile': args.profile, 'updates': updates, 'failed': failed}
+
+
+COMMANDS = {
+    'upload': command_upload,
+    'restore': command_restore,
+    'diff': command_diff,
+    'history': command_history,
+    'export': command_export,
+    'import': command_import,
+    'top': command_top,
+    'who-uses': command_who_uses,
+    'reindex': command_reindex,
+    'prefetch': command_prefetch,
+    'watch': command_watch,
+    'follow': command_follow,
+}
+
+
+def run_command(args):
+    """
+    Run a batch subcommand without prompting and print its result as JSON.
+
+    Everything else the command prints goes to stderr so stdout stays parseable.
+    Returns the process exit code.
+    """
+    stdout = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            user = authenticate(args.token)
+            if user is None:
+                code, result = EXIT_AUTH, {'error': "authentication failed"}
+            else:
+                code, result = COMMANDS[args.command](user, args)
+                result = {'user': user.username, **result}
+        except Exception as e:
+            code, result = EXIT_ERROR, {'error': f"{type(e).__name__}: {e}"}
+        metrics.finish(lambda message: log('metrics', message))
+
+    json.dump({'command': args.command, 'exit_code': code, **result}, stdout, indent=2)
+    stdout.write('\n')
+    return code
+
+
 if __name__ == '__main__':
-    main()
+    args = build_parser().parse_args()
+    if args.command is None:
+        main()
+    else:
+        sys.exit(run_command(args))
@@ -0,0 +1,136 @@
+"""
+Compare the size and the encode/decode throughput of the plain text pip list
+format with the interned hash format.
+
+Usage:
+    python benchmarks/bench_codec.py [--users 1000] [--packages 300] [--redis-url URL]
+
+Without --redis-url the benchmark runs against fakeredis and only reports the
+payload bytes (the lengths of the stored strings). With --redis-url every
+format is written under `benchcodec:*` keys and measured with MEMORY USAGE,
+which includes Redis' per-key and per-field overhead; use a scratch database,
+as the names are interned into its shared `pipdict:*` table.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codec  # noqa: E402
+from storage import to_lines, to_mapping  # noqa: E402
+
+WORDS = ['python', 'django', 'flask', 'data', 'science', 'utils', 'client', 'sdk', 'azure', 'google',
+         'cloud', 'types', 'plugin', 'pytest', 'async', 'core', 'tools', 'requests', 'toolbelt', 'jupyter']
+
+
+def make_pool(size, rng):
+    pool = set()
+    while len(pool) < size:
+        pool.add('-'.join(rng.sample(WORDS, rng.randint(1, 3))) + str(rng.randint(0, 99)))
+    return sorted(pool)
+
+
+def make_profiles(users, packages, rng):
+    pool = make_pool(packages * 3, rng)
+    # Most users share the same popular packages.
+    weights = [1.0 / (rank + 1) for rank in range(len(pool))]
+    profiles = []
+    for _ in range(users):
+        names = set()
+        while len(names) < packages:
+            names.update(rng.choices(pool, weights, k=packages - len(names)))
+        profiles.append([f"{name}=={rng.randint(0, 9)}.{rng.randint(0, 30)}.{rng.randint(0, 9)}" for name in sorted(names)])
+    return profiles
+
+
+def connect(url):
+    if url:
+        import redis
+        return redis.StrictRedis.from_url(url, decode_responses=True)
+    import fakeredis
+    return fakeredis.FakeStrictRedis(decode_responses=True)
+
+
+def memory_usage(redis_client, prefix, values, write):
+    """
+    Write each value under `<prefix>:<index>` with `write(pipe, key, value)` and return the total
+    MEMORY USAGE of the keys, which are deleted again.
+    """
+    keys = [f"benchcodec:{prefix}:{index}" for index in range(len(values))]
+    pipe = redis_client.pipeline(transaction=False)
+    for key, value in zip(keys, values):
+        write(pipe, key, value)
+    pipe.execute()
+    for key in keys:
+        pipe.memory_usage(key, samples=0)
+    total = sum(usage or 0 for usage in pipe.execute())
+    redis_client.delete(*keys)
+    return total
+
+
+def throughput(profiles, function):
+    start = time.perf_counter()
+    for profile in profiles:
+        function(profile)
+    elapsed = time.perf_counter() - start
+    return len(profiles) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--packages', type=int, default=300)
+    parser.add_argument('--redis-url')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    profiles = make_profiles(args.users, args.packages, rng)
+    redis_client = connect(args.redis_url)
+    codec.clear_cache()
+
+    texts = ['\n'.join(profile) for profile in profiles]
+    mappings = [to_mapping(profile) for profile in profiles]
+    encoded = [codec.encode_mapping(redis_client, mapping) for mapping in mappings]
+    names = redis_client.hgetall(codec.NAMES_KEY)
+
+    if args.redis_url:
+        unit = 'bytes in Redis (MEMORY USAGE)'
+        text_bytes = memory_usage(redis_client, 'text', texts, lambda pipe, key, text: pipe.set(key, text))
+        zlib_bytes = memory_usage(redis_client, 'zlib', texts,
+                                  lambda pipe, key, text: pipe.set(key, zlib.compress(text.encode())))
+        plain_bytes = memory_usage(redis_client, 'plain', mappings,
+                                   lambda pipe, key, mapping: pipe.hset(key, mapping=mapping))
+        interned_bytes = memory_usage(redis_client, 'interned', encoded,
+                                      lambda pipe, key, mapping: pipe.hset(key, mapping=mapping))
+        table_bytes = sum(redis_client.memory_usage(key, samples=0) or 0 for key in (codec.NAMES_KEY, codec.IDS_KEY))
+    else:
+        unit = 'payload bytes (without Redis overhead)'
+        text_bytes = sum(len(text) for text in texts)
+        zlib_bytes = sum(len(zlib.compress(text.encode())) for text in texts)
+        plain_bytes = sum(len(name) + len(version) for mapping in mappings for name, version in mapping.items())
+        interned_bytes = sum(len(name_id) + len(version) for mapping in encoded
+                             for name_id, version in mapping.items())
+        table_bytes = 2 * sum(len(name) + len(name_id) for name, name_id in names.items())
+
+    text_encode = throughput(profiles, lambda profile: '\n'.join(profile))
+    text_decode = throughput(texts, lambda text: to_mapping(text.split('\n')))
+    interned_encode = throughput(mappings, lambda mapping: codec.encode_mapping(redis_client, mapping))
+    interned_decode = throughput(encoded, lambda mapping: to_lines(codec.decode_mapping(redis_client, mapping)))
+
+    print(f"{args.users} users x {args.packages} packages, {len(names)} distinct names, {unit}")
+    print(f"  text blob             {text_bytes:12,d} bytes")
+    print(f"  text blob, zlib       {zlib_bytes:12,d} bytes")
+    print(f"  hash, plain names     {plain_bytes:12,d} bytes")
+    print(f"  hash, interned names  {interned_bytes + table_bytes:12,d} bytes "
+          f"({interned_bytes:,d} + {table_bytes:,d} shared table)")
+    print(f"  text encode / decode      {text_encode:10,.0f} / {text_decode:10,.0f} lists/s")
+    print(f"  interned encode / decode  {interned_encode:10,.0f} / {interned_decode:10,.0f} lists/s")
+
+
+if __name__ == '__main__':
+    main()
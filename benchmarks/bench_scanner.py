@@ -0,0 +1,95 @@
+"""
+Compare the environment scanner with pkg_resources and `pip list`.
+
+Usage:
+    python benchmarks/bench_scanner.py [--packages 500] [--site-packages DIR] [--repeat 5]
+
+Without --site-packages a synthetic site-packages directory with the given
+number of distributions is created in a temporary directory.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scanner  # noqa: E402
+
+
+def build_site_packages(root, count):
+    for index in range(count):
+        name = f"bench_package_{index}"
+        version = f"1.{index % 10}.{index}"
+        dist_info = os.path.join(root, f"{name}-{version}.dist-info")
+        os.makedirs(dist_info)
+        with open(os.path.join(dist_info, 'METADATA'), 'w') as metadata:
+            metadata.write(f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n\n")
+        with open(os.path.join(dist_info, 'RECORD'), 'w'):
+            pass
+    return root
+
+
+def best_of(repeat, function):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def bench_pkg_resources(site):
+    start = time.perf_counter()
+    import pkg_resources
+    import_time = time.perf_counter() - start
+
+    def scan():
+        return sorted("%s==%s" % (i.key, i.version) for i in pkg_resources.WorkingSet([site]))
+    return import_time, scan
+
+
+def bench_pip_list(site):
+    def scan():
+        result = subprocess.run(
+            [sys.executable, '-m', 'pip', 'list', '--format=freeze', '--path', site],
+            capture_output=True,
+            text=True
+        )
+        return result.stdout.strip().split('\n')
+    return scan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--packages', type=int, default=500)
+    parser.add_argument('--site-packages')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        site = args.site_packages or build_site_packages(root, args.packages)
+
+        def cold_scan():
+            scanner.clear_cache()
+            return scanner.scan_environment([site])
+
+        cold, packages = best_of(args.repeat, cold_scan)
+        warm, _ = best_of(args.repeat, lambda: scanner.scan_environment([site]))
+        import_time, pkg_resources_scan = bench_pkg_resources(site)
+        pkg_resources_time, _ = best_of(args.repeat, pkg_resources_scan)
+        pip_time, _ = best_of(args.repeat, bench_pip_list(site))
+
+    print(f"{len(packages)} distributions, best of {args.repeat} runs")
+    print(f"  scanner (cold)          {cold * 1000:10.2f} ms")
+    print(f"  scanner (memoized)      {warm * 1000:10.2f} ms")
+    print(f"  pkg_resources import    {import_time * 1000:10.2f} ms")
+    print(f"  pkg_resources scan      {pkg_resources_time * 1000:10.2f} ms")
+    print(f"  pip list --format=freeze{pip_time * 1000:10.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+Benchmark the scan, upload, download and restore paths and report them as JSON.
+
+Usage:
+    python benchmarks/run.py [--sizes 100,1000,20000] [--repeat 5] [--redis-url URL] [--output FILE]
+
+For every size a synthetic site-packages directory and stored pip list with
+that many packages is built, and each stage reports its latency percentiles,
+throughput (packages per second) and peak traced memory. Without --redis-url
+the Redis stages run against fakeredis. The restore stages install
+--install-packages generated wheels from a local wheelhouse into a fresh
+virtual environment, so no network access is needed. Compare two releases by
+running the same command on both and diffing the JSON output.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import venv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codec  # noqa: E402
+import core  # noqa: E402
+import scanner  # noqa: E402
+import storage  # noqa: E402
+from bench_codec import connect  # noqa: E402
+from bench_scanner import build_site_packages  # noqa: E402
+from depgraph import build_graph, install_graph  # noqa: E402
+from installer import install_packages  # noqa: E402
+from wheels import write_wheel  # noqa: E402
+
+STAGES = ['scan', 'scan_memoized', 'pip_list', 'upload', 'upload_unchanged', 'upload_delta', 'download',
+          'parse_legacy', 'diff', 'login', 'session', 'restore', 'restore_graph']
+
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(function, repeat, items, setup=None):
+    """
+    Time `repeat` runs of `function` (after `setup`, which is not timed) and trace the
+    memory of one more run. Returns the stage result dict.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return summarize(timings, items, peak)
+
+
+def summarize(timings, items, peak_memory=None):
+    mean = sum(timings) / len(timings)
+    return {
+        'runs': len(timings),
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p90_ms': percentile(timings, 0.90) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'max_ms': max(timings) * 1000,
+        'mean_ms': mean * 1000,
+        'throughput': items / mean if mean else None,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def make_packages(count, rng):
+    return [f"bench-package-{index}=={rng.randint(0, 9)}.{rng.randint(0, 30)}.{index}" for index in range(count)]
+
+
+def build_wheelhouse(root, count):
+    """
+    Generate `count` wheels in chains of ten, where every package depends on the one ten before it.
+    """
+    wheelhouse = os.path.join(root, 'wheelhouse')
+    os.makedirs(wheelhouse)
+    requirements = []
+    for index in range(count):
+        name = f"bench_wheel_{index}"
+        write_wheel(wheelhouse, name, '1.0', [f"bench_wheel_{index - 10}"] if index >= 10 else [])
+        requirements.append(f"{name}==1.0")
+    return wheelhouse, requirements
+
+
+def fresh_environment(root, label):
+    path = os.path.join(root, label)
+    venv.create(path, with_pip=True)
+    return os.path.join(path, 'bin', 'python') if os.name != 'nt' else os.path.join(path, 'Scripts', 'python.exe')
+
+
+def bench_restore(root, wheelhouse, requirements, graph):
+    python = fresh_environment(root, 'restore-graph' if graph else 'restore')
+    start = time.perf_counter()
+    if graph:
+        report = install_graph(build_graph(requirements, wheelhouse, python=python), lambda message: None,
+                               workers=4, python=python)
+    else:
+        report = install_packages(requirements, lambda message: None,
+                                  extra_args=['--no-index', '--find-links', wheelhouse, '--quiet'], python=python)
+    elapsed = time.perf_counter() - start
+    result = summarize(list(report['package_times'].values()) or [elapsed], 1)
+    result.update(throughput=len(report['installed']) / elapsed, total_ms=elapsed * 1000,
+                  failed=len(report['failed']))
+    return result
+
+
+def run_size(size, args, stages, redis_client):
+    rng = random.Random(args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        site = build_site_packages(os.path.join(root, 'site-packages'), size)
+        packages = make_packages(size, rng)
+        changed = [line if index % 100 else line + '.post1' for index, line in enumerate(packages)]
+
+        if 'scan' in stages:
+            results['scan'] = measure(lambda: scanner.scan_environment([site]), args.repeat, size,
+                                      setup=scanner.clear_cache)
+        if 'scan_memoized' in stages:
+            scanner.scan_environment([site])
+            results['scan_memoized'] = measure(lambda: scanner.scan_environment([site]), args.repeat, size)
+        if 'pip_list' in stages:
+            command = [sys.executable, '-m', 'pip', 'list', '--format=freeze', '--path', site]
+            results['pip_list'] = measure(lambda: subprocess.run(command, capture_output=True), args.repeat, size)
+
+        username = f"bench-{size}-user"
+
+        def reset_user():
+            keys = list(redis_client.scan_iter(f"pip:{username}*"))
+            if keys:
+                redis_client.delete(*keys)
+
+        if 'upload' in stages:
+            results['upload'] = measure(lambda: storage.upload_packages(redis_client, username, packages),
+                                        args.repeat, size, setup=reset_user)
+        storage.upload_packages(redis_client, username, packages)
+        if 'upload_unchanged' in stages:
+            results['upload_unchanged'] = measure(lambda: storage.upload_packages(redis_client, username, packages),
+                                                  args.repeat, size)
+        if 'upload_delta' in stages:
+            flip = iter(range(args.repeat + 1))
+            results['upload_delta'] = measure(
+                lambda: storage.upload_packages(redis_client, username, changed if next(flip) % 2 == 0 else packages),
+                args.repeat, size)
+        storage.upload_packages(redis_client, username, packages)
+        if 'download' in stages:
+            results['download'] = measure(lambda: storage.load_packages(redis_client, username), args.repeat, size,
+                                          setup=codec.clear_cache)
+        if 'parse_legacy' in stages:
+            # The pre-hash format: one newline separated string parsed with split('\n') / split('==').
+            text = '\n'.join(packages) + '\n'
+            results['parse_legacy'] = measure(lambda: storage.to_mapping(text.split('\n')), args.repeat, size)
+        if 'diff' in stages:
+            storage.upload_packages(redis_client, username, changed)
+            snapshots = [snapshot for snapshot, _ in storage.list_snapshots(redis_client, username)]
+            results['diff'] = measure(
+                lambda: storage.diff_snapshots(redis_client, username, snapshots[-2], snapshots[-1]),
+                args.repeat, size)
+        reset_user()
+
+        if size == args.sizes[0]:
+            if 'login' in stages:
+                user = core.User('bench-login')
+                user.set_password('password')
+                results['login'] = measure(lambda: user.check_password('password'), args.repeat, 1)
+            if 'session' in stages:
+                core.session_file = os.path.join(root, 'session.json')
+                manager = core.UserManager()
+                token = manager.create_session(core.User('bench-login'))
+                results['session'] = measure(lambda: manager.resume_session(token), args.repeat, 1)
+
+            count = min(size, args.install_packages)
+            if count and ('restore' in stages or 'restore_graph' in stages):
+                wheelhouse, requirements = build_wheelhouse(root, count)
+                if 'restore' in stages:
+                    results['restore'] = bench_restore(root, wheelhouse, requirements, graph=False)
+                if 'restore_graph' in stages:
+                    results['restore_graph'] = bench_restore(root, wheelhouse, requirements, graph=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default='100,1000,20000',
+                        help="comma separated package counts (default: 100,1000,20000)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--redis-url', help="benchmark against this server instead of fakeredis")
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help=f"comma separated stages to run (default: all of {','.join(STAGES)})")
+    parser.add_argument('--install-packages', type=int, default=50,
+                        help="number of wheels installed by the restore stages, run at the smallest size only")
+    parser.add_argument('--bcrypt-rounds', type=int, default=core.bcrypt_rounds)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    args.sizes = sorted(int(size) for size in args.sizes.split(','))
+    stages = set(args.stages.split(','))
+    unknown = stages - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    redis_client = connect(args.redis_url)
+    core.set_redis(redis_client)
+    core.bcrypt_rounds = args.bcrypt_rounds
+    codec.clear_cache()
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'redis': 'redis' if args.redis_url else 'fakeredis',
+        'repeat': args.repeat,
+        'bcrypt_rounds': args.bcrypt_rounds,
+        'timestamp': time.time(),
+        'sizes': {},
+    }
+    for size in args.sizes:
+        print(f"Benchmarking {size} packages...", file=sys.stderr)
+        report['sizes'][str(size)] = run_size(size, args, stages, redis_client)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
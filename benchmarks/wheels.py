@@ -0,0 +1,30 @@
+"""
+Generate wheels for benchmarks and tests, so restores need no package index.
+"""
+import base64
+import hashlib
+import os
+import zipfile
+
+
+def write_wheel(wheelhouse, name, version, requires=()):
+    """
+    Write a minimal pure-Python wheel that depends on the `requires` requirements and return its path.
+    """
+    dist_info = f"{name}-{version}.dist-info"
+    files = {
+        f"{name}.py": f"VERSION = {version!r}\n",
+        f"{dist_info}/METADATA": f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+                                 + ''.join(f"Requires-Dist: {requirement}\n" for requirement in requires),
+        f"{dist_info}/WHEEL": "Wheel-Version: 1.0\nGenerator: benchmarks\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+    }
+    record = []
+    path = os.path.join(wheelhouse, f"{name}-{version}-py3-none-any.whl")
+    with zipfile.ZipFile(path, 'w') as wheel:
+        for file_path, content in files.items():
+            wheel.writestr(file_path, content)
+            digest = base64.urlsafe_b64encode(hashlib.sha256(content.encode()).digest()).rstrip(b'=').decode()
+            record.append(f"{file_path},sha256={digest},{len(content)}")
+        record.append(f"{dist_info}/RECORD,,")
+        wheel.writestr(f"{dist_info}/RECORD", '\n'.join(record) + '\n')
+    return path
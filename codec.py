@@ -0,0 +1,104 @@
+"""
+Compact encoding of stored package lists.
+
+Package names repeat across nearly every user, so instead of storing them in
+each user's hash they are interned once in a shared table and the per-user
+hash maps a short base-36 id to the version:
+
+    pipdict:names    name -> id
+    pipdict:ids      id -> name
+    pipdict:seq      last allocated id
+
+The format of a user's hash is recorded in the `format` field of its meta hash.
+"""
+
+FORMAT_PLAIN = 1
+FORMAT_INTERNED = 2
+FORMAT_VERSION = FORMAT_INTERNED
+
+NAMES_KEY = 'pipdict:names'
+IDS_KEY = 'pipdict:ids'
+SEQ_KEY = 'pipdict:seq'
+
+# Interned ids never change, so they can be cached for the life of the process.
+_name_ids = {}
+_id_names = {}
+
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def to_base36(number):
+    encoded = ''
+    while True:
+        number, digit = divmod(number, 36)
+        encoded = _DIGITS[digit] + encoded
+        if not number:
+            return encoded
+
+
+def _remember(name, name_id):
+    _name_ids[name] = name_id
+    _id_names[name_id] = name
+
+
+def intern_names(redis_client, names):
+    """
+    Return a dict of name -> id, allocating ids for names not seen before.
+
+    Known names cost one HMGET; new names get a block of ids from a single
+    INCRBY and are registered with HSETNX, so concurrent writers agree on the
+    id that won.
+    """
+    missing = [name for name in set(names) if name not in _name_ids]
+    if missing:
+        for name, name_id in zip(missing, redis_client.hmget(NAMES_KEY, missing)):
+            if name_id:
+                _remember(name, name_id)
+        missing = [name for name in missing if name not in _name_ids]
+
+    if missing:
+        last = redis_client.incrby(SEQ_KEY, len(missing))
+        pipe = redis_client.pipeline()
+        for offset, name in enumerate(missing):
+            name_id = to_base36(last - len(missing) + offset + 1)
+            pipe.hsetnx(NAMES_KEY, name, name_id)
+            pipe.hsetnx(IDS_KEY, name_id, name)
+        pipe.hmget(NAMES_KEY, missing)
+        for name, name_id in zip(missing, pipe.execute()[-1]):
+            _remember(name, name_id)
+
+    return {name: _name_ids[name] for name in names}
+
+
+def lookup_names(redis_client, name_ids):
+    """
+    Return a dict of id -> name for interned ids.
+    """
+    missing = [name_id for name_id in set(name_ids) if name_id not in _id_names]
+    if missing:
+        for name_id, name in zip(missing, redis_client.hmget(IDS_KEY, missing)):
+            if name is None:
+                raise KeyError(f"Unknown package id {name_id!r} in stored pip list.")
+            _remember(name, name_id)
+    return {name_id: _id_names[name_id] for name_id in name_ids}
+
+
+def encode_mapping(redis_client, mapping):
+    """
+    Encode a dict of name -> version into a dict of id -> version.
+    """
+    name_ids = intern_names(redis_client, list(mapping))
+    return {name_ids[name]: version for name, version in mapping.items()}
+
+
+def decode_mapping(redis_client, encoded):
+    """
+    Decode a dict of id -> version back into a dict of name -> version.
+    """
+    names = lookup_names(redis_client, list(encoded))
+    return {names[name_id]: version for name_id, version in encoded.items()}
+
+
+def clear_cache():
+    _name_ids.clear()
+    _id_names.clear()
@@ -0,0 +1,682 @@
+import contextlib
+import hashlib
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+
+from dotenv import load_dotenv
+
+import metrics
+from depgraph import prefetch_and_install_graph, prefetch_and_install_targets
+from installer import (empty_report, fetch_wheels, install_packages, normalize_name, parse_requirement,
+                       plan_requirements, plan_restore, prefetch_and_install, print_plan, print_report)
+from lockfile import applicable, capture_entries, capture_lock, install_lock
+from popularity import package_users, rebuild_index, top_packages
+from scanner import interpreter_paths, scan_environment
+import storage
+from storage import (DEFAULT_PROFILE, apply_delta, check_name, compute_etag, count_packages, diff_mappings,
+                     diff_snapshots, index_member, iter_changes, iter_package_batches, list_profiles, list_snapshots,
+                     load_lock, load_mapping, load_packages, store_lock, stored_version, to_lines, to_mapping,
+                     update_lock, upload_packages)
+from watcher import SiteWatcher, watch
+from wheelcache import WheelCache
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Number of parallel download workers for restores; 0 installs straight from the index
+prefetch_workers = int(os.getenv("PREFETCH_WORKERS", "0"))
+wheelhouse_dir = os.getenv("WHEELHOUSE_DIR") or None
+
+# Number of concurrent `pip install --no-deps` runs per dependency layer; 0 lets pip resolve the whole list
+install_workers = int(os.getenv("INSTALL_WORKERS", "0"))
+
+# Stored lists longer than this are read and restored in batches of this many packages
+stream_batch_size = int(os.getenv("STREAM_BATCH_SIZE", "5000"))
+
+# Local wheel cache shared by all restores; setting WHEEL_CACHE_DIR enables it
+wheel_cache_dir = os.getenv("WHEEL_CACHE_DIR") or None
+wheel_cache_size = int(os.getenv("WHEEL_CACHE_SIZE_MB", "2048")) * 1024 * 1024
+
+# bcrypt cost factor for new and rehashed passwords
+bcrypt_rounds = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Lifetime of login sessions in seconds and where the CLI caches its session token
+session_ttl = int(os.getenv("SESSION_TTL", "86400"))
+session_file = os.path.expanduser(os.getenv("SESSION_FILE", "~/.pip_list_downloader/session.json"))
+
+_redis_client = None
+
+
+def create_connection_pool():
+    """
+    Build the shared Redis connection pool from the environment.
+
+    No connection is opened here; the pool connects on the first command.
+    Transient connection errors and timeouts are retried REDIS_RETRIES times
+    with exponential backoff, and idle connections are health-checked every
+    REDIS_HEALTH_CHECK_INTERVAL seconds before reuse.
+    """
+    import redis
+    from redis.backoff import ExponentialBackoff
+    from redis.exceptions import ConnectionError, TimeoutError
+    from redis.retry import Retry
+
+    redis_host = os.getenv("REDIS_HOST")
+    redis_port = os.getenv("REDIS_PORT")
+    redis_password = os.getenv("REDIS_PASSWORD")
+
+    # Validate environment variables
+    if not redis_host or not redis_port:
+        raise ValueError("REDIS_HOST and REDIS_PORT must be set.")
+
+    return redis.ConnectionPool(
+        host=redis_host,
+        port=int(redis_port),
+        password=redis_password,
+        db=0,
+        decode_responses=True,
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "16")),
+        socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "5")),
+        socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", "5")),
+        health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30")),
+        retry=Retry(ExponentialBackoff(cap=2, base=0.1), int(os.getenv("REDIS_RETRIES", "3"))),
+        retry_on_error=[ConnectionError, TimeoutError],
+    )
+
+
+def get_redis():
+    """
+    Return the shared Redis client, creating its connection pool on first use.
+    """
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = metrics.instrument_redis(redis.StrictRedis(connection_pool=create_connection_pool()))
+    return _redis_client
+
+
+def set_redis(client):
+    """
+    Use the given client (e.g. a fakeredis instance with decode_responses=True) instead of the pool.
+    """
+    global _redis_client
+    _redis_client = metrics.instrument_redis(client)
+
+
+class User:
+    def __init__(self, username, session_token=None):
+        self.username = username
+        self.session_token = session_token
+
+    def check_password(self, password):
+        """
+        Verify the password, rehashing it when it was hashed with a different cost factor.
+        """
+        import bcrypt  # Imported lazily, only password logins and signups need it
+        stored_password = get_redis().hget('users', self.username)
+        if not stored_password:
+            return False
+        with metrics.span('bcrypt', operation='check', rounds=password_rounds(stored_password)) as record:
+            if not bcrypt.checkpw(password.encode(), stored_password.encode()):
+                record['status'] = 'failed'
+                return False
+        if password_rounds(stored_password) != bcrypt_rounds:
+            self.set_password(password)
+        return True
+
+    def set_password(self, password):
+        import bcrypt
+
+        with metrics.span('bcrypt', operation='hash', rounds=bcrypt_rounds):
+            hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=bcrypt_rounds)).decode()
+        get_redis().hset('users', self.username, hashed_password)
+
+
+def password_rounds(hashed_password):
+    """
+    Return the cost factor of a `$2b$<rounds>$...` bcrypt hash.
+    """
+    try:
+        return int(hashed_password.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def session_key(token):
+    # Only a digest of the token is stored, so a Redis dump holds no usable tokens.
+    return f"pipsession:{hashlib.sha256(token.encode()).hexdigest()}"
+
+
+def user_sessions_key(username):
+    return f"pipsession:user:{username}"
+
+
+class UserManager:
+    def login(self, username, password, remember=True):
+        """
+        Log in with a password. With `remember`, a session token is issued and cached
+        so later runs can log in through `resume_session()` without bcrypt.
+        """
+        user = User(username)
+        if user.check_password(password):
+            if remember:
+                self.create_session(user)
+            return user
+        return None
+
+    def signup(self, username, password):
+        """
+        Register a new user. Returns None when the username is taken, and raises ValueError
+        when it cannot be used in key names (see `storage.check_name()`).
+        """
+        check_name(username)
+        if not get_redis().hexists('users', username):
+            user = User(username)
+            user.set_password(password)
+            return user
+        return None
+
+    def create_session(self, user):
+        """
+        Issue a random session token for the user, valid for SESSION_TTL seconds.
+        """
+        token = secrets.token_urlsafe(32)
+        pipe = get_redis().pipeline()
+        pipe.set(session_key(token), user.username, ex=session_ttl)
+        pipe.sadd(user_sessions_key(user.username), session_key(token))
+        pipe.expire(user_sessions_key(user.username), session_ttl)
+        pipe.execute()
+
+        user.session_token = token
+        try:
+            os.makedirs(os.path.dirname(session_file), exist_ok=True)
+            descriptor = os.open(session_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(descriptor, 'w') as cache:
+                json.dump({'username': user.username, 'token': token}, cache)
+        except OSError as e:
+            print(f"Failed to cache session token: {e}")
+        return token
+
+    def resume_session(self, token=None):
+        """
+        Log in with a session token (by default the cached one) using a single GET.
+        Returns None when there is no token or it expired or was invalidated; an
+        invalid cached token is removed from the cache.
+        """
+        cached = token is None
+        if cached:
+            try:
+                with open(session_file) as cache:
+                    token = json.load(cache)['token']
+            except (OSError, ValueError, KeyError):
+                return None
+
+        username = get_redis().get(session_key(token))
+        if username is None:
+            if cached:
+                self.forget_session()
+            return None
+        return User(username, token)
+
+    def logout(self, user):
+        """
+        Invalidate the user's current session token and remove the cached one.
+        """
+        if user.session_token:
+            pipe = get_redis().pipeline()
+            pipe.delete(session_key(user.session_token))
+            pipe.srem(user_sessions_key(user.username), session_key(user.session_token))
+            pipe.execute()
+            user.session_token = None
+        self.forget_session()
+
+    def invalidate_sessions(self, username):
+        """
+        Invalidate every session token issued to a user.
+        """
+        redis_client = get_redis()
+        keys = redis_client.smembers(user_sessions_key(username))
+        redis_client.delete(user_sessions_key(username), *keys)
+
+    def forget_session(self):
+        try:
+            os.remove(session_file)
+        except FileNotFoundError:
+            pass
+
+
+class PackageManager:
+    @staticmethod
+    def get_local_pip_list(python=None):
+        """
+        Retrieve the list of installed packages from the dist-info / egg-info metadata on sys.path,
+        or on the path of the `python` interpreter.
+        """
+        try:
+            with metrics.span('scan', method='metadata', python=python or sys.executable) as record:
+                packages = scan_environment() if python is None else scan_environment(interpreter_paths(python))
+                record['count'] = len(packages)
+            return packages
+        except Exception as e:
+            print(f"Failed to get local pip list: {e}")
+            return []
+
+    @staticmethod
+    def get_local_pip_list_using_pip(python=None):
+        """
+        Retrieve the list of installed packages using pip module.
+        """
+        try:
+            with metrics.span('scan', method='pip', python=python or sys.executable) as record:
+                result = subprocess.run(
+                    [python or sys.executable, '-m', 'pip', 'list', '--format=freeze'],
+                    capture_output=True,
+                    text=True
+                )
+                record.update(exit_status=result.returncode, bytes=len(result.stdout))
+            if result.returncode == 0:
+                return result.stdout.strip().split('\n')
+            else:
+                print(f"Failed to run pip list: {result.stderr}")
+                return []
+        except Exception as e:
+            print(f"Failed to get local pip list using pip: {e}")
+            return []
+
+    @staticmethod
+    def store_pip_list(user, packages, profile=DEFAULT_PROFILE):
+        """
+        Store a package list in one of the user's profiles and return the `changed` / `removed`
+        counts and new `version`, or None when the stored list was already up to date.
+        """
+        with metrics.span('upload', profile=profile, count=len(packages)):
+            return upload_packages(get_redis(), user.username, packages, profile)
+
+    @staticmethod
+    def upload_pip(user, packages, profile=DEFAULT_PROFILE):
+        """
+        Upload a list of packages to Redis, sending only the changed entries.
+        """
+        if not packages:
+            print("No packages selected for upload.")
+            return False
+
+        result = PackageManager.store_pip_list(user, packages, profile)
+        if result is None:
+            print("Pip list is unchanged, nothing to upload.")
+        else:
+            print(f"Pip list uploaded successfully ({result['changed']} changed, {result['removed']} removed).")
+        return True
+
+    @staticmethod
+    def upload_all_pip(user, use_pip_module=False, python=None, profile=DEFAULT_PROFILE):
+        """
+        Upload the list of installed packages to Redis, together with their lock entries.
+        """
+        if use_pip_module:
+            pip_list = PackageManager.get_local_pip_list_using_pip(python)
+        else:
+            pip_list = PackageManager.get_local_pip_list(python)
+        if not PackageManager.upload_pip(user, pip_list, profile):
+            return False
+        PackageManager.store_lock(user, PackageManager.get_local_lock(python), profile)
+        return True
+
+    @staticmethod
+    def get_local_lock(python=None):
+        """
+        Return the lock entries (version, wheel tags and hashes, source URL, marker) of the installed packages.
+        """
+        cache = WheelCache(wheel_cache_dir, wheel_cache_size) if wheel_cache_dir else None
+        with metrics.span('scan', method='lock', python=python or sys.executable) as record:
+            entries = capture_lock(sys.path if python is None else interpreter_paths(python), cache, python)
+            record['count'] = len(entries)
+        return entries
+
+    @staticmethod
+    def store_lock(user, entries, profile=DEFAULT_PROFILE):
+        """
+        Store the lock entries of a profile. Returns False when the stored lock was already up to date.
+        """
+        return store_lock(get_redis(), user.username, entries, profile)
+
+    @staticmethod
+    def get_stored_lock(user, profile=DEFAULT_PROFILE):
+        return load_lock(get_redis(), user.username, profile)
+
+    @staticmethod
+    def get_stored_pip_list(user, profile=DEFAULT_PROFILE, snapshot=None):
+        """
+        Return a stored package list of the user (the current one, or a snapshot) as `name==version` lines.
+        """
+        with metrics.span('download', profile=profile) as record:
+            packages = load_packages(get_redis(), user.username, profile, snapshot)
+            record['count'] = len(packages)
+        return packages
+
+    @staticmethod
+    def iter_stored_pip_list(user, profile=DEFAULT_PROFILE, batch_size=None):
+        """
+        Yield the stored package list in batches of `name==version` lines (STREAM_BATCH_SIZE by default)
+        without loading the whole list.
+        """
+        return iter_package_batches(get_redis(), user.username, profile, batch_size or stream_batch_size)
+
+    @staticmethod
+    def get_profiles(user):
+        return list_profiles(get_redis(), user.username)
+
+    @staticmethod
+    def get_snapshots(user, profile=DEFAULT_PROFILE):
+        """
+        Return the (snapshot id, timestamp) pairs of a profile, oldest first.
+        """
+        return list_snapshots(get_redis(), user.username, profile)
+
+    @staticmethod
+    def diff(user, old=None, new=None, profile=DEFAULT_PROFILE, python=None):
+        """
+        Return the `added`, `removed` and `changed` packages between two versions of a profile.
+
+        `old` and `new` are snapshot ids, None for the current stored list, or
+        'live' for the packages installed in the `python` interpreter.
+        """
+        if old != 'live' and new != 'live':
+            return diff_snapshots(get_redis(), user.username, old, new, profile)
+
+        def mapping(ref):
+            if ref == 'live':
+                return to_mapping(PackageManager.get_local_pip_list(python))
+            return load_mapping(get_redis(), user.username, profile, ref)
+        return diff_mappings(mapping(old), mapping(new))
+
+    @staticmethod
+    def get_top_packages(count=10, versions=False):
+        """
+        Return the (name, number of stored lists) of the most used packages across all users,
+        or of the most used `name==version` pins with `versions`.
+        """
+        return top_packages(get_redis(), count, versions)
+
+    @staticmethod
+    def get_package_users(name, version=None):
+        """
+        Return the stored lists (usernames, or `username/profile`) that use a package.
+        """
+        return package_users(get_redis(), normalize_name(name), version)
+
+    @staticmethod
+    def rebuild_index():
+        """
+        Recompute the popularity index from the stored lists of every user. Returns the number of lists indexed.
+        """
+        redis_client = get_redis()
+        lists = [(username, profile) for username in redis_client.hkeys('users')
+                 for profile in list_profiles(redis_client, username)]
+        rebuild_index(redis_client, ((index_member(username, profile), load_mapping(redis_client, username, profile))
+                                     for username, profile in lists))
+        return len(lists)
+
+    @staticmethod
+    def prefetch_popular(count=10, wheelhouse=None, workers=4, progress_callback=print, python=None):
+        """
+        Fetch the wheels of the `count` most used `name==version` pins in parallel.
+
+        Wheels go into `wheelhouse` (default: WHEELHOUSE_DIR) and, with
+        WHEEL_CACHE_DIR set, into the local wheel cache, so later restores start warm.
+        Returns the prefetched and failed requirements.
+        """
+        wheelhouse = wheelhouse or wheelhouse_dir
+        cache = WheelCache(wheel_cache_dir, wheel_cache_size) if wheel_cache_dir else None
+        if wheelhouse is None and cache is None:
+            raise ValueError("Set a wheelhouse or WHEEL_CACHE_DIR to prefetch into.")
+
+        requirements = [requirement for requirement, _ in top_packages(get_redis(), count, versions=True)]
+        result = {'fetched': [], 'failed': []}
+        with contextlib.ExitStack() as stack:
+            if wheelhouse is None:
+                wheelhouse = stack.enter_context(tempfile.TemporaryDirectory(prefix='wheelhouse-'))
+            os.makedirs(wheelhouse, exist_ok=True)
+            fetch_wheels(requirements, wheelhouse, progress_callback, workers, python=python, cache=cache,
+                         fetched_callback=lambda package, ok: result['fetched' if ok else 'failed'].append(package))
+            if cache is not None:
+                cache.add_directory(wheelhouse)
+                cache.save()
+        return result
+
+    @staticmethod
+    def watch(user, python=None, profile=DEFAULT_PROFILE, interval=1.0, debounce=2.0, should_stop=lambda: False,
+              progress_callback=print):
+        """
+        Keep a stored profile in sync with the installed packages until `should_stop()` or Ctrl+C.
+
+        The environment is uploaded once in full, then its site-packages
+        directories are polled every `interval` seconds and the changes are
+        pushed as deltas once they have settled for `debounce` seconds. Only the
+        lock entries of the changed packages are read and written. When the
+        stored list was changed elsewhere in the meantime, the whole list is
+        uploaded instead. Returns the number of pushes.
+        """
+        redis_client = get_redis()
+        site = SiteWatcher(sys.path if python is None else interpreter_paths(python))
+        with metrics.span('scan', method='watch', python=python or sys.executable) as record:
+            packages = site.scan()
+            record['count'] = len(packages)
+        PackageManager.store_pip_list(user, to_lines(packages), profile)
+        PackageManager.store_lock(user, PackageManager.get_local_lock(python), profile)
+        progress_callback(f"Uploaded {len(packages)} packages, watching for changes...")
+
+        cache = WheelCache(wheel_cache_dir, wheel_cache_size) if wheel_cache_dir else None
+        state = {'etag': compute_etag(packages)}
+
+        def push(mapping, added, removed):
+            with metrics.span('upload', profile=profile, method='delta', count=len(added) + len(removed)):
+                result = apply_delta(redis_client, user.username, mapping, state['etag'], added, removed, profile)
+            if result is None:
+                progress_callback("The stored list was changed elsewhere, uploading the whole list.")
+                PackageManager.store_pip_list(user, to_lines(mapping), profile)
+                PackageManager.store_lock(user, PackageManager.get_local_lock(python), profile)
+            else:
+                entries = capture_entries({name: (version, site.location(name)) for name, version in added.items()},
+                                          cache, python)
+                update_lock(redis_client, user.username, entries, [name for name in removed if name not in added],
+                            profile)
+            state['etag'] = compute_etag(mapping)
+            upgraded = len(set(added) & set(removed))
+            progress_callback(f"Pushed {len(added) - upgraded} added, {upgraded} upgraded and "
+                              f"{len(removed) - upgraded} removed packages.")
+            # A watch runs until it is stopped, so spans are exported and dropped after every push.
+            metrics.finish(progress_callback)
+
+        return watch(site, push, interval, debounce, should_stop=should_stop, progress_callback=progress_callback)
+
+    @staticmethod
+    def follow(user, profile=DEFAULT_PROFILE, restore=False, python=None, should_stop=lambda: False,
+               progress_callback=print, change_callback=None):
+        """
+        Receive the updates of a stored profile as they are published, until `should_stop()` or Ctrl+C.
+
+        `change_callback(message, report)` is called for every update. With
+        `restore`, the added and upgraded packages are installed into the
+        `python` interpreter as they arrive; when updates were missed (a gap in
+        the version numbers) or a message only says the list changed in full,
+        the whole stored list is restored. Removed packages are not
+        uninstalled. Returns the number of updates received.
+        """
+        redis_client = get_redis()
+        changes = iter_changes(redis_client, user.username, profile)
+        version = stored_version(redis_client, user.username, profile)
+        received = 0
+        try:
+            for message in changes:
+                if should_stop():
+                    break
+                if message is None or message['origin'] == storage.origin:
+                    continue
+                received += 1
+                report = None
+                if restore:
+                    if message.get('full') or message['version'] != version + 1:
+                        packages = PackageManager.get_stored_pip_list(user, profile)
+                    else:
+                        packages = to_lines(message['added'])
+                    if packages:
+                        report = PackageManager.restore(packages, progress_callback, python=python)['report']
+                version = message['version']
+                if change_callback:
+                    change_callback(message, report)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            changes.close()
+        return received
+
+    @staticmethod
+    def restore(packages, progress_callback=print, chunk_size=None, dry_run=False, monitor=None, python=None,
+                lock=None):
+        """
+        Download and install the given `name==version` packages and return the plan and install report.
+
+        The packages are diffed against the installed packages first and only
+        missing or mismatched pins are handed to pip, in one run (or one run per
+        `chunk_size` packages); failed packages are retried one by one. With
+        PREFETCH_WORKERS set, wheels are fetched in parallel into a wheelhouse
+        ahead of the install. With WHEEL_CACHE_DIR set, the pipeline is always
+        used and wheels come from the local wheel cache when possible.
+        With INSTALL_WORKERS set, all wheels are fetched first and installed
+        along their dependency graph, INSTALL_WORKERS at a time per layer.
+        With `lock` entries, packages are installed exactly as locked with
+        `--no-deps --require-hashes` and no resolver run; packages without an
+        entry, or whose marker does not match the interpreter, are skipped.
+        With `dry_run` only the plan is computed. An
+        `InstallMonitor` streams pip's output and can cancel the install.
+        Packages are installed into the `python` interpreter (default: this one).
+        """
+        if lock is not None:
+            lock = {entry['name']: entry for entry in applicable(lock, python)}
+            packages = [line for line in packages if parse_requirement(line)[0] in lock]
+        installed = PackageManager.get_local_pip_list(python)
+        plan = plan_restore(packages, installed)
+        print_plan(plan, progress_callback, verbose=dry_run)
+        requirements = plan_requirements(plan)
+        if dry_run or not requirements:
+            return {'plan': plan, 'report': None}
+
+        with metrics.span('install', count=len(requirements), python=python or sys.executable) as record:
+            cache = WheelCache(wheel_cache_dir, wheel_cache_size) if wheel_cache_dir else None
+            if lock is not None:
+                report = install_lock([lock[parse_requirement(requirement)[0]] for requirement in requirements],
+                                      progress_callback, monitor=monitor, python=python, cache=cache)
+            elif install_workers > 0:
+                report = prefetch_and_install_graph(requirements, progress_callback, wheelhouse_dir,
+                                                    max(1, prefetch_workers), install_workers, monitor=monitor,
+                                                    python=python, cache=cache, installed_packages=installed)
+            elif prefetch_workers > 0 or wheel_cache_dir:
+                report = prefetch_and_install(requirements, progress_callback, wheelhouse_dir,
+                                              max(1, prefetch_workers), chunk_size, monitor=monitor, python=python,
+                                              cache=cache)
+            else:
+                report = install_packages(requirements, progress_callback, chunk_size, monitor=monitor, python=python)
+            record['failed'] = len(report['failed'])
+        return {'plan': plan, 'report': report}
+
+    @staticmethod
+    def restore_targets(packages, targets, progress_callback=print, jobs=None, dry_run=False):
+        """
+        Restore one package list into several interpreters concurrently and return the plan and
+        install report of each, keyed by interpreter.
+
+        `targets` is a dict of interpreter -> number of concurrent installs into
+        it (None: INSTALL_WORKERS, at least 1). Each target is diffed against its installed packages, then
+        the wheels all targets need are fetched once into a shared wheelhouse
+        (WHEELHOUSE_DIR, or a temporary one) with PREFETCH_WORKERS parallel
+        downloads, going through the WHEEL_CACHE_DIR cache when set. Up to `jobs`
+        targets then install their dependency graph from it at the same time.
+        """
+        plans = {}
+        for python in targets:
+            installed = PackageManager.get_local_pip_list(python)
+            plans[python] = (plan_restore(packages, installed), installed)
+            print_plan(plans[python][0], lambda message: progress_callback(f"{python or sys.executable}: {message}"),
+                       verbose=dry_run)
+        results = {python: {'plan': plan, 'report': None} for python, (plan, _) in plans.items()}
+        pending = [python for python, (plan, _) in plans.items() if plan_requirements(plan)]
+        if dry_run or not pending:
+            return results
+
+        cache = WheelCache(wheel_cache_dir, wheel_cache_size) if wheel_cache_dir else None
+        with metrics.span('install', count=len(pending), method='targets') as record:
+            reports = prefetch_and_install_targets(
+                [{'python': python, 'requirements': plan_requirements(plans[python][0]),
+                  'installed_packages': plans[python][1], 'workers': targets[python] or max(1, install_workers),
+                  'progress_callback': lambda message, label=python or sys.executable:
+                      progress_callback(f"{label}: {message}")}
+                 for python in pending],
+                progress_callback, wheelhouse_dir, max(1, prefetch_workers or 4), jobs, cache=cache)
+            record['failed'] = sum(len(report['failed']) for report in reports)
+        for python, report in zip(pending, reports):
+            results[python]['report'] = report
+        return results
+
+    @staticmethod
+    def download_pip(user, packages, progress_callback=print, chunk_size=None, dry_run=False, monitor=None,
+                     python=None):
+        """
+        Download and install the given `name==version` packages, see `restore()`.
+        """
+        if not packages:
+            print("No packages selected for download.")
+            return False
+
+        report = PackageManager.restore(packages, progress_callback, chunk_size, dry_run, monitor, python)['report']
+        if report is None:
+            if not dry_run:
+                progress_callback("All packages are already satisfied.")
+            return True
+        print_report(report, progress_callback)
+        return not report['failed'] and not report['cancelled']
+
+    @staticmethod
+    def download_all_packages(user, progress_callback=print, chunk_size=None, dry_run=False, monitor=None,
+                              python=None, profile=DEFAULT_PROFILE):
+        """
+        Download and install all packages from the stored pip list in Redis.
+
+        Lists longer than STREAM_BATCH_SIZE are streamed from Redis and restored
+        one batch at a time, so installs start after the first batch arrives and
+        memory use does not grow with the size of the profile.
+        """
+        total = count_packages(get_redis(), user.username, profile)
+        if not total:
+            print("No pip data found for the user.")
+            return False
+        if total <= stream_batch_size:
+            pip_list = PackageManager.get_stored_pip_list(user, profile)
+            return PackageManager.download_pip(user, pip_list, progress_callback, chunk_size, dry_run, monitor, python)
+
+        progress_callback(f"Restoring {total} packages in batches of {stream_batch_size}...")
+        if monitor:
+            monitor.begin(total)
+        report = empty_report()
+        for batch in PackageManager.iter_stored_pip_list(user, profile):
+            result = PackageManager.restore(batch, progress_callback, chunk_size, dry_run, monitor, python)
+            if monitor:
+                monitor.advance(len(batch) if dry_run else len(result['plan']['unchanged']))
+            if result['report'] is None:
+                continue
+            report['installed'].extend(result['report']['installed'])
+            report['failed'].extend(result['report']['failed'])
+            report['package_times'].update(result['report']['package_times'])
+            report['total_time'] += result['report']['total_time']
+            if result['report']['cancelled']:
+                report['cancelled'] = True
+                break
+
+        if dry_run:
+            return True
+        print_report(report, progress_callback)
+        return not report['failed'] and not report['cancelled']
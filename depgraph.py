@@ -0,0 +1,415 @@
+"""
+Dependency-graph-aware installs from a wheelhouse.
+
+Instead of handing pip a long requirement list to resolve, the wheels in the
+wheelhouse are read directly: their `Requires-Dist` metadata gives a
+dependency graph, which is installed in topological layers. Every package of
+a layer only depends on packages of earlier layers, so a layer is installed
+with concurrent `pip install --no-deps` runs and each
+dependency is installed exactly once.
+"""
+
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from installer import empty_report, fetch_wheels, normalize_name, packaging_module, parse_requirement, run_pip
+from wheelcache import parse_wheel_filename, supported_tags
+
+_MARKER_ENVIRONMENT_SCRIPT = (
+    "import json\n"
+    "try:\n"
+    "    from packaging.markers import default_environment\n"
+    "except ImportError:\n"
+    "    from pip._vendor.packaging.markers import default_environment\n"
+    "print(json.dumps(default_environment()))\n"
+)
+
+# interpreter -> PEP 508 marker environment
+_marker_environments = {}
+
+
+def marker_environment(python=None):
+    """
+    Return the environment markers (python_version, sys_platform, ...) of the `python` interpreter.
+    """
+    if python not in _marker_environments:
+        if python is None:
+            _marker_environments[python] = packaging_module('markers').default_environment()
+        else:
+            result = subprocess.run([python, '-c', _MARKER_ENVIRONMENT_SCRIPT], capture_output=True, text=True,
+                                    check=True)
+            _marker_environments[python] = json.loads(result.stdout)
+    return _marker_environments[python]
+
+
+def read_requires_dist(path):
+    """
+    Return the `Requires-Dist` lines of a wheel's METADATA file.
+    """
+    with zipfile.ZipFile(path) as wheel:
+        for member in wheel.namelist():
+            if member.count('/') == 1 and member.endswith('.dist-info/METADATA'):
+                metadata = wheel.read(member).decode('utf-8', errors='replace')
+                break
+        else:
+            return []
+
+    requires = []
+    for line in metadata.splitlines():
+        if not line.strip():
+            break
+        if line.startswith('Requires-Dist:'):
+            requires.append(line[len('Requires-Dist:'):].strip())
+    return requires
+
+
+def index_wheelhouse(wheelhouse, python=None):
+    """
+    Return a dict of normalized name -> [(version, path), ...] of the wheels in the
+    wheelhouse that the `python` interpreter can install, newest version first.
+    """
+    parse_version = packaging_module('version').parse
+    tags = supported_tags(python)
+    wheels = {}
+    for filename in os.listdir(wheelhouse):
+        parsed = parse_wheel_filename(filename)
+        if parsed and parsed[3] & tags:
+            wheels.setdefault(parsed[0], []).append((parsed[1], os.path.join(wheelhouse, filename)))
+    for candidates in wheels.values():
+        candidates.sort(key=lambda candidate: parse_version(candidate[0]), reverse=True)
+    return wheels
+
+
+def build_graph(requirements, wheelhouse, installed_packages=(), python=None):
+    """
+    Build the dependency graph of `name==version` requirements from the wheels in the wheelhouse.
+
+    The requested packages are always part of the graph. Their dependencies
+    are followed through `Requires-Dist` (evaluated for the `python`
+    interpreter, including requested extras) and added unless an installed
+    package already satisfies them. Returns a dict with the `wheels` to
+    install (name -> wheel path), the `requires` edges (name -> set of names
+    in the graph) and the `missing` requirements no wheel was found for
+    (name -> requirement).
+    """
+    packaging_requirements = packaging_module('requirements')
+    available = index_wheelhouse(wheelhouse, python)
+    environment = dict(marker_environment(python))
+
+    installed = {}
+    for line in installed_packages:
+        name, version = parse_requirement(line)
+        if name:
+            installed[name] = version
+
+    graph = {'wheels': {}, 'requires': {}, 'missing': {}}
+    specifiers = {}
+    extras = {}
+    pending = []
+
+    def add(name, specifier, requested_extras, requirement):
+        if name in graph['missing']:
+            return
+        specifiers.setdefault(name, []).append(specifier)
+        chosen = graph['wheels'].get(name)
+        if chosen and specifier.contains(parse_wheel_filename(os.path.basename(chosen))[1], prereleases=True):
+            if not requested_extras <= extras[name]:
+                extras[name] |= requested_extras
+                pending.append(name)
+            return
+
+        # Pick the newest wheel allowed by every requirement on the package seen so far.
+        for version, path in available.get(name, ()):
+            if all(allowed.contains(version, prereleases=True) for allowed in specifiers[name]):
+                graph['wheels'][name] = path
+                graph['requires'][name] = set()
+                extras[name] = extras.get(name, set()) | requested_extras
+                pending.append(name)
+                return
+        graph['wheels'].pop(name, None)
+        graph['requires'].pop(name, None)
+        graph['missing'][name] = requirement
+
+    for line in requirements:
+        try:
+            requirement = packaging_requirements.Requirement(line)
+        except packaging_requirements.InvalidRequirement:
+            graph['missing'][parse_requirement(line)[0] or line] = line
+            continue
+        add(normalize_name(requirement.name), requirement.specifier, set(requirement.extras), line)
+    requested = set(graph['wheels']) | set(graph['missing'])
+
+    while pending:
+        name = pending.pop()
+        if name not in graph['wheels']:
+            continue
+        for line in read_requires_dist(graph['wheels'][name]):
+            try:
+                dependency = packaging_requirements.Requirement(line)
+            except packaging_requirements.InvalidRequirement:
+                continue
+            if dependency.marker and not any(
+                    dependency.marker.evaluate(dict(environment, extra=extra)) for extra in {''} | extras[name]):
+                continue
+
+            dependency_name = normalize_name(dependency.name)
+            if dependency_name == name:
+                continue
+            if dependency_name not in requested:
+                current = installed.get(dependency_name)
+                if dependency_name not in graph['wheels'] and current is not None and \
+                        dependency.specifier.contains(current, prereleases=True):
+                    continue
+                dependency.marker = None
+                add(dependency_name, dependency.specifier, set(dependency.extras), str(dependency))
+            graph['requires'][name].add(dependency_name)
+    return graph
+
+
+def topological_layers(requires):
+    """
+    Split a dependency graph (name -> set of dependency names) into install layers.
+
+    Each layer only depends on earlier layers. Dependencies outside the graph
+    are ignored, and the packages of a dependency cycle end up together in
+    the last layer, since `--no-deps` installs do not care about their order.
+    """
+    remaining = {name: set(dependencies) & set(requires) for name, dependencies in requires.items()}
+    layers = []
+    while remaining:
+        layer = sorted(name for name, dependencies in remaining.items() if not dependencies)
+        if not layer:
+            layers.append(sorted(remaining))
+            break
+        layers.append(layer)
+        for name in layer:
+            del remaining[name]
+        for dependencies in remaining.values():
+            dependencies.difference_update(layer)
+    return layers
+
+
+def install_graph(graph, progress_callback=print, workers=4, monitor=None, python=None):
+    """
+    Install a graph from `build_graph()` layer by layer, splitting each layer between
+    up to `workers` concurrent pip runs.
+
+    Packages whose dependencies are missing or failed to install are not
+    installed and reported as failed. Returns the same report as
+    `installer.install_packages`, plus the number of `layers`.
+    """
+    report = empty_report()
+    layers = topological_layers(graph['requires'])
+    report['layers'] = len(layers)
+    if monitor:
+        monitor.begin(len(graph['wheels']) + len(graph['missing']))
+
+    failed = set(graph['missing'])
+    for name, requirement in graph['missing'].items():
+        progress_callback(f"No wheel found for {requirement}.")
+        report['failed'].append(requirement)
+    if monitor and failed:
+        monitor.advance(len(failed))
+
+    def install(batch):
+        """
+        Install a batch of wheels with one pip run, falling back to one run per wheel
+        when it fails. Returns (name, returncode, seconds) for each wheel.
+        """
+        batch_start = time.perf_counter()
+        returncode = run_pip('install', [graph['wheels'][name] for name in batch], ['--no-deps', '--no-index'],
+                             quiet=monitor is None, monitor=monitor, python=python)
+        seconds = (time.perf_counter() - batch_start) / len(batch)
+        if returncode == 0 or len(batch) == 1:
+            return [(name, returncode, seconds) for name in batch]
+        return [result for name in batch for result in install([name])]
+
+    start = time.perf_counter()
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for number, layer in enumerate(layers, 1):
+            if monitor and monitor.cancelled:
+                report['cancelled'] = True
+                break
+
+            blocked = [name for name in layer if graph['requires'][name] & failed]
+            for name in blocked:
+                progress_callback(f"Skipping {name}, a dependency failed to install.")
+                failed.add(name)
+                report['failed'].append(requirement_of(graph, name))
+            if monitor and blocked:
+                monitor.advance(len(blocked))
+
+            layer = [name for name in layer if name not in failed]
+            if not layer:
+                continue
+            progress_callback(f"Installing layer {number}/{len(layers)} ({len(layer)} packages)...")
+            # Starting pip costs more than installing a small wheel, so each worker gets a share of the layer.
+            batches = [layer[index::workers] for index in range(min(workers, len(layer)))]
+            for results in executor.map(install, batches):
+                for name, returncode, seconds in results:
+                    requirement = requirement_of(graph, name)
+                    report['package_times'][requirement] = seconds
+                    if returncode == 0:
+                        report['installed'].append(requirement)
+                    else:
+                        progress_callback(f"Failed to install {requirement}.")
+                        failed.add(name)
+                        report['failed'].append(requirement)
+                    if monitor:
+                        monitor.advance(1)
+
+    if monitor and monitor.cancelled:
+        report['cancelled'] = True
+    report['total_time'] = time.perf_counter() - start
+    return report
+
+
+def requirement_of(graph, name):
+    """
+    Return the `name==version` pin of a package of the graph, read from its wheel file name.
+    """
+    return f"{name}=={parse_wheel_filename(os.path.basename(graph['wheels'][name]))[1]}"
+
+
+def fetch_missing(build, attempted, wheelhouse, progress_callback=print, workers=4, index_args=None, monitor=None,
+                  python=None, cache=None):
+    """
+    Fetch the dependencies the graphs returned by `build()` are missing, and rebuild them, until none are left.
+
+    Cached wheels come without their dependencies, so a graph built right after
+    fetching can still miss some. Requirements in `attempted` (a set, updated
+    in place) are not fetched again. Returns the last graphs built.
+    """
+    graphs = build()
+    while not (monitor and monitor.cancelled):
+        missing = sorted({requirement for graph in graphs for requirement in graph['missing'].values()
+                          if requirement not in attempted})
+        if not missing:
+            break
+        attempted.update(missing)
+        progress_callback(f"Fetching {len(missing)} missing dependencies...")
+        fetch_wheels(missing, wheelhouse, progress_callback, workers, index_args, monitor, python, cache)
+        graphs = build()
+    return graphs
+
+
+def prefetch_and_install_graph(packages, progress_callback=print, wheelhouse=None, workers=4, install_workers=4,
+                               index_args=None, monitor=None, python=None, cache=None, installed_packages=()):
+    """
+    Restore packages by fetching all wheels first and installing their dependency graph.
+
+    Wheels are fetched like `installer.prefetch_and_install` does (from the
+    `WheelCache` or with `workers` parallel `pip wheel` runs), then the graph
+    is built from the wheelhouse and installed with `install_graph()` using
+    `install_workers` concurrent installs per layer. Dependencies already
+    satisfied by `installed_packages` are left alone.
+    """
+    packages = [package for package in packages if package]
+    report = empty_report()
+    if not packages:
+        return report
+
+    with contextlib.ExitStack() as stack:
+        if wheelhouse is None:
+            wheelhouse = stack.enter_context(tempfile.TemporaryDirectory(prefix='wheelhouse-'))
+        os.makedirs(wheelhouse, exist_ok=True)
+
+        start = time.perf_counter()
+        fetched = []
+        fetch_failed = []
+
+        def collect(package, ok):
+            (fetched if ok else fetch_failed).append(package)
+
+        progress_callback(f"Fetching wheels for {len(packages)} packages...")
+        fetch_wheels(packages, wheelhouse, progress_callback, workers, index_args, monitor, python, cache, collect)
+
+        if monitor and monitor.cancelled:
+            report['cancelled'] = True
+            report['failed'] = fetch_failed
+        else:
+            graph, = fetch_missing(lambda: [build_graph(fetched, wheelhouse, installed_packages, python)],
+                                   set(packages), wheelhouse, progress_callback, workers, index_args, monitor, python,
+                                   cache)
+            dependencies = set(graph['wheels']) - {parse_requirement(package)[0] for package in fetched}
+            progress_callback(f"Installing {len(graph['wheels'])} packages ({len(dependencies)} dependencies)...")
+            report = install_graph(graph, progress_callback, install_workers, monitor, python)
+            report['failed'] = fetch_failed + report['failed']
+            if monitor and fetch_failed:
+                monitor.total += len(fetch_failed)
+                monitor.advance(len(fetch_failed))
+
+        if cache is not None:
+            cache.add_directory(wheelhouse)
+            cache.save()
+            report['cache'] = cache.summary()
+
+    report['total_time'] = time.perf_counter() - start
+    return report
+
+
+def prefetch_and_install_targets(targets, progress_callback=print, wheelhouse=None, workers=4, jobs=None,
+                                 index_args=None, cache=None):
+    """
+    Install into several interpreters at once from one shared wheelhouse.
+
+    `targets` is a list of dicts with the target's `python`, the
+    `requirements` to install, its `installed_packages`, the number of
+    concurrent installs per layer (`workers`) and an optional
+    `progress_callback`. Targets are grouped by the wheel tags their
+    interpreter supports and the wheels of each group are fetched once, with
+    `workers` parallel `pip wheel` runs; wheels already in the wheelhouse
+    (e.g. pure-Python wheels fetched for another group) are not fetched again.
+    Then every target's dependency graph is installed with `install_graph()`,
+    up to `jobs` targets at a time. Returns the `install_graph()` report of
+    each target, in order.
+    """
+    with contextlib.ExitStack() as stack:
+        if wheelhouse is None:
+            wheelhouse = stack.enter_context(tempfile.TemporaryDirectory(prefix='wheelhouse-'))
+        os.makedirs(wheelhouse, exist_ok=True)
+
+        groups = {}
+        for target in targets:
+            groups.setdefault(frozenset(supported_tags(target['python'])), []).append(target)
+
+        graphs = {}
+        for group in groups.values():
+            python = group[0]['python']
+            available = index_wheelhouse(wheelhouse, python)
+            missing = sorted({requirement for target in group for requirement in target['requirements']
+                              if not _has_wheel(available, requirement)})
+            if missing:
+                progress_callback(f"Fetching {len(missing)} wheels for {python or sys.executable}...")
+                fetch_wheels(missing, wheelhouse, progress_callback, workers, index_args, python=python, cache=cache)
+            built = fetch_missing(
+                lambda: [build_graph(target['requirements'], wheelhouse, target['installed_packages'], python)
+                         for target in group],
+                set(missing), wheelhouse, progress_callback, workers, index_args, python=python, cache=cache)
+            for target, graph in zip(group, built):
+                graphs[id(target)] = graph
+
+        def install(target):
+            callback = target.get('progress_callback') or progress_callback
+            return install_graph(graphs[id(target)], callback, target['workers'], python=target['python'])
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs or len(targets))) as executor:
+            reports = list(executor.map(install, targets))
+
+        if cache is not None:
+            cache.add_directory(wheelhouse)
+            cache.save()
+    return reports
+
+
+def _has_wheel(available, requirement):
+    name, version = parse_requirement(requirement)
+    return any(candidate == version for candidate, _ in available.get(name, ()))
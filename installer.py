@@ -0,0 +1,463 @@
+import contextlib
+import importlib
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metrics import span
+
+
+class InstallMonitor:
+    """
+    Follow and cancel a running install from another thread.
+
+    `output_callback(line)` receives every line pip prints and
+    `step_callback(done, total)` is called as packages complete. `cancel()`
+    terminates the running pip processes and keeps new ones from starting.
+    """
+
+    def __init__(self, output_callback=None, step_callback=None):
+        self.output_callback = output_callback
+        self.step_callback = step_callback
+        self.cancelled = False
+        self.done = 0
+        self.total = None
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def begin(self, total):
+        if self.total is None:
+            self.total = total
+            self.advance(0)
+
+    def advance(self, count):
+        self.done += count
+        if self.step_callback:
+            self.step_callback(self.done, self.total)
+
+    def output(self, line):
+        if self.output_callback:
+            self.output_callback(line)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            for process in self._processes:
+                process.terminate()
+
+    def register(self, process):
+        with self._lock:
+            if self.cancelled:
+                process.terminate()
+            self._processes.add(process)
+
+    def unregister(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+
+def run_pip(pip_command, requirements, extra_args=None, quiet=False, monitor=None, python=None):
+    """
+    Run a single pip command for the given requirements and return its exit code.
+
+    pip runs under `python` (default: the current interpreter), so packages can
+    be installed into another interpreter or virtual environment.
+
+    With a monitor, pip's output is streamed line by line to the monitor and
+    the process can be terminated through `monitor.cancel()`. Each run is
+    recorded as a `pip_<command>` metrics span with its packages and exit status.
+    """
+    command = [python or sys.executable, '-m', 'pip', pip_command]
+    if extra_args:
+        command.extend(extra_args)
+    command.extend(requirements)
+
+    packages = [wheel_requirement(requirement) if requirement.endswith('.whl') else requirement
+                for requirement in requirements]
+    with span(f"pip_{pip_command}", packages=packages, python=python or sys.executable) as record:
+        wheels = [requirement for requirement in requirements if requirement.endswith('.whl')]
+        if wheels:
+            record['bytes'] = sum(os.path.getsize(wheel) for wheel in wheels if os.path.exists(wheel))
+        returncode = _run_process(command, quiet, monitor)
+        record['exit_status'] = returncode
+        if returncode != 0:
+            record['status'] = 'failed'
+        return returncode
+
+
+def _run_process(command, quiet, monitor):
+    if monitor is None:
+        if quiet:
+            return subprocess.call(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return subprocess.call(command)
+
+    if monitor.cancelled:
+        return -1
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.DEVNULL if quiet else subprocess.PIPE,
+        stderr=subprocess.DEVNULL if quiet else subprocess.STDOUT,
+        text=True
+    )
+    monitor.register(process)
+    try:
+        if not quiet:
+            for line in process.stdout:
+                monitor.output(line.rstrip())
+        return process.wait()
+    finally:
+        monitor.unregister(process)
+
+
+def wheel_requirement(path):
+    """
+    Return the `name==version` pin of a wheel file path.
+    """
+    parts = os.path.basename(path).split('-')
+    return f"{normalize_name(parts[0])}=={parts[1]}" if len(parts) > 1 else path
+
+
+def run_pip_install(requirements, extra_args=None, monitor=None, python=None):
+    """
+    Run a single `pip install` for the given requirements and return its exit code.
+    """
+    return run_pip('install', requirements, extra_args, monitor=monitor, python=python)
+
+
+def normalize_name(name):
+    """
+    Normalize a distribution name the way pip compares them (PEP 503).
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def parse_requirement(line):
+    """
+    Split a stored `name==version` line into its normalized name and version.
+
+    The version is None for lines without a pin.
+    """
+    package_info = line.strip().split('==')
+    if not package_info[0]:
+        return None, None
+    version = package_info[1].strip() if len(package_info) > 1 else None
+    return normalize_name(package_info[0].strip()), version or None
+
+
+def packaging_module(name):
+    """
+    Import a submodule of `packaging`, or of the copy vendored by pip when `packaging` is not installed.
+    """
+    try:
+        return importlib.import_module(f"packaging.{name}")
+    except ImportError:
+        return importlib.import_module(f"pip._vendor.packaging.{name}")
+
+
+def plan_restore(stored_packages, installed_packages):
+    """
+    Diff a stored pip list against the installed packages.
+
+    Both arguments are iterables of `name==version` lines. Returns a dict with
+    the `install`, `upgrade`, `downgrade` and `unchanged` requirements; only
+    the first three need to be handed to pip. Unpinned stored entries count as
+    unchanged when the package is installed at any version. Versions that are
+    not PEP 440 compliant are always handed to pip as upgrades.
+    """
+    version_module = packaging_module('version')
+
+    def parse_version(version):
+        try:
+            return version_module.Version(version)
+        except version_module.InvalidVersion:
+            return None
+
+    installed = {}
+    for line in installed_packages:
+        name, version = parse_requirement(line)
+        if name:
+            installed[name] = version
+
+    plan = {'install': [], 'upgrade': [], 'downgrade': [], 'unchanged': []}
+    for line in stored_packages:
+        name, version = parse_requirement(line)
+        if not name:
+            continue
+        requirement = f"{name}=={version}" if version else name
+        current = installed.get(name)
+        if current is None:
+            plan['install'].append(requirement)
+        elif version is None or current == version:
+            plan['unchanged'].append(requirement)
+        else:
+            new, old = parse_version(version), parse_version(current)
+            if new is None or old is None or new > old:
+                plan['upgrade'].append(requirement)
+            elif new < old:
+                plan['downgrade'].append(requirement)
+            else:
+                plan['unchanged'].append(requirement)
+    return plan
+
+
+def plan_requirements(plan):
+    """
+    Return the requirements of a restore plan that still have to be installed.
+    """
+    return plan['install'] + plan['upgrade'] + plan['downgrade']
+
+
+def print_plan(plan, progress_callback=print, verbose=False):
+    """
+    Print the install / upgrade / downgrade / unchanged counts of a restore plan.
+    """
+    if verbose:
+        for action in ('install', 'upgrade', 'downgrade'):
+            for requirement in plan[action]:
+                progress_callback(f"  {action}: {requirement}")
+    progress_callback(
+        f"Restore plan: {len(plan['install'])} to install, {len(plan['upgrade'])} to upgrade, "
+        f"{len(plan['downgrade'])} to downgrade, {len(plan['unchanged'])} unchanged."
+    )
+
+
+def empty_report():
+    """
+    Return an install report before any package was handled.
+    """
+    return {'installed': [], 'failed': [], 'total_time': 0.0, 'package_times': {}, 'cancelled': False}
+
+
+def install_packages(packages, progress_callback=print, chunk_size=None, extra_args=None, monitor=None,
+                     python=None):
+    """
+    Install packages with one pip resolver run per chunk instead of one per package.
+
+    When a chunk fails, only the packages of that chunk are retried one by one,
+    so a single broken requirement does not keep the rest from installing.
+    Returns a report with the installed and failed packages, the total time and
+    the time spent on each package; `cancelled` is set when the monitor was
+    cancelled before all packages were handled.
+    """
+    packages = [package for package in packages if package]
+    report = empty_report()
+    if not packages:
+        return report
+
+    if not chunk_size or chunk_size <= 0:
+        chunk_size = len(packages)
+    if monitor:
+        monitor.begin(len(packages))
+
+    start = time.perf_counter()
+    for index in range(0, len(packages), chunk_size):
+        if monitor and monitor.cancelled:
+            report['cancelled'] = True
+            break
+        chunk = packages[index:index + chunk_size]
+        progress_callback(f"Installing {len(chunk)} packages ({index + len(chunk)}/{len(packages)})...")
+
+        chunk_start = time.perf_counter()
+        returncode = run_pip_install(chunk, extra_args, monitor, python)
+        chunk_time = time.perf_counter() - chunk_start
+
+        if returncode == 0:
+            for package in chunk:
+                report['installed'].append(package)
+                report['package_times'][package] = chunk_time / len(chunk)
+            if monitor:
+                monitor.advance(len(chunk))
+            continue
+
+        if len(chunk) == 1:
+            report['failed'].append(chunk[0])
+            report['package_times'][chunk[0]] = chunk_time
+            progress_callback(f"Failed to install {chunk[0]}.")
+            if monitor:
+                monitor.advance(1)
+            continue
+
+        progress_callback(f"Batch install failed, retrying {len(chunk)} packages one by one...")
+        for package in chunk:
+            if monitor and monitor.cancelled:
+                report['cancelled'] = True
+                break
+            progress_callback(f"Downloading and installing {package}...")
+            package_start = time.perf_counter()
+            returncode = run_pip_install([package], extra_args, monitor, python)
+            report['package_times'][package] = time.perf_counter() - package_start
+            if returncode == 0:
+                report['installed'].append(package)
+                progress_callback(f"{package} has been downloaded and installed.")
+            else:
+                report['failed'].append(package)
+                progress_callback(f"Failed to install {package}.")
+            if monitor:
+                monitor.advance(1)
+
+    report['total_time'] = time.perf_counter() - start
+    return report
+
+
+def build_wheel(package, wheelhouse, index_args=None, monitor=None, python=None):
+    """
+    Download or build the wheels of a package and its dependencies into the wheelhouse.
+    """
+    extra_args = ['--wheel-dir', wheelhouse]
+    if index_args:
+        extra_args.extend(index_args)
+    return run_pip('wheel', [package], extra_args, quiet=True, monitor=monitor, python=python)
+
+
+def fetch_wheels(packages, wheelhouse, progress_callback=print, workers=4, index_args=None, monitor=None,
+                 python=None, cache=None, fetched_callback=None):
+    """
+    Fill the wheelhouse with the wheels of the given packages and their dependencies.
+
+    Pinned packages found in the `WheelCache` are copied from it; the others
+    are fetched by a pool of `workers` threads running `pip wheel`.
+    `fetched_callback(package, ok)` is called from this thread as each package
+    is handled, so the caller can start installing while downloads continue.
+    Packages are skipped once the monitor is cancelled.
+    """
+    cached = []
+    downloads = []
+    for package in packages:
+        if cache is not None and cache.fetch(package, wheelhouse, python):
+            progress_callback(f"Using cached wheel for {package}.")
+            cached.append(package)
+        else:
+            downloads.append(package)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(build_wheel, package, wheelhouse, index_args, monitor, python): package
+            for package in downloads
+        }
+        if fetched_callback:
+            for package in cached:
+                fetched_callback(package, True)
+        for done, future in enumerate(as_completed(futures), 1):
+            package = futures[future]
+            if monitor and monitor.cancelled:
+                continue
+            if future.result() == 0:
+                progress_callback(f"Fetched {package} ({done}/{len(downloads)}).")
+            else:
+                progress_callback(f"Failed to fetch {package}.")
+            if fetched_callback:
+                fetched_callback(package, future.result() == 0)
+
+
+def prefetch_and_install(packages, progress_callback=print, wheelhouse=None, workers=4,
+                         chunk_size=None, index_args=None, monitor=None, python=None, cache=None):
+    """
+    Restore packages with a two-stage pipeline.
+
+    A pool of `workers` threads runs `pip wheel` for each package into the
+    wheelhouse directory while the install stage installs the finished wheels,
+    `chunk_size` packages at a time, with `--no-index --find-links wheelhouse`.
+    `index_args` are passed to the download stage only, e.g.
+    `['--no-index', '--find-links', '/path/to/sdists']` to restore offline.
+
+    With a `WheelCache`, pinned packages found in the cache are copied into the
+    wheelhouse instead of being downloaded, and every wheel of the wheelhouse is
+    added to the cache afterwards. Packages that fail to install before all
+    downloads are done (e.g. a cached wheel whose dependency is still being
+    fetched) are retried once at the end, after `pip wheel` has fetched their
+    dependencies.
+    Returns the same report as `install_packages`, plus the cache `summary()`
+    under `cache` when a cache is used.
+    """
+    packages = [package for package in packages if package]
+    report = empty_report()
+    if not packages:
+        return report
+
+    if monitor:
+        monitor.begin(len(packages))
+    with contextlib.ExitStack() as stack:
+        if wheelhouse is None:
+            wheelhouse = stack.enter_context(tempfile.TemporaryDirectory(prefix='wheelhouse-'))
+        os.makedirs(wheelhouse, exist_ok=True)
+        if not chunk_size or chunk_size <= 0:
+            chunk_size = max(1, len(packages) // 10)
+        install_args = ['--no-index', '--find-links', wheelhouse]
+
+        deferred = []
+
+        def install_ready(ready, final=False):
+            chunk_report = install_packages(ready, progress_callback, extra_args=install_args, monitor=monitor,
+                                            python=python)
+            report['installed'].extend(chunk_report['installed'])
+            if final:
+                report['failed'].extend(chunk_report['failed'])
+            else:
+                deferred.extend(chunk_report['failed'])
+            report['package_times'].update(chunk_report['package_times'])
+            report['cancelled'] = report['cancelled'] or chunk_report['cancelled']
+
+        start = time.perf_counter()
+        ready = []
+
+        def fetched(package, ok):
+            nonlocal ready
+            if not ok:
+                report['failed'].append(package)
+                if monitor:
+                    monitor.advance(1)
+                return
+            ready.append(package)
+            if len(ready) >= chunk_size:
+                install_ready(ready)
+                ready = []
+
+        fetch_wheels(packages, wheelhouse, progress_callback, workers, index_args, monitor, python, cache, fetched)
+        if monitor and monitor.cancelled:
+            report['cancelled'] = True
+        if ready and not report['cancelled']:
+            install_ready(ready)
+
+        if deferred:
+            if report['cancelled']:
+                report['failed'].extend(deferred)
+            else:
+                # A wheel copied from the cache comes without its dependencies, which may be in no other request.
+                progress_callback(f"Fetching the dependencies of {len(deferred)} packages that failed to install...")
+                fetch_wheels(deferred, wheelhouse, progress_callback, workers,
+                             list(index_args or []) + ['--find-links', wheelhouse], monitor, python)
+                progress_callback(f"Retrying {len(deferred)} packages now that all wheels are fetched...")
+                if monitor:
+                    monitor.done -= len(deferred)
+                install_ready(deferred, final=True)
+
+        if cache is not None:
+            cache.add_directory(wheelhouse)
+            cache.save()
+            report['cache'] = cache.summary()
+
+    report['total_time'] = time.perf_counter() - start
+    return report
+
+
+def print_report(report, progress_callback=print):
+    """
+    Print the total time and the per-package time of an install report.
+    """
+    for package, seconds in sorted(report['package_times'].items(), key=lambda item: item[1], reverse=True):
+        progress_callback(f"  {package}: {seconds:.2f}s")
+    progress_callback(
+        f"Installed {len(report['installed'])} packages, {len(report['failed'])} failed "
+        f"in {report['total_time']:.2f}s."
+    )
+    if 'cache' in report:
+        cache = report['cache']
+        progress_callback(
+            f"Wheel cache: {cache['hit_rate']:.0%} hit rate, {cache['bytes_saved'] / 1024 ** 2:.1f} MB saved, "
+            f"{cache['wheels']} wheels ({cache['bytes'] / 1024 ** 2:.1f} MB) stored."
+        )
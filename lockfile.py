@@ -0,0 +1,350 @@
+"""
+Lockfile-grade records of installed packages.
+
+For every installed distribution the lock keeps its version, the
+python-abi-platform tags of the wheel it was installed from, the wheel's
+sha256 when it is known and the sha256 of its RECORD file, plus the source
+URL from `direct_url.json` and an environment marker for platform-specific
+wheels. Locks are written as `requirements.lock` files that pip reads
+directly:
+
+    name==version ; marker --hash=sha256:<wheel hash>  # tags=... record=sha256:... url=...
+
+and restored with `pip install --no-deps --require-hashes`, without any
+dependency resolution.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+from depgraph import marker_environment
+from installer import empty_report, normalize_name, packaging_module, parse_requirement, run_pip
+from scanner import scan_environment
+
+LOCK_FILENAME = 'requirements.lock'
+
+_COMMENT = re.compile(r'(^|\s+)#.*$')
+
+
+def _read_text(path):
+    try:
+        with open(path, encoding='utf-8') as text:
+            return text.read()
+    except OSError:
+        return None
+
+
+def wheel_hash(direct_url):
+    """
+    Return the sha256 of the archive a distribution was installed from, as recorded in `direct_url.json`.
+    """
+    archive = direct_url.get('archive_info', {})
+    if 'sha256' in archive.get('hashes', {}):
+        return archive['hashes']['sha256']
+    if archive.get('hash', '').startswith('sha256='):
+        return archive['hash'][len('sha256='):]
+    return None
+
+
+def platform_marker(tags, environment):
+    """
+    Return the marker limiting a wheel to the interpreter and platform it was built for,
+    or None for pure-Python `none-any` wheels.
+    """
+    if not tags or any(tag.endswith('-none-any') for tag in tags):
+        return None
+    return (f'python_version == "{environment["python_version"]}" and '
+            f'sys_platform == "{environment["sys_platform"]}" and '
+            f'platform_machine == "{environment["platform_machine"]}"')
+
+
+def read_entry(dist_info, environment, cache=None, python=None):
+    """
+    Return the lock entry of an installed `*.dist-info` directory, or None when it has no usable metadata.
+    """
+    name, _, version = os.path.basename(dist_info)[:-len('.dist-info')].partition('-')
+    if not name or not version:
+        return None
+
+    entry = {'name': normalize_name(name), 'version': version, 'tags': [], 'sha256': None,
+             'record_sha256': None, 'url': None, 'marker': None}
+    wheel = _read_text(os.path.join(dist_info, 'WHEEL'))
+    if wheel:
+        entry['tags'] = [line[4:].strip() for line in wheel.splitlines() if line.startswith('Tag:')]
+    record = _read_text(os.path.join(dist_info, 'RECORD'))
+    if record is not None:
+        entry['record_sha256'] = hashlib.sha256(record.encode()).hexdigest()
+
+    direct_url = _read_text(os.path.join(dist_info, 'direct_url.json'))
+    if direct_url:
+        try:
+            direct_url = json.loads(direct_url)
+        except ValueError:
+            direct_url = {}
+        # A `file:` URL points into a wheelhouse that is usually gone by now, and is useless on other machines.
+        if not direct_url.get('url', 'file:').startswith('file:'):
+            entry['url'] = direct_url['url']
+        entry['sha256'] = wheel_hash(direct_url)
+    if entry['sha256'] is None and cache is not None:
+        cached = cache.lookup(f"{entry['name']}=={version}", python)
+        if cached:
+            entry['sha256'] = cached['sha256']
+
+    entry['marker'] = platform_marker(entry['tags'], environment)
+    return entry
+
+
+def capture_lock(paths, cache=None, python=None):
+    """
+    Return the lock entries of the distributions installed on `paths` (the `sys.path`
+    of the `python` interpreter), sorted by name.
+
+    Wheel hashes come from `direct_url.json` or, for packages installed from an
+    index, from the `WheelCache` when it holds the wheel; `install_lock()`
+    finds such wheels in the cache again. Distributions
+    installed from an egg-info directory are locked without tags or hashes.
+    """
+    environment = marker_environment(python)
+    entries = {}
+    for path in paths:
+        path = os.path.abspath(path or os.curdir)
+        try:
+            with os.scandir(path) as directory:
+                found = sorted(directory, key=lambda item: item.name)
+        except OSError:
+            continue
+        for item in found:
+            if item.name.endswith('.dist-info'):
+                entry = read_entry(item.path, environment, cache, python)
+                if entry:
+                    entries.setdefault(entry['name'], entry)
+
+    for line in scan_environment(paths):
+        name, version = parse_requirement(line)
+        if name not in entries:
+            entries[name] = bare_entry(name, version)
+    return [entries[name] for name in sorted(entries)]
+
+
+def capture_entries(distributions, cache=None, python=None):
+    """
+    Return the lock entries of some installed distributions, given as a dict of
+    name -> (version, path of their `*.dist-info` or `*.egg-info` entry).
+    """
+    environment = marker_environment(python)
+    entries = []
+    for name, (version, path) in sorted(distributions.items()):
+        entry = read_entry(path, environment, cache, python) if path.endswith('.dist-info') else None
+        entries.append(entry or bare_entry(name, version))
+    return entries
+
+
+def bare_entry(name, version):
+    """
+    Return the lock entry of a distribution without wheel metadata, e.g. one installed from an egg-info directory.
+    """
+    return {'name': name, 'version': version or '', 'tags': [], 'sha256': None, 'record_sha256': None, 'url': None,
+            'marker': None}
+
+
+def requirement(entry):
+    """
+    Return the `name==version` pin of a lock entry.
+    """
+    return f"{entry['name']}=={entry['version']}" if entry['version'] else entry['name']
+
+
+def format_entry(entry):
+    """
+    Return the `requirements.lock` line of a lock entry.
+    """
+    line = requirement(entry)
+    if entry.get('marker'):
+        line += f" ; {entry['marker']}"
+    if entry.get('sha256'):
+        line += f" --hash=sha256:{entry['sha256']}"
+
+    details = []
+    if entry.get('tags'):
+        details.append(f"tags={','.join(entry['tags'])}")
+    if entry.get('record_sha256'):
+        details.append(f"record=sha256:{entry['record_sha256']}")
+    if entry.get('url'):
+        details.append(f"url={entry['url']}")
+    if details:
+        line += f"  # {' '.join(details)}"
+    return line
+
+
+def parse_entry(line):
+    """
+    Parse a `requirements.lock` or requirements file line back into a lock entry.
+
+    Returns None for blank, comment and option lines (`-r`, `--index-url`, ...).
+    Only `==` pins keep their version; requirements with any other specifier
+    or a direct URL become unpinned entries. Raises ValueError for lines that
+    are not valid requirements.
+    """
+    details = {}
+    match = _COMMENT.search(line)
+    if match:
+        for field in match.group(0).lstrip().lstrip('#').split():
+            key, _, value = field.partition('=')
+            details[key] = value
+        line = line[:match.start()]
+    line = line.strip()
+    if not line or line.startswith('-'):
+        return None
+
+    hashes = re.findall(r'--hash=sha256:([0-9a-fA-F]+)', line)
+    spec = re.sub(r'\s*--hash=\S+', '', line)
+    requirements = packaging_module('requirements')
+    try:
+        parsed = requirements.Requirement(spec)
+    except requirements.InvalidRequirement as e:
+        raise ValueError(f"Invalid requirement {line!r}: {e}")
+
+    pins = list(parsed.specifier)
+    version = pins[0].version if len(pins) == 1 and pins[0].operator == '==' and '*' not in pins[0].version else ''
+    return {
+        'name': normalize_name(parsed.name),
+        'version': version,
+        'tags': details['tags'].split(',') if details.get('tags') else [],
+        'sha256': hashes[0] if hashes else None,
+        'record_sha256': details.get('record', '').partition('sha256:')[2] or None,
+        'url': details.get('url') or parsed.url,
+        'marker': str(parsed.marker) if parsed.marker else None,
+    }
+
+
+def write_lock(path, entries):
+    with open(path, 'w') as lock:
+        if all(entry.get('sha256') for entry in entries):
+            lock.write(f"# Install with: pip install --no-deps --require-hashes -r {os.path.basename(path)}\n")
+        else:
+            lock.write("# Some packages have no locked hash; install with: python app.py restore --lock-file "
+                       f"{os.path.basename(path)}\n")
+        for entry in entries:
+            lock.write(format_entry(entry) + '\n')
+
+
+def read_requirements(path):
+    """
+    Read a `requirements.lock` or requirements file. Returns its lock entries and the
+    option lines (`-r`, `--index-url`, ...) that were skipped.
+    """
+    entries = []
+    skipped = []
+    with open(path) as lock:
+        # pip-compile style files continue a requirement's `--hash` options on the next lines.
+        for line in re.sub(r'\\\n', ' ', lock.read()).splitlines():
+            entry = parse_entry(line)
+            if entry:
+                entries.append(entry)
+            elif line.strip().startswith('-'):
+                skipped.append(line.strip())
+    return entries, skipped
+
+
+def read_lock(path):
+    return read_requirements(path)[0]
+
+
+def applicable(entries, python=None):
+    """
+    Return the entries whose marker matches the `python` interpreter.
+    """
+    marker_class = packaging_module('markers').Marker
+    environment = marker_environment(python)
+    return [entry for entry in entries
+            if not entry.get('marker') or marker_class(entry['marker']).evaluate(environment)]
+
+
+def _install_lines(lines, hashed, extra_args, monitor, python):
+    descriptor, path = tempfile.mkstemp(prefix='pip-lock-', suffix='.txt')
+    try:
+        with os.fdopen(descriptor, 'w') as requirements:
+            requirements.write('\n'.join(lines) + '\n')
+        args = ['--no-deps'] + (['--require-hashes'] if hashed else []) + list(extra_args or []) + ['-r', path]
+        return run_pip('install', [], args, monitor=monitor, python=python)
+    finally:
+        os.remove(path)
+
+
+def install_lock(entries, progress_callback=print, extra_args=None, monitor=None, python=None, cache=None):
+    """
+    Install lock entries exactly as locked, without dependency resolution.
+
+    Entries with a wheel hash are installed in one `pip install --no-deps
+    --require-hashes` run, the others in one `--no-deps` run. A failed run is
+    retried entry by entry. A locked hash may belong to a wheel that was built
+    locally from an sdist, which no index serves, so the wheels of the `cache`
+    (a `WheelCache`) with a locked hash are copied into a temporary wheelhouse
+    that pip also searches with `--find-links`. Returns the same report as
+    `installer.install_packages`.
+    """
+    entries = [entry for entry in entries if entry['version']]
+    with contextlib.ExitStack() as stack:
+        if cache is not None and any(entry.get('sha256') for entry in entries):
+            wheelhouse = stack.enter_context(tempfile.TemporaryDirectory(prefix='wheelhouse-'))
+            cached = [entry for entry in entries
+                      if entry.get('sha256') and cache.fetch_hash(entry['sha256'], wheelhouse)]
+            if cached:
+                progress_callback(f"Using {len(cached)} cached wheels.")
+                extra_args = ['--find-links', wheelhouse] + list(extra_args or [])
+        report = _install_entries(entries, progress_callback, extra_args, monitor, python)
+    if cache is not None:
+        cache.save()
+        report['cache'] = cache.summary()
+    return report
+
+
+def _install_entries(entries, progress_callback, extra_args, monitor, python):
+    report = empty_report()
+    if monitor:
+        monitor.begin(len(entries))
+
+    start = time.perf_counter()
+    for hashed in (True, False):
+        group = [entry for entry in entries if bool(entry.get('sha256')) == hashed]
+        if not group:
+            continue
+        if monitor and monitor.cancelled:
+            report['cancelled'] = True
+            break
+        if hashed:
+            progress_callback(f"Installing {len(group)} hash-checked packages...")
+        else:
+            progress_callback(f"Installing {len(group)} packages without a locked hash...")
+
+        group_start = time.perf_counter()
+        lines = [format_entry(dict(entry, marker=None)) for entry in group]
+        if _install_lines(lines, hashed, extra_args, monitor, python) == 0:
+            for entry in group:
+                report['installed'].append(requirement(entry))
+                report['package_times'][requirement(entry)] = (time.perf_counter() - group_start) / len(group)
+            if monitor:
+                monitor.advance(len(group))
+            continue
+
+        for entry, line in zip(group, lines):
+            if monitor and monitor.cancelled:
+                report['cancelled'] = True
+                break
+            package_start = time.perf_counter()
+            returncode = _install_lines([line], hashed, extra_args, monitor, python)
+            report['package_times'][requirement(entry)] = time.perf_counter() - package_start
+            if returncode == 0:
+                report['installed'].append(requirement(entry))
+            else:
+                report['failed'].append(requirement(entry))
+                progress_callback(f"Failed to install {requirement(entry)}.")
+            if monitor:
+                monitor.advance(1)
+
+    report['total_time'] = time.perf_counter() - start
+    return report
@@ -0,0 +1,228 @@
+"""
+Timing spans for Redis calls, environment scans, bcrypt checks and pip runs.
+
+Every instrumented operation records a span with its phase, duration, status
+and attributes such as the bytes transferred or the packages involved. Spans
+are kept in memory until `finish()` prints a summary of the run (time per
+phase and the slowest packages). Two environment variables export them:
+
+    METRICS_LOG        append every span as one JSON object per line to this
+                       file, or to stderr with '-'
+    METRICS_TEXTFILE   write the per-phase and per-package totals in the
+                       Prometheus text format at the end of each run, e.g. for
+                       node_exporter's textfile collector (OpenMetrics when the
+                       file name ends in .om)
+"""
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+_spans = []
+_lock = threading.Lock()
+_log_file = None
+
+
+def payload_size(value):
+    """
+    Return the approximate number of bytes a Redis argument or reply takes on the wire.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, dict):
+        return sum(payload_size(key) + payload_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sum(payload_size(item) for item in value)
+    return len(str(value))
+
+
+@contextlib.contextmanager
+def span(phase, **attributes):
+    """
+    Time the enclosed block as a span of the given phase.
+
+    Yields the span's attribute dict, so the block can add e.g. `bytes` or
+    `status` once they are known. Exceptions mark the span as failed.
+    """
+    record = {'phase': phase, **attributes}
+    started = time.time()
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['status'] = 'error'
+        record['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record['start'] = started
+        record['duration'] = time.perf_counter() - start
+        record.setdefault('status', 'ok')
+        _record(record)
+
+
+def _record(record):
+    global _log_file
+    with _lock:
+        _spans.append(record)
+        destination = os.getenv("METRICS_LOG")
+        if not destination:
+            return
+        if destination == '-':
+            stream = sys.stderr
+        else:
+            if _log_file is None or _log_file.name != destination:
+                _log_file = open(destination, 'a')
+            stream = _log_file
+        stream.write(json.dumps(record, default=str) + '\n')
+        stream.flush()
+
+
+def instrument_redis(client):
+    """
+    Record a span for every command and pipeline the Redis client executes.
+    """
+    if getattr(client, '_metrics_instrumented', False):
+        return client
+
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def instrumented_execute_command(*args, **options):
+        with span('redis', command=str(args[0]).upper(), bytes_sent=payload_size(args)) as record:
+            reply = execute_command(*args, **options)
+            record['bytes_received'] = payload_size(reply)
+            return reply
+
+    def instrumented_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def instrumented_execute(*execute_args, **execute_kwargs):
+            commands = [command_args for command_args, _ in pipe.command_stack]
+            with span('redis', command='PIPELINE', commands=len(commands),
+                      bytes_sent=payload_size(commands)) as record:
+                replies = execute(*execute_args, **execute_kwargs)
+                record['bytes_received'] = payload_size(replies)
+                return replies
+
+        pipe.execute = instrumented_execute
+        return pipe
+
+    client.execute_command = instrumented_execute_command
+    client.pipeline = instrumented_pipeline
+    client._metrics_instrumented = True
+    return client
+
+
+def spans():
+    with _lock:
+        return list(_spans)
+
+
+def summary(limit=10):
+    """
+    Return the count, seconds, bytes and errors of each phase, and the `limit`
+    packages that took the longest to fetch or install.
+
+    The time of a pip run is split evenly between the packages it handled.
+    Phases run concurrently (e.g. parallel pip runs) add up their busy time.
+    """
+    phases = {}
+    packages = {}
+    for record in spans():
+        phase = phases.setdefault(record['phase'], {'count': 0, 'seconds': 0.0, 'bytes': 0, 'errors': 0})
+        phase['count'] += 1
+        phase['seconds'] += record['duration']
+        phase['bytes'] += record.get('bytes', 0) + record.get('bytes_sent', 0) + record.get('bytes_received', 0)
+        if record['status'] != 'ok':
+            phase['errors'] += 1
+        if record['phase'].startswith('pip') and record.get('packages'):
+            share = record['duration'] / len(record['packages'])
+            for package in record['packages']:
+                packages[package] = packages.get(package, 0.0) + share
+
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return {'phases': phases, 'packages': packages, 'slowest_packages': slowest}
+
+
+def print_summary(progress_callback=print, limit=10):
+    result = summary(limit)
+    if not result['phases']:
+        return
+    progress_callback("Time per phase:")
+    for phase, totals in sorted(result['phases'].items(), key=lambda item: item[1]['seconds'], reverse=True):
+        errors = f", {totals['errors']} failed" if totals['errors'] else ''
+        progress_callback(f"  {phase}: {totals['seconds']:.2f}s in {totals['count']} calls, "
+                          f"{totals['bytes'] / 1024:.1f} KB{errors}")
+    if result['slowest_packages']:
+        progress_callback("Slowest packages:")
+        for package, seconds in result['slowest_packages']:
+            progress_callback(f"  {package}: {seconds:.2f}s")
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_textfile(path, openmetrics=None):
+    """
+    Write the totals of `summary()` to a Prometheus text format (or OpenMetrics) file.
+
+    Each run replaces the file with its own totals, so they are exported as
+    gauges of the last run rather than as counters. The file is replaced
+    atomically, as the textfile collector may read it at any time.
+    """
+    if openmetrics is None:
+        openmetrics = path.endswith('.om')
+    result = summary()
+    lines = []
+
+    def gauge(name, help_text, values, label):
+        lines.append(f"# HELP pip_list_{name} {help_text}")
+        lines.append(f"# TYPE pip_list_{name} gauge")
+        for key, value in values:
+            lines.append(f'pip_list_{name}{{{label}="{_label(key)}"}} {value}')
+
+    phases = sorted(result['phases'].items())
+    gauge('phase_seconds', "Time spent in each phase during the last run.",
+          [(phase, totals['seconds']) for phase, totals in phases], 'phase')
+    gauge('phase_spans', "Number of spans of each phase during the last run.",
+          [(phase, totals['count']) for phase, totals in phases], 'phase')
+    gauge('phase_bytes', "Bytes transferred in each phase during the last run.",
+          [(phase, totals['bytes']) for phase, totals in phases], 'phase')
+    gauge('phase_errors', "Failed spans of each phase during the last run.",
+          [(phase, totals['errors']) for phase, totals in phases], 'phase')
+    gauge('package_seconds', "Time spent fetching and installing each package during the last run.",
+          sorted(result['packages'].items()), 'package')
+    if openmetrics:
+        lines.append("# EOF")
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as textfile:
+        textfile.write('\n'.join(lines) + '\n')
+    os.replace(temporary, path)
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+
+
+def finish(progress_callback=print):
+    """
+    End a run: print the summary, write METRICS_TEXTFILE if set and forget the recorded spans.
+    """
+    print_summary(progress_callback)
+    textfile = os.getenv("METRICS_TEXTFILE")
+    if textfile and spans():
+        try:
+            write_textfile(textfile)
+        except OSError as e:
+            progress_callback(f"Failed to write metrics to {textfile}: {e}")
+    reset()
@@ -0,0 +1,88 @@
+"""
+Fleet-wide index of the packages stored by all users.
+
+The index is updated from the delta of every upload, so queries never have to
+scan the users' lists:
+
+    pipindex:packages                  sorted set of name -> number of lists using it
+    pipindex:versions                  sorted set of name==version -> number of lists using it
+    pipindex:package:<name>            set of the lists using a package
+    pipindex:version:<name==version>   set of the lists using a version
+
+A list is identified by the username, or `username/profile` for named profiles.
+Counts are recomputed from the size of the sets after each update, so a
+retried or repeated update never skews them; `rebuild_index()` recomputes the
+whole index from the stored lists.
+"""
+
+PACKAGES_KEY = 'pipindex:packages'
+VERSIONS_KEY = 'pipindex:versions'
+
+
+def package_key(name):
+    return f"pipindex:package:{name}"
+
+
+def version_key(name, version):
+    return f"pipindex:version:{name}=={version}"
+
+
+def update_index(redis_client, member, added, removed):
+    """
+    Record that the list `member` gained the `added` and lost the `removed` packages
+    (dicts of name -> version). A version change is a removal plus an addition.
+    """
+    if not added and not removed:
+        return
+
+    pipe = redis_client.pipeline()
+    touched = []
+    for name, version in removed.items():
+        pipe.srem(version_key(name, version), member)
+        touched.append((VERSIONS_KEY, f"{name}=={version}", version_key(name, version)))
+        if name not in added:
+            pipe.srem(package_key(name), member)
+            touched.append((PACKAGES_KEY, name, package_key(name)))
+    for name, version in added.items():
+        pipe.sadd(version_key(name, version), member)
+        pipe.sadd(package_key(name), member)
+        touched.append((VERSIONS_KEY, f"{name}=={version}", version_key(name, version)))
+        touched.append((PACKAGES_KEY, name, package_key(name)))
+    for _, _, key in touched:
+        pipe.scard(key)
+    counts = pipe.execute()[-len(touched):]
+
+    pipe = redis_client.pipeline()
+    for (index_key, entry, _), count in zip(touched, counts):
+        if count:
+            pipe.zadd(index_key, {entry: count})
+        else:
+            pipe.zrem(index_key, entry)
+    pipe.execute()
+
+
+def top_packages(redis_client, count=10, versions=False):
+    """
+    Return the (name, number of lists) of the `count` most used packages, or of
+    the most used `name==version` pins with `versions`.
+    """
+    return [(entry, int(score)) for entry, score in
+            redis_client.zrevrange(VERSIONS_KEY if versions else PACKAGES_KEY, 0, count - 1, withscores=True)]
+
+
+def package_users(redis_client, name, version=None):
+    """
+    Return the lists (usernames, or `username/profile`) that use a package, or one version of it.
+    """
+    return sorted(redis_client.smembers(package_key(name) if version is None else version_key(name, version)))
+
+
+def rebuild_index(redis_client, lists):
+    """
+    Recompute the whole index from (member, mapping of name -> version) pairs.
+    """
+    stale = list(redis_client.scan_iter('pipindex:*'))
+    for start in range(0, len(stale), 1000):
+        redis_client.delete(*stale[start:start + 1000])
+    for member, mapping in lists:
+        update_index(redis_client, member, mapping, {})
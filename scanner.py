@@ -0,0 +1,128 @@
+import json
+import os
+import subprocess
+import sys
+
+from installer import normalize_name
+
+# site directory -> (directory mtime, [(name, version), ...])
+_scan_cache = {}
+
+
+def _read_metadata(path):
+    """
+    Read the Name and Version headers from a METADATA / PKG-INFO file.
+    """
+    name = version = None
+    try:
+        with open(path, encoding='utf-8', errors='replace') as metadata:
+            for line in metadata:
+                if not line.strip():
+                    break
+                if line.startswith('Name:'):
+                    name = line[5:].strip()
+                elif line.startswith('Version:'):
+                    version = line[8:].strip()
+                if name and version:
+                    break
+    except OSError:
+        pass
+    return name, version
+
+
+def read_distribution(entry):
+    """
+    Return the (name, version) of a `*.dist-info` or `*.egg-info` directory entry.
+
+    Wheel-installed `name-version.dist-info` directories carry both in their
+    name, so the metadata file is only opened for egg-info and unusual names.
+    """
+    if entry.name.endswith('.dist-info'):
+        stem = entry.name[:-len('.dist-info')]
+        parts = stem.split('-')
+        if len(parts) == 2 and parts[0] and parts[1]:
+            return parts[0], parts[1]
+        return _read_metadata(os.path.join(entry.path, 'METADATA'))
+
+    if entry.is_dir():
+        return _read_metadata(os.path.join(entry.path, 'PKG-INFO'))
+    return _read_metadata(entry.path)
+
+
+def scan_directory(path):
+    """
+    Return the (name, version) pairs of the distributions installed in one directory.
+
+    Results are memoized by the directory mtime, which changes whenever a
+    distribution is installed, upgraded or removed.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return []
+
+    cached = _scan_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    distributions = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.endswith(('.dist-info', '.egg-info')):
+                    name, version = read_distribution(entry)
+                    if name and version:
+                        distributions.append((normalize_name(name), version))
+    except OSError:
+        return []
+
+    _scan_cache[path] = (mtime, distributions)
+    return distributions
+
+
+def scan_environment(paths=None):
+    """
+    Return the sorted `name==version` list of the distributions found on `paths`.
+
+    `paths` defaults to `sys.path`. Like the import system, the first
+    distribution found for a name wins.
+    """
+    if paths is None:
+        paths = sys.path
+
+    installed = {}
+    for path in paths:
+        path = os.path.abspath(path or os.curdir)
+        if not os.path.isdir(path):
+            continue
+        for name, version in scan_directory(path):
+            installed.setdefault(name, version)
+    return sorted(f"{name}=={version}" for name, version in installed.items())
+
+
+def interpreter_paths(python):
+    """
+    Return the `sys.path` of another Python interpreter, e.g. a virtual environment's.
+    """
+    result = subprocess.run(
+        [python, '-c', 'import json, sys; print(json.dumps(sys.path[1:]))'],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return json.loads(result.stdout)
+
+
+def resolve_interpreter(path):
+    """
+    Return the interpreter of a virtual environment directory, or `path` itself when it is not a directory.
+    """
+    if not os.path.isdir(path):
+        return path
+    if os.name == 'nt':
+        return os.path.join(path, 'Scripts', 'python.exe')
+    return os.path.join(path, 'bin', 'python')
+
+
+def clear_cache():
+    _scan_cache.clear()
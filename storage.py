@@ -0,0 +1,560 @@
+import hashlib
+import json
+import os
+import socket
+import time
+
+from codec import FORMAT_INTERNED, FORMAT_VERSION, decode_mapping, encode_mapping, intern_names, lookup_names
+from installer import parse_requirement
+from popularity import update_index
+
+DEFAULT_PROFILE = 'default'
+
+# Number of snapshots kept per profile
+history_limit = int(os.getenv("SNAPSHOT_HISTORY", "10"))
+
+# Value of the `snapshots` meta field once the snapshots of a list are stored as reverse deltas
+SNAPSHOT_DELTAS = 'reverse-delta'
+
+# Bytes read per GETRANGE when streaming a legacy string list
+LEGACY_CHUNK_SIZE = 64 * 1024
+
+# Hash of username -> password hash, and the prefixes of all other keys the app writes
+USERS_KEY = 'users'
+RESERVED_PREFIXES = ('pip:', 'pipdict:', 'pipindex:', 'pipsession:')
+
+# Largest delta sent in full in a change message
+CHANGE_MESSAGE_LIMIT = 1000
+
+# Sender of the change messages published by this process
+origin = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def check_name(name, kind='username'):
+    """
+    Raise ValueError for a username or profile name that would collide with other keys:
+    `:` and `/` separate the parts of a key name.
+    """
+    if not name or ':' in name or '/' in name:
+        raise ValueError(f"Invalid {kind} {name!r}: it must not be empty or contain ':' or '/'.")
+
+
+def packages_key(username, profile=DEFAULT_PROFILE):
+    if profile == DEFAULT_PROFILE:
+        return f"pip:{username}"
+    check_name(profile, 'profile')
+    return f"pip:{username}/{profile}"
+
+
+def meta_key(username, profile=DEFAULT_PROFILE):
+    return f"{packages_key(username, profile)}:meta"
+
+
+def history_key(username, profile=DEFAULT_PROFILE):
+    return f"{packages_key(username, profile)}:history"
+
+
+def snapshot_key(username, profile, snapshot):
+    return f"{packages_key(username, profile)}:snapshot:{snapshot}"
+
+
+def index_member(username, profile=DEFAULT_PROFILE):
+    """
+    Return the name a stored list has in the popularity index.
+    """
+    return packages_key(username, profile)[len('pip:'):]
+
+
+def lock_key(username, profile=DEFAULT_PROFILE):
+    return f"{packages_key(username, profile)}:lock"
+
+
+def profiles_key(username):
+    return f"pip:{username}:profiles"
+
+
+def changes_channel(username, profile=DEFAULT_PROFILE):
+    return f"{packages_key(username, profile)}:changes"
+
+
+def to_mapping(packages):
+    """
+    Turn `name==version` lines into a dict of normalized name -> version ('' when unpinned).
+    """
+    return {name: version or '' for name, version in iter_requirements(packages)}
+
+
+def iter_requirements(lines):
+    """
+    Yield the (normalized name, version or None) of each `name==version` line, skipping blank lines.
+    """
+    for line in lines:
+        name, version = parse_requirement(line)
+        if name:
+            yield name, version
+
+
+def iter_lines(redis_client, key, chunk_size=LEGACY_CHUNK_SIZE):
+    """
+    Yield the lines of a string value, read `chunk_size` bytes at a time with GETRANGE
+    so the whole value is never held in memory. Requirement lines are ASCII, so
+    chunk boundaries never split a character.
+    """
+    offset = 0
+    partial = ''
+    while True:
+        chunk = redis_client.getrange(key, offset, offset + chunk_size - 1)
+        if not chunk:
+            break
+        offset += len(chunk)
+        lines = (partial + chunk).split('\n')
+        partial = lines.pop()
+        yield from lines
+    if partial:
+        yield partial
+
+
+def to_lines(mapping):
+    """
+    Turn a dict of name -> version back into sorted `name==version` lines.
+    """
+    return [f"{name}=={version}" if version else name for name, version in sorted(mapping.items())]
+
+
+def compute_etag(mapping):
+    """
+    Return a content hash of a package mapping that does not depend on its order.
+    """
+    digest = hashlib.sha1()
+    for line in to_lines(mapping):
+        digest.update(line.encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def is_legacy_list(redis_client, username):
+    """
+    Return True when the key named after a user holds a list stored by an older version.
+
+    Only registered users count, and never keys of the app's own namespaces (e.g.
+    the `pipdict:seq` counter), which a username could otherwise point at.
+    """
+    if username == USERS_KEY or username.startswith(RESERVED_PREFIXES):
+        return False
+    return redis_client.hexists(USERS_KEY, username) and redis_client.type(username) == 'string'
+
+
+def migrate_legacy(redis_client, username, profile=DEFAULT_PROFILE):
+    """
+    Bring a user's stored package list to the current format.
+
+    Lists stored as one `name==version\n` string under the username (default
+    profile only) and hashes keyed by plain package names are rewritten as an
+    interned hash. Returns True when a key was migrated.
+    """
+    if redis_client.exists(packages_key(username, profile)):
+        stored_format, snapshots = redis_client.hmget(meta_key(username, profile), 'format', 'snapshots')
+        if int(stored_format or 1) == FORMAT_VERSION:
+            if snapshots != SNAPSHOT_DELTAS:
+                migrate_snapshots(redis_client, username, profile)
+            return False
+        mapping = redis_client.hgetall(packages_key(username, profile))
+    elif profile == DEFAULT_PROFILE and is_legacy_list(redis_client, username):
+        mapping = to_mapping(iter_lines(redis_client, username))
+    else:
+        return False
+
+    version = stored_version(redis_client, username, profile) + 1
+    pipe = redis_client.pipeline()
+    pipe.delete(packages_key(username, profile))
+    if mapping:
+        pipe.hset(packages_key(username, profile), mapping=encode_mapping(redis_client, mapping))
+    pipe.hset(meta_key(username, profile), mapping={'etag': compute_etag(mapping), 'format': FORMAT_VERSION,
+                                                    'version': version, 'snapshots': SNAPSHOT_DELTAS})
+    # The migrated list is the first snapshot of the new layout.
+    pipe.zadd(history_key(username, profile), {version: time.time()})
+    pipe.sadd(profiles_key(username), profile)
+    if profile == DEFAULT_PROFILE:
+        pipe.delete(username)
+    pipe.execute()
+    print(f"Migrated stored pip list of {username} to format {FORMAT_VERSION}.")
+    return True
+
+
+def migrate_snapshots(redis_client, username, profile=DEFAULT_PROFILE):
+    """
+    Rewrite the snapshots of a list that were stored as full copies as reverse deltas.
+
+    The newest snapshot is the stored list itself, so its copy is dropped; every
+    older one is replaced by the fields that turn the next snapshot back into it.
+    """
+    snapshots = sorted(int(snapshot) for snapshot in redis_client.zrange(history_key(username, profile), 0, -1))
+    newer = redis_client.hgetall(packages_key(username, profile))
+    pipe = redis_client.pipeline()
+    if snapshots:
+        pipe.delete(snapshot_key(username, profile, snapshots[-1]))
+    for snapshot in reversed(snapshots[:-1]):
+        older = redis_client.hgetall(snapshot_key(username, profile, snapshot))
+        delta = reverse_delta(older, [name_id for name_id in newer if older.get(name_id) != newer[name_id]]
+                              + [name_id for name_id in older if name_id not in newer])
+        pipe.delete(snapshot_key(username, profile, snapshot))
+        if delta:
+            pipe.hset(snapshot_key(username, profile, snapshot), mapping=delta)
+        newer = older
+    pipe.hset(meta_key(username, profile), 'snapshots', SNAPSHOT_DELTAS)
+    pipe.execute()
+
+
+def upload_packages(redis_client, username, packages, profile=DEFAULT_PROFILE):
+    """
+    Store a package list, sending only the entries that changed.
+
+    The etag of the stored list is checked first so an unchanged list costs a
+    single round-trip. Otherwise the stored hash is diffed against `packages`
+    and the changed and removed fields are written with HSET/HDEL in one
+    MULTI/EXEC transaction. The same transaction keeps the previous list as a
+    snapshot, stored as the reverse delta of the update (see `_write_update()`),
+    and drops the snapshots beyond SNAPSHOT_HISTORY. Returns a dict
+    with the `changed` and `removed` counts and the new `version` (which is
+    also the snapshot id), or None when nothing changed. The popularity index
+    is updated from the same delta afterwards, and the delta is announced with
+    `publish_change()`.
+    """
+    migrate_legacy(redis_client, username, profile)
+
+    mapping = to_mapping(packages)
+    etag = compute_etag(mapping)
+    if redis_client.hget(meta_key(username, profile), 'etag') == etag:
+        return None
+
+    encoded = encode_mapping(redis_client, mapping)
+    result = {}
+    delta = {}
+
+    def write(pipe):
+        stored = pipe.hgetall(packages_key(username, profile))
+        indexed = pipe.hget(meta_key(username, profile), 'indexed')
+        changed = {name_id: value for name_id, value in encoded.items() if stored.get(name_id) != value}
+        removed = [name_id for name_id in stored if name_id not in encoded]
+        result.update(_write_update(pipe, username, profile, etag, changed, removed,
+                                    reverse_delta(stored, list(changed) + removed)))
+        delta.update(stored=stored, changed=changed, removed=removed, indexed=indexed)
+
+    # Retried from the start if another client modifies the list in between.
+    redis_client.transaction(write, packages_key(username, profile), meta_key(username, profile))
+
+    stored = delta['stored']
+    names = {name_id: name for name, name_id in intern_names(redis_client, list(mapping)).items()}
+    names.update(lookup_names(redis_client, delta['removed']))
+    added = {names[name_id]: value for name_id, value in delta['changed'].items()}
+    removed = {names[name_id]: stored[name_id] for name_id in list(delta['changed']) + delta['removed']
+               if name_id in stored and stored[name_id] != encoded.get(name_id)}
+    # Lists stored before the index existed are indexed in full on their first upload.
+    update_index(redis_client, index_member(username, profile), added if delta['indexed'] else mapping, removed)
+    publish_change(redis_client, username, profile, result, etag, added, removed)
+    return result
+
+
+def apply_delta(redis_client, username, mapping, base_etag, added, removed, profile=DEFAULT_PROFILE):
+    """
+    Store a package list of which only the difference to the stored one is known.
+
+    `mapping` is the complete new dict of name -> version, `added` the new and
+    upgraded packages (name -> version) and `removed` the old versions of the
+    removed and upgraded ones (name -> version), relative to the list whose
+    etag is `base_etag`. Only the delta is written to the list, inside a
+    transaction that first checks the stored etag is still `base_etag`. Returns
+    the same dict as `upload_packages()`, or None when the stored list moved on
+    (or predates the popularity index) and a full `upload_packages()` is needed.
+    """
+    etag = compute_etag(mapping)
+    name_ids = intern_names(redis_client, list(added) + list(removed))
+    result = {}
+
+    def write(pipe):
+        meta = pipe.hgetall(meta_key(username, profile))
+        if meta.get('etag') != base_etag or int(meta.get('format') or 1) != FORMAT_VERSION \
+                or not meta.get('indexed') or meta.get('snapshots') != SNAPSHOT_DELTAS:
+            pipe.unwatch()
+            return
+        changed = {name_ids[name]: version for name, version in added.items()}
+        gone = [name_ids[name] for name in removed if name not in added]
+        old = {name_ids[name]: version for name, version in removed.items()}
+        result.update(_write_update(pipe, username, profile, etag, changed, gone,
+                                    reverse_delta(old, list(changed) + gone)))
+
+    redis_client.transaction(write, packages_key(username, profile), meta_key(username, profile))
+    if not result:
+        return None
+    update_index(redis_client, index_member(username, profile), added, removed)
+    publish_change(redis_client, username, profile, result, etag, added, removed)
+    return result
+
+
+def reverse_delta(old, name_ids):
+    """
+    Return the fields that turn a list back into `old` after the `name_ids` fields changed:
+    `=` and the old version for the ids `old` had, `-` for the ids it did not have.
+    """
+    return {name_id: '=' + old[name_id] if name_id in old else '-' for name_id in name_ids}
+
+
+def _write_update(pipe, username, profile, etag, changed, removed, reverse):
+    """
+    Queue the writes of a list update on a transaction pipeline that is still in watch mode.
+
+    Writes the `changed` fields and deletes the `removed` ids, bumps the meta
+    version and etag and records the new version in the history. The previous
+    version is kept as its `reverse` delta rather than as a copy, so an update
+    costs as many fields as it changes. Snapshots beyond SNAPSHOT_HISTORY are
+    dropped. Returns the `changed` and `removed` counts and the new `version`.
+    """
+    previous, previous_etag = pipe.hmget(meta_key(username, profile), 'version', 'etag')
+    version = int(previous or 0) + 1
+    snapshots = sorted(int(snapshot) for snapshot in pipe.zrange(history_key(username, profile), 0, -1))
+
+    pipe.multi()
+    if changed:
+        pipe.hset(packages_key(username, profile), mapping=changed)
+    if removed:
+        pipe.hdel(packages_key(username, profile), *removed)
+    pipe.hset(meta_key(username, profile), mapping={'etag': etag, 'format': FORMAT_INTERNED, 'version': version,
+                                                    'indexed': 1, 'snapshots': SNAPSHOT_DELTAS})
+    pipe.sadd(profiles_key(username), profile)
+
+    if previous_etag is not None:
+        if reverse:
+            pipe.hset(snapshot_key(username, profile, version - 1), mapping=reverse)
+        # Lists stored before the history existed get their last version recorded now.
+        if version - 1 not in snapshots:
+            pipe.zadd(history_key(username, profile), {version - 1: time.time()})
+            snapshots.append(version - 1)
+    pipe.zadd(history_key(username, profile), {version: time.time()})
+    expired = snapshots[:max(0, len(snapshots) + 1 - history_limit)]
+    if expired:
+        pipe.zrem(history_key(username, profile), *expired)
+        pipe.delete(*(snapshot_key(username, profile, snapshot) for snapshot in expired))
+    return {'changed': len(changed), 'removed': len(removed), 'version': version}
+
+
+def publish_change(redis_client, username, profile, result, etag, added, removed):
+    """
+    Announce a list update on the profile's `changes_channel()`.
+
+    The message holds the new `version` and `etag`, the `added` packages
+    (name -> version, including upgrades), the `removed` package names and the
+    `origin` host. Deltas above CHANGE_MESSAGE_LIMIT packages are sent with
+    `full` set instead, telling subscribers to read the stored list.
+    """
+    message = {'username': username, 'profile': profile, 'version': result['version'], 'etag': etag,
+               'origin': origin}
+    if len(added) + len(removed) > CHANGE_MESSAGE_LIMIT:
+        message['full'] = True
+    else:
+        message.update(added=added, removed=sorted(name for name in removed if name not in added))
+    redis_client.publish(changes_channel(username, profile), json.dumps(message))
+
+
+def iter_changes(redis_client, username, profile=DEFAULT_PROFILE, timeout=1.0):
+    """
+    Subscribe to the update messages of a profile and yield them as dicts.
+
+    None is yielded every `timeout` seconds without a message, so the caller
+    can check whether to stop. Messages published while nobody is subscribed
+    are lost; subscribers notice them as gaps in the `version` numbers.
+    """
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(changes_channel(username, profile))
+    try:
+        while True:
+            message = pubsub.get_message(timeout=timeout)
+            yield json.loads(message['data']) if message else None
+    finally:
+        pubsub.close()
+
+
+def stored_version(redis_client, username, profile=DEFAULT_PROFILE):
+    return int(redis_client.hget(meta_key(username, profile), 'version') or 0)
+
+
+def load_mapping(redis_client, username, profile=DEFAULT_PROFILE, snapshot=None):
+    """
+    Return the stored dict of name -> version of a profile, or of one of its snapshots.
+    """
+    migrate_legacy(redis_client, username, profile)
+    if snapshot is None:
+        return decode_mapping(redis_client, redis_client.hgetall(packages_key(username, profile)))
+    return decode_mapping(redis_client, load_snapshots(redis_client, username, [snapshot], profile)[0])
+
+
+def load_snapshots(redis_client, username, snapshots, profile=DEFAULT_PROFILE):
+    """
+    Return the encoded lists (id -> version) of some snapshots of a profile; None stands for the current list.
+
+    Only the current version is stored in full; every older snapshot holds the
+    fields that turn the next one back into it (see `reverse_delta()`). The
+    stored list and the deltas down to the oldest requested snapshot are read
+    in one transaction and applied newest first. Raises ValueError for ids that
+    are not in the history (never recorded, or expired).
+    """
+    requested = [snapshot for snapshot in snapshots if snapshot is not None]
+    state = {}
+
+    def read(pipe):
+        # Every update bumps the meta version, so watching the meta hash covers the list and its snapshots.
+        state['current'] = int(pipe.hget(meta_key(username, profile), 'version') or 0)
+        history = sorted(int(snapshot) for snapshot in pipe.zrange(history_key(username, profile), 0, -1))
+        unknown = sorted(set(requested) - set(history))
+        if unknown:
+            raise ValueError(f"Unknown snapshot {', '.join(map(str, unknown))} of profile {profile}; "
+                             f"the stored snapshots are {', '.join(map(str, history)) or 'none'}.")
+        state['chain'] = [snapshot for snapshot in reversed(history)
+                          if requested and min(requested) <= snapshot < state['current']]
+        pipe.multi()
+        pipe.hgetall(packages_key(username, profile))
+        for snapshot in state['chain']:
+            pipe.hgetall(snapshot_key(username, profile, snapshot))
+
+    encoded, *deltas = redis_client.transaction(read, meta_key(username, profile))
+    chain = state['chain']
+    found = {None: encoded, state['current']: encoded}
+    encoded = dict(encoded)
+    for snapshot, delta in zip(chain, deltas):
+        for name_id, value in delta.items():
+            if value == '-':
+                encoded.pop(name_id, None)
+            else:
+                encoded[name_id] = value[1:]
+        if snapshot in requested:
+            found[snapshot] = dict(encoded)
+    return [found[snapshot] for snapshot in snapshots]
+
+
+def load_packages(redis_client, username, profile=DEFAULT_PROFILE, snapshot=None):
+    """
+    Return the stored package list of a user as `name==version` lines.
+    """
+    return to_lines(load_mapping(redis_client, username, profile, snapshot))
+
+
+def store_lock(redis_client, username, entries, profile=DEFAULT_PROFILE):
+    """
+    Replace the lock entries of a profile, stored as JSON per interned package id.
+
+    Returns False without writing when the lock is unchanged since the last upload.
+    """
+    name_ids = intern_names(redis_client, [entry['name'] for entry in entries])
+    encoded = {name_ids[entry['name']]: json.dumps({key: value for key, value in entry.items() if key != 'name'},
+                                                   sort_keys=True)
+               for entry in entries}
+    digest = hashlib.sha1()
+    for name_id, value in sorted(encoded.items()):
+        digest.update(f"{name_id}={value}\n".encode())
+    if redis_client.hget(meta_key(username, profile), 'lock_etag') == digest.hexdigest():
+        return False
+
+    pipe = redis_client.pipeline()
+    pipe.delete(lock_key(username, profile))
+    if encoded:
+        pipe.hset(lock_key(username, profile), mapping=encoded)
+    pipe.hset(meta_key(username, profile), 'lock_etag', digest.hexdigest())
+    pipe.execute()
+    return True
+
+
+def update_lock(redis_client, username, entries, removed=(), profile=DEFAULT_PROFILE):
+    """
+    Write the lock entries of some packages and delete those of the `removed` names,
+    leaving the other entries of the profile alone.
+    """
+    name_ids = intern_names(redis_client, [entry['name'] for entry in entries] + list(removed))
+    pipe = redis_client.pipeline()
+    if entries:
+        pipe.hset(lock_key(username, profile), mapping={
+            name_ids[entry['name']]: json.dumps({key: value for key, value in entry.items() if key != 'name'},
+                                                sort_keys=True)
+            for entry in entries})
+    if removed:
+        pipe.hdel(lock_key(username, profile), *(name_ids[name] for name in removed))
+    # The lock no longer matches the etag of a complete upload.
+    pipe.hdel(meta_key(username, profile), 'lock_etag')
+    pipe.execute()
+
+
+def load_lock(redis_client, username, profile=DEFAULT_PROFILE):
+    """
+    Return the stored lock entries of a profile, sorted by name.
+    """
+    encoded = redis_client.hgetall(lock_key(username, profile))
+    names = lookup_names(redis_client, list(encoded))
+    return sorted(({'name': names[name_id], **json.loads(value)} for name_id, value in encoded.items()),
+                  key=lambda entry: entry['name'])
+
+
+def count_packages(redis_client, username, profile=DEFAULT_PROFILE):
+    migrate_legacy(redis_client, username, profile)
+    return redis_client.hlen(packages_key(username, profile))
+
+
+def iter_package_batches(redis_client, username, profile=DEFAULT_PROFILE, batch_size=1000):
+    """
+    Yield the stored package list of a user as lists of up to `batch_size` `name==version` lines.
+
+    The hash is read incrementally with HSCAN and only the names of each batch
+    are decoded, so memory use depends on `batch_size` rather than on the size
+    of the profile and the caller can start working on the first batch right away.
+    """
+    migrate_legacy(redis_client, username, profile)
+    batch = {}
+    for name_id, version in redis_client.hscan_iter(packages_key(username, profile), count=batch_size):
+        batch[name_id] = version
+        if len(batch) >= batch_size:
+            yield to_lines(decode_mapping(redis_client, batch))
+            batch = {}
+    if batch:
+        yield to_lines(decode_mapping(redis_client, batch))
+
+
+def list_profiles(redis_client, username):
+    """
+    Return the names of the profiles a user has stored.
+    """
+    migrate_legacy(redis_client, username)
+    return sorted(redis_client.smembers(profiles_key(username)))
+
+
+def list_snapshots(redis_client, username, profile=DEFAULT_PROFILE):
+    """
+    Return the (snapshot id, timestamp) pairs of a profile, oldest first.
+    """
+    migrate_legacy(redis_client, username, profile)
+    return [(int(snapshot), timestamp)
+            for snapshot, timestamp in redis_client.zrange(history_key(username, profile), 0, -1, withscores=True)]
+
+
+def diff_mappings(old, new):
+    """
+    Return the packages `added`, `removed` and `changed` (as [old, new] versions) from `old` to `new`.
+    """
+    return {
+        'added': {name: version for name, version in new.items() if name not in old},
+        'removed': {name: version for name, version in old.items() if name not in new},
+        'changed': {name: [old[name], version] for name, version in new.items()
+                    if name in old and old[name] != version},
+    }
+
+
+def diff_snapshots(redis_client, username, old, new, profile=DEFAULT_PROFILE):
+    """
+    Diff two snapshots of a profile; None stands for the current list.
+
+    Both lists are rebuilt from one `load_snapshots()` read and compared by
+    their interned ids, so only the names of the packages that differ are decoded.
+    """
+    migrate_legacy(redis_client, username, profile)
+    old_encoded, new_encoded = load_snapshots(redis_client, username, [old, new], profile)
+
+    diff = diff_mappings(old_encoded, new_encoded)
+    names = lookup_names(redis_client, [name_id for entries in diff.values() for name_id in entries])
+    return {section: {names[name_id]: value for name_id, value in entries.items()}
+            for section, entries in diff.items()}
@@ -0,0 +1,53 @@
+import os
+import sys
+import venv
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import codec  # noqa: E402
+from wheels import write_wheel  # noqa: E402,F401
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    """
+    A fresh fakeredis server, also used by `core.get_redis()`.
+    """
+    fakeredis = pytest.importorskip('fakeredis')
+    core = pytest.importorskip('core')
+    # Interned ids are cached per process, but every test starts with an empty table.
+    codec.clear_cache()
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(core, '_redis_client', None)
+    core.set_redis(client)
+    yield client
+    codec.clear_cache()
+
+
+@pytest.fixture
+def users(redis_client, tmp_path, monkeypatch):
+    """
+    Users `alice` and `svc` (password `secret-<name>`), and no cached session yet.
+    """
+    core = pytest.importorskip('core')
+    monkeypatch.setattr(core, 'session_file', str(tmp_path / 'session.json'))
+    monkeypatch.setattr(core, 'bcrypt_rounds', 4)
+    for username in ('alice', 'svc'):
+        core.UserManager().signup(username, f"secret-{username}")
+    monkeypatch.delenv('PIP_LIST_USERNAME', raising=False)
+    monkeypatch.delenv('PIP_LIST_PASSWORD', raising=False)
+    return redis_client
+
+
+@pytest.fixture
+def environment(tmp_path):
+    """
+    The interpreter of a new virtual environment to install into.
+    """
+    path = tmp_path / 'env'
+    venv.create(path, with_pip=True)
+    return str(path / ('Scripts/python.exe' if os.name == 'nt' else 'bin/python'))
@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+import types
+
+import pytest
+
+core = pytest.importorskip('core')
+app = pytest.importorskip('app')
+import storage  # noqa: E402
+
+
+def test_authenticate_ignores_the_cached_session_of_another_user(users, monkeypatch):
+    core.UserManager().login('alice', 'secret-alice')
+    assert app.authenticate().username == 'alice'
+
+    monkeypatch.setenv('PIP_LIST_USERNAME', 'svc')
+    monkeypatch.setenv('PIP_LIST_PASSWORD', 'wrong')
+    assert app.authenticate() is None
+    monkeypatch.setenv('PIP_LIST_PASSWORD', 'secret-svc')
+    assert app.authenticate().username == 'svc'
+
+    # alice's cached session survives both, and an invalid explicit token.
+    assert app.authenticate('invalid') is None
+    assert core.UserManager().resume_session().username == 'alice'
+
+
+def run(argv, capsys):
+    code = app.run_command(app.build_parser().parse_args(argv))
+    return code, json.loads(capsys.readouterr().out)
+
+
+def test_diff_snapshots(users, monkeypatch, capsys):
+    monkeypatch.setenv('PIP_LIST_USERNAME', 'alice')
+    monkeypatch.setenv('PIP_LIST_PASSWORD', 'secret-alice')
+    storage.upload_packages(users, 'alice', ['a==1'])
+    storage.upload_packages(users, 'alice', ['a==2'])
+
+    code, result = run(['diff', '--from', '1', '--to', 'current'], capsys)
+    assert code == app.EXIT_FAILED
+    assert result['diffs'][0]['changed'] == {'a': ['1', '2']}
+
+    code, result = run(['diff', '--from', '99', '--to', 'current'], capsys)
+    assert code == app.EXIT_USAGE
+    assert 'Unknown snapshot 99' in result['error']
+    assert run(['export', '--snapshot', '99'], capsys)[0] == app.EXIT_USAGE
+    with pytest.raises(SystemExit) as exit_info:
+        app.build_parser().parse_args(['diff', '--from', 'yesterday'])
+    assert exit_info.value.code == app.EXIT_USAGE
+
+
+def test_run_targets_restores_one_interpreter_at_a_time(monkeypatch):
+    lock = threading.Lock()
+    active = {}
+    peaks = {'per_python': 0, 'total': 0}
+
+    def restore_target(packages, profile, python, args, dry_run, stored_lock=None):
+        with lock:
+            active[python] = active.get(python, 0) + 1
+            peaks['per_python'] = max(peaks['per_python'], active[python])
+            peaks['total'] = max(peaks['total'], sum(active.values()))
+        time.sleep(0.1)
+        with lock:
+            active[python] -= 1
+        return profile, python
+
+    monkeypatch.setattr(app, 'restore_target', restore_target)
+    monkeypatch.setattr(app, 'parse_target', lambda value: (value, None))
+    monkeypatch.setattr(app.PackageManager, 'get_stored_pip_list', staticmethod(lambda user, profile: ['a==1']))
+
+    args = types.SimpleNamespace(profiles=['a', 'b'], pythons=None, jobs=2, lock_file=None, locked=False)
+    assert app.run_targets(None, args, True) == [('a', None), ('b', None)]
+    assert peaks == {'per_python': 1, 'total': 1}
+
+    args.pythons, args.jobs = ['/x', '/y'], None
+    assert app.run_targets(None, args, True) == [('a', '/x'), ('a', '/y'), ('b', '/x'), ('b', '/y')]
+    assert peaks == {'per_python': 1, 'total': 2}
@@ -0,0 +1,39 @@
+import pytest
+
+import codec
+
+
+def test_to_base36():
+    assert [codec.to_base36(number) for number in (0, 9, 10, 35, 36, 1295, 1296)] == \
+        ['0', '9', 'a', 'z', '10', 'zz', '100']
+
+
+def test_encode_decode_round_trip(redis_client):
+    mapping = {'django': '4.2.1', 'requests': '2.31.0', 'six': ''}
+    encoded = codec.encode_mapping(redis_client, mapping)
+    assert set(encoded.values()) == set(mapping.values())
+    assert not set(encoded) & set(mapping)
+
+    codec.clear_cache()
+    assert codec.decode_mapping(redis_client, encoded) == mapping
+
+
+def test_intern_names_is_stable(redis_client):
+    first = codec.intern_names(redis_client, ['a', 'b'])
+    codec.clear_cache()
+    second = codec.intern_names(redis_client, ['b', 'c', 'a'])
+    assert second['a'] == first['a'] and second['b'] == first['b']
+    assert len(set(second.values())) == 3
+    assert redis_client.hgetall(codec.IDS_KEY) == {name_id: name for name, name_id in second.items()}
+
+
+def test_lookup_names(redis_client):
+    name_ids = codec.intern_names(redis_client, ['x', 'y'])
+    codec.clear_cache()
+    assert codec.lookup_names(redis_client, [name_ids['y'], name_ids['x']]) == {name_ids['x']: 'x',
+                                                                                name_ids['y']: 'y'}
+
+
+def test_lookup_unknown_id(redis_client):
+    with pytest.raises(KeyError):
+        codec.lookup_names(redis_client, ['zz'])
@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+core = pytest.importorskip('core')
+import storage  # noqa: E402
+
+
+def test_signup_rejects_names_that_collide_with_other_keys(users):
+    with pytest.raises(ValueError):
+        core.UserManager().signup('alice:meta', 'secret')
+    assert core.UserManager().signup('alice', 'secret') is None
+
+
+def test_sessions_expire_and_are_only_stored_as_digests(users, monkeypatch):
+    monkeypatch.setattr(core, 'session_ttl', 60)
+    user = core.UserManager().login('alice', 'secret-alice')
+    assert oct(os.stat(core.session_file).st_mode & 0o777) == '0o600'
+    assert core.UserManager().resume_session().username == 'alice'
+    assert core.UserManager().resume_session(user.session_token).username == 'alice'
+
+    assert users.get(core.session_key(user.session_token)) == 'alice'
+    assert not users.exists(f"pipsession:{user.session_token}")
+    assert 0 < users.ttl(core.session_key(user.session_token)) <= 60
+
+    users.delete(core.session_key(user.session_token))
+    assert core.UserManager().resume_session() is None
+    # The expired token is forgotten, so the next run asks for a password right away.
+    assert not os.path.exists(core.session_file)
+
+
+def test_login_without_remember_issues_no_session(users):
+    assert core.UserManager().login('alice', 'secret-alice', remember=False).session_token is None
+    assert core.UserManager().login('alice', 'wrong') is None
+    assert not os.path.exists(core.session_file)
+
+
+def test_logout_and_invalidate_sessions(users):
+    manager = core.UserManager()
+    first = manager.login('alice', 'secret-alice')
+    second = manager.login('alice', 'secret-alice')
+    manager.logout(second)
+    assert second.session_token is None
+    assert manager.resume_session() is None
+    assert manager.resume_session(first.session_token).username == 'alice'
+
+    manager.invalidate_sessions('alice')
+    assert manager.resume_session(first.session_token) is None
+    assert not users.keys('pipsession:*')
+
+
+def test_password_is_rehashed_with_the_configured_cost(users, monkeypatch):
+    assert core.password_rounds(users.hget('users', 'alice')) == 4
+    monkeypatch.setattr(core, 'bcrypt_rounds', 5)
+    assert core.User('alice').check_password('wrong') is False
+    assert core.password_rounds(users.hget('users', 'alice')) == 4
+    assert core.User('alice').check_password('secret-alice') is True
+    assert core.password_rounds(users.hget('users', 'alice')) == 5
+    assert core.User('alice').check_password('secret-alice') is True
+
+
+def test_download_all_packages_streams_large_lists(users, monkeypatch):
+    storage.upload_packages(users, 'alice', [f"pkg{index}==1.0" for index in range(7)])
+    monkeypatch.setattr(core, 'stream_batch_size', 3)
+    batches = []
+
+    def restore(packages, progress_callback, chunk_size, dry_run, monitor, python):
+        batches.append(packages)
+        report = {'installed': packages[1:], 'failed': packages[:1], 'total_time': 1.0,
+                  'package_times': dict.fromkeys(packages, 0.5), 'cancelled': len(batches) == 2}
+        return {'plan': None, 'report': report}
+
+    monkeypatch.setattr(core.PackageManager, 'restore', staticmethod(restore))
+    messages = []
+    assert core.PackageManager.download_all_packages(core.User('alice'), messages.append) is False
+    # The second batch was cancelled, so the third is never restored.
+    assert [len(batch) for batch in batches] == [3, 3]
+    assert messages[0] == "Restoring 7 packages in batches of 3..."
+    assert messages[-1] == "Installed 4 packages, 2 failed in 2.00s."
+
+
+def test_follow_restores_published_changes(users, monkeypatch):
+    restored = []
+    monkeypatch.setattr(core.PackageManager, 'restore', staticmethod(
+        lambda packages, progress_callback, python: restored.append(packages) or {'report': 'report'}))
+    received = []
+
+    def publish():
+        monkeypatch.setattr(storage, 'origin', 'elsewhere')
+        storage.upload_packages(users, 'alice', ['a==1', 'b==1'])
+        storage.upload_packages(users, 'alice', ['a==2', 'b==1'])
+        storage.origin = 'here'
+        storage.upload_packages(users, 'alice', ['a==2', 'b==1', 'c==1'])
+        storage.origin = 'elsewhere'
+        storage.upload_packages(users, 'alice', ['a==2', 'c==1', 'd==1'])
+        storage.origin = 'here'
+
+    def should_stop():
+        # Called once the subscription is in place, so nothing is published before it.
+        if not received:
+            received.append(None)
+            publish()
+        return len(received) == 4
+
+    count = core.PackageManager.follow(core.User('alice'), restore=True, should_stop=should_stop,
+                                       change_callback=lambda message, report: received.append(message['version']))
+    assert count == 3
+    assert received == [None, 1, 2, 4]
+    # Our own update 3 is skipped, so update 4 restores the whole list.
+    assert restored == [['a==1', 'b==1'], ['a==2'], ['a==2', 'c==1', 'd==1']]
+
+
+def test_download_pip_reports_through_the_callback(users, monkeypatch, capsys):
+    report = {'installed': ['a==1'], 'failed': [], 'total_time': 0.5, 'package_times': {'a==1': 0.5},
+              'cancelled': False}
+    monkeypatch.setattr(core.PackageManager, 'restore', staticmethod(lambda *args: {'plan': None, 'report': report}))
+    messages = []
+    assert core.PackageManager.download_pip(core.User('alice'), ['a==1'], messages.append) is True
+    assert messages == ["  a==1: 0.50s", "Installed 1 packages, 0 failed in 0.50s."]
+    assert capsys.readouterr().out == ''
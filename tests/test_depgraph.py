@@ -0,0 +1,88 @@
+import os
+import venv
+
+import pytest
+
+from conftest import write_wheel
+from depgraph import (build_graph, install_graph, prefetch_and_install_graph, prefetch_and_install_targets,
+                      topological_layers)
+
+
+@pytest.fixture
+def wheelhouse(tmp_path):
+    """
+    top -> left, right -> base; left needs base<2, so base 1.0 is picked over 2.0.
+    """
+    path = tmp_path / 'wheelhouse'
+    path.mkdir()
+    write_wheel(path, 'top', '1.0', ['left', 'right[speed]', 'win; sys_platform == "nonexistent"'])
+    write_wheel(path, 'left', '1.0', ['base<2'])
+    write_wheel(path, 'right', '1.0', ['base>=1', 'fast; extra == "speed"', 'opt; extra == "other"'])
+    write_wheel(path, 'base', '1.0')
+    write_wheel(path, 'base', '2.0')
+    write_wheel(path, 'fast', '1.0')
+    write_wheel(path, 'opt', '1.0')
+    write_wheel(path, 'win', '1.0')
+    write_wheel(path, 'lone', '1.0', ['nothere'])
+    return str(path)
+
+
+def test_build_graph(wheelhouse):
+    graph = build_graph(['top==1.0'], wheelhouse)
+    assert {name: os.path.basename(path) for name, path in graph['wheels'].items()} == {
+        'top': 'top-1.0-py3-none-any.whl',
+        'left': 'left-1.0-py3-none-any.whl',
+        'right': 'right-1.0-py3-none-any.whl',
+        'base': 'base-1.0-py3-none-any.whl',
+        'fast': 'fast-1.0-py3-none-any.whl',
+    }
+    assert graph['requires'] == {'top': {'left', 'right'}, 'left': {'base'}, 'right': {'base', 'fast'},
+                                 'base': set(), 'fast': set()}
+    assert graph['missing'] == {}
+    assert topological_layers(graph['requires']) == [['base', 'fast'], ['left', 'right'], ['top']]
+
+
+def test_build_graph_skips_installed_and_reports_missing(wheelhouse):
+    graph = build_graph(['left==1.0', 'lone==1.0', 'ghost==1.0'], wheelhouse, installed_packages=['base==1.5'])
+    assert sorted(graph['wheels']) == ['left', 'lone']
+    assert graph['missing'] == {'nothere': 'nothere', 'ghost': 'ghost==1.0'}
+
+
+def test_topological_layers_puts_cycles_last():
+    assert topological_layers({'a': {'b'}, 'b': {'a'}, 'c': set(), 'd': {'c', 'outside'}}) == \
+        [['c'], ['d'], ['a', 'b']]
+
+
+def test_install_graph(wheelhouse, environment):
+    graph = build_graph(['top==1.0', 'lone==1.0'], wheelhouse)
+    report = install_graph(graph, lambda message: None, workers=2, python=environment)
+    assert sorted(report['installed']) == ['base==1.0', 'fast==1.0', 'left==1.0', 'right==1.0', 'top==1.0']
+    # lone is skipped because its dependency has no wheel.
+    assert sorted(report['failed']) == ['lone==1.0', 'nothere']
+    assert report['layers'] == 3
+
+
+def test_prefetch_and_install_graph(wheelhouse, environment, tmp_path):
+    report = prefetch_and_install_graph(['left==1.0'], lambda message: None, wheelhouse=str(tmp_path / 'fetched'),
+                                        index_args=['--no-index', '--find-links', wheelhouse], python=environment)
+    assert sorted(report['installed']) == ['base==1.0', 'left==1.0']
+    assert report['failed'] == []
+
+
+def test_prefetch_and_install_targets(wheelhouse, environment, tmp_path):
+    other = tmp_path / 'other'
+    venv.create(other, with_pip=True)
+    other = str(other / ('Scripts/python.exe' if os.name == 'nt' else 'bin/python'))
+    messages = []
+    targets = [
+        {'python': environment, 'requirements': ['left==1.0'], 'installed_packages': [], 'workers': 2},
+        {'python': other, 'requirements': ['right==1.0'], 'installed_packages': ['base==1.0'], 'workers': 2},
+    ]
+    shared = tmp_path / 'shared'
+    reports = prefetch_and_install_targets(targets, messages.append, str(shared), jobs=None,
+                                           index_args=['--no-index', '--find-links', wheelhouse])
+    assert [sorted(report['installed']) for report in reports] == [['base==1.0', 'left==1.0'], ['right==1.0']]
+    assert [report['failed'] for report in reports] == [[], []]
+    # Both interpreters support the same tags, so one round of downloads serves both.
+    assert sum(message.startswith('Fetching ') for message in messages) == 1
+    assert {'left-1.0-py3-none-any.whl', 'right-1.0-py3-none-any.whl'} <= set(os.listdir(shared))
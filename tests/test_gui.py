@@ -0,0 +1,83 @@
+import importlib.util
+import os
+import types
+
+import pytest
+
+pytest.importorskip('tkinter')
+pytest.importorskip('core')
+
+spec = importlib.util.spec_from_file_location(
+    'app_gui', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app-gui.py'))
+app_gui = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app_gui)
+
+
+def test_filter_narrows_and_widens():
+    model = app_gui.PackageTableModel()
+    model.set_packages(['Django==4.2', 'django-rest==3.0', 'requests==2.31', 'six'])
+    assert model.rows[3] == ('six', '')
+    assert model.filter('DJ') == [0, 1]
+    assert model.filter('django-') == [1]
+    assert model.filter('e') == [1, 2]
+    assert model.filter('  ') == [0, 1, 2, 3]
+
+
+def test_selection_is_kept_across_filters():
+    model = app_gui.PackageTableModel()
+    model.set_packages(['a==1', 'ab==1', 'b==1'])
+    model.filter('a')
+    model.select_matching()
+    assert model.toggle(2) == 1
+    assert model.toggle(0) == 0
+    model.filter('')
+    assert model.selected_packages() == ['ab==1', 'b==1']
+    model.select_all()
+    assert model.selected_indexes() == [0, 1, 2]
+    model.select_none()
+    assert model.selected_indexes() == []
+
+
+class FakeTree:
+    def __init__(self):
+        self.rows = {}
+        self.selection = set()
+
+    def insert(self, parent, index, iid, values):
+        self.rows[iid] = values
+
+    def delete(self, *row_ids):
+        for row_id in row_ids:
+            del self.rows[row_id]
+
+    def selection_add(self, row_ids):
+        self.selection.update(row_ids)
+
+
+def test_rows_are_inserted_in_chunks(monkeypatch):
+    monkeypatch.setattr(app_gui, 'INSERT_CHUNK_SIZE', 2)
+    model = app_gui.PackageTableModel()
+    model.set_packages([f"pkg{index}==1.0" for index in range(5)])
+    model.toggle(3)
+    pending = []
+    view = types.SimpleNamespace(package_model=model, package_tree=FakeTree(), inserted_rows=[], render_generation=0,
+                                 root=types.SimpleNamespace(after_idle=lambda *call: pending.append(call)))
+    view.insert_chunk = lambda *args: app_gui.App.insert_chunk(view, *args)
+
+    app_gui.App.render_rows(view, model.filter(''))
+    assert view.inserted_rows == ['0', '1']
+    while pending:
+        callback, *args = pending.pop(0)
+        callback(*args)
+    assert view.inserted_rows == ['0', '1', '2', '3', '4']
+    assert view.package_tree.rows['4'] == ('pkg4', '1.0')
+    assert view.package_tree.selection == {'3'}
+
+    # A newer render makes the chunks still queued for an older one no-ops.
+    app_gui.App.render_rows(view, model.filter('pkg'))
+    app_gui.App.render_rows(view, model.filter('pkg1'))
+    assert len(pending) == 1
+    callback, *args = pending.pop()
+    callback(*args)
+    assert view.package_tree.rows == {'1': ('pkg1', '1.0')}
+    assert pending == []
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import tempfile
+
+from conftest import write_wheel
+from installer import plan_restore, prefetch_and_install
+from wheelcache import WheelCache
+
+
+def test_plan_restore():
+    plan = plan_restore(['a==1.0', 'b==2.0', 'c==1.10', 'd==1.0', 'e', 'f==2.0', 'g==1.0', 'h==weird'],
+                        ['b==1.9', 'c==1.9', 'd==1.0', 'e==3', 'f==2.0.0', 'g==1.1', 'h==1.0'])
+    assert plan == {
+        'install': ['a==1.0'],
+        'upgrade': ['b==2.0', 'c==1.10', 'h==weird'],
+        'downgrade': ['g==1.0'],
+        'unchanged': ['d==1.0', 'e', 'f==2.0'],
+    }
+    assert plan_restore(['a==1.0'], ['a==1.0rc1'])['upgrade'] == ['a==1.0']
+
+
+def installed(python):
+    output = subprocess.run([python, '-m', 'pip', 'list', '--format=freeze'], capture_output=True, text=True).stdout
+    return sorted(line.lower() for line in output.splitlines() if line.startswith('pkg'))
+
+
+def test_cached_wheel_gets_its_dependencies(tmp_path, environment):
+    index = tmp_path / 'index'
+    index.mkdir()
+    write_wheel(index, 'pkga', '1.0', ['pkgb>=1'])
+    write_wheel(index, 'pkgb', '1.0')
+    # Only pkga is cached, so its dependency must still come from the index.
+    cache = WheelCache(str(tmp_path / 'cache'))
+    cache.add(str(index / 'pkga-1.0-py3-none-any.whl'))
+
+    report = prefetch_and_install(['pkga==1.0'], lambda message: None, cache=cache, python=environment,
+                                  index_args=['--no-index', '--find-links', str(index)])
+    assert report['failed'] == []
+    assert report['cache']['hits'] == 1
+    assert installed(environment) == ['pkga==1.0', 'pkgb==1.0']
+
+
+def test_temporary_wheelhouse_is_removed(tmp_path, environment, monkeypatch):
+    index = tmp_path / 'index'
+    index.mkdir()
+    write_wheel(index, 'pkgc', '1.0')
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path / 'tmp'))
+    os.makedirs(tempfile.tempdir)
+
+    report = prefetch_and_install(['pkgc==1.0'], lambda message: None, python=environment,
+                                  index_args=['--no-index', '--find-links', str(index)])
+    assert report['installed'] == ['pkgc==1.0']
+    assert os.listdir(tempfile.tempdir) == []
@@ -0,0 +1,127 @@
+import io
+import json
+import os
+import subprocess
+import tarfile
+
+import pytest
+
+from installer import prefetch_and_install
+from lockfile import capture_lock, format_entry, install_lock, parse_entry, read_entry, read_requirements
+from scanner import interpreter_paths
+from wheelcache import WheelCache
+
+
+def test_parse_entry_keeps_only_exact_pins():
+    assert parse_entry('Django==4.2.1')['version'] == '4.2.1'
+    for line in ('requests>=2.0', 'Django~=4.2', 'six==1.*', 'a>=1,<2'):
+        entry = parse_entry(line)
+        assert entry['version'] == ''
+        assert '=' not in entry['name'] and '.' not in entry['name']
+    assert parse_entry('requests>=2.0')['name'] == 'requests'
+    assert parse_entry('Django~=4.2')['name'] == 'django'
+
+
+@pytest.mark.parametrize('line', ['-r base.txt', '--index-url https://example.org/simple', '', '# comment'])
+def test_parse_entry_skips_options_and_comments(line):
+    assert parse_entry(line) is None
+
+
+def test_parse_entry_reads_markers_urls_and_hashes():
+    entry = parse_entry('foo==1.0 ; python_version < "4" --hash=sha256:' + 'ab' * 32)
+    assert entry['marker'] == 'python_version < "4"'
+    assert entry['sha256'] == 'ab' * 32
+    assert parse_entry('bar @ https://example.org/bar-1.0.tar.gz')['url'] == 'https://example.org/bar-1.0.tar.gz'
+
+
+def test_parse_entry_round_trips_lock_entries():
+    entry = {'name': 'foo', 'version': '1.0', 'tags': ['py3-none-any'], 'sha256': 'cd' * 32,
+             'record_sha256': 'ef' * 32, 'url': None, 'marker': None}
+    assert parse_entry(format_entry(entry)) == entry
+
+
+def test_parse_entry_rejects_invalid_lines():
+    with pytest.raises(ValueError):
+        parse_entry('not a requirement!')
+
+
+def test_read_requirements(tmp_path):
+    path = tmp_path / 'requirements.txt'
+    path.write_text('--index-url https://example.org/simple\n-r base.txt\nrequests>=2.0\n'
+                    'foo==1.0 \\\n    --hash=sha256:' + 'ab' * 32 + '\n')
+    entries, skipped = read_requirements(str(path))
+    assert [(entry['name'], entry['version']) for entry in entries] == [('requests', ''), ('foo', '1.0')]
+    assert entries[1]['sha256'] == 'ab' * 32
+    assert skipped == ['--index-url https://example.org/simple', '-r base.txt']
+
+
+BACKEND = '''
+import base64, hashlib, os, zipfile
+
+def build_wheel(wheel_directory, config_settings=None, metadata_directory=None):
+    files = {'pkgs.py': 'VERSION = "1.0"\\n',
+             'pkgs-1.0.dist-info/METADATA': 'Metadata-Version: 2.1\\nName: pkgs\\nVersion: 1.0\\n',
+             'pkgs-1.0.dist-info/WHEEL': 'Wheel-Version: 1.0\\nRoot-Is-Purelib: true\\nTag: py3-none-any\\n',
+             # Differs between builds, like the timestamps in a real wheel.
+             'pkgs-1.0.dist-info/BUILD': os.urandom(8).hex()}
+    record = []
+    with zipfile.ZipFile(os.path.join(wheel_directory, 'pkgs-1.0-py3-none-any.whl'), 'w') as wheel:
+        for path, content in files.items():
+            wheel.writestr(path, content)
+            digest = base64.urlsafe_b64encode(hashlib.sha256(content.encode()).digest()).rstrip(b'=').decode()
+            record.append(f"{path},sha256={digest},{len(content)}")
+        wheel.writestr('pkgs-1.0.dist-info/RECORD', '\\n'.join(record + ['pkgs-1.0.dist-info/RECORD,,']) + '\\n')
+    return 'pkgs-1.0-py3-none-any.whl'
+'''
+
+
+def write_sdist(directory):
+    """
+    Write the sdist of `pkgs` 1.0, built by an in-tree backend so no build dependency is downloaded.
+    """
+    files = {
+        'PKG-INFO': 'Metadata-Version: 2.1\nName: pkgs\nVersion: 1.0\n',
+        'pyproject.toml': '[build-system]\nrequires = []\nbuild-backend = "backend"\nbackend-path = ["."]\n',
+        'backend.py': BACKEND,
+    }
+    with tarfile.open(os.path.join(directory, 'pkgs-1.0.tar.gz'), 'w:gz') as sdist:
+        for path, content in files.items():
+            info = tarfile.TarInfo(f"pkgs-1.0/{path}")
+            info.size = len(content.encode())
+            sdist.addfile(info, io.BytesIO(content.encode()))
+
+
+def test_locked_hash_of_a_locally_built_wheel(tmp_path, environment):
+    index = tmp_path / 'index'
+    index.mkdir()
+    write_sdist(index)
+    index_args = ['--no-index', '--find-links', str(index)]
+    cache = WheelCache(str(tmp_path / 'cache'))
+    report = prefetch_and_install(['pkgs==1.0'], lambda message: None, cache=cache, python=environment,
+                                  index_args=index_args)
+    assert report['installed'] == ['pkgs==1.0']
+
+    lock = [entry for entry in capture_lock(interpreter_paths(environment), cache, environment)
+            if entry['name'] == 'pkgs']
+    assert lock[0]['sha256'] == cache.lookup('pkgs==1.0', environment)['sha256']
+    assert lock[0]['url'] is None
+    uninstall = [environment, '-m', 'pip', 'uninstall', '--yes', 'pkgs']
+    subprocess.run(uninstall, check=True, capture_output=True)
+
+    # The index only has the sdist, and building it again gives a wheel with another hash.
+    assert install_lock(lock, lambda message: None, index_args, python=environment)['failed'] == ['pkgs==1.0']
+    report = install_lock(lock, lambda message: None, index_args, python=environment, cache=cache)
+    assert report['installed'] == ['pkgs==1.0'] and report['failed'] == []
+    assert report['cache']['hits'] == 1
+
+
+@pytest.mark.parametrize('url, locked_url', [('file:///tmp/wheelhouse-x/foo-1.0-py3-none-any.whl', None),
+                                             ('https://example.org/foo-1.0-py3-none-any.whl',
+                                              'https://example.org/foo-1.0-py3-none-any.whl')])
+def test_read_entry_drops_local_urls(tmp_path, url, locked_url):
+    dist_info = tmp_path / 'foo-1.0.dist-info'
+    dist_info.mkdir()
+    direct_url = {'url': url, 'archive_info': {'hash': 'sha256=' + 'ab' * 32}}
+    (dist_info / 'direct_url.json').write_text(json.dumps(direct_url))
+    entry = read_entry(str(dist_info), {})
+    assert (entry['url'], entry['sha256']) == (locked_url, 'ab' * 32)
@@ -0,0 +1,30 @@
+import pytest
+
+import metrics
+
+
+@pytest.mark.parametrize('filename', ['metrics.prom', 'metrics.om'])
+def test_write_textfile_names_match(tmp_path, filename):
+    metrics.reset()
+    with metrics.span('redis', bytes=10):
+        pass
+    with metrics.span('install', packages=['foo==1.0']):
+        pass
+    path = str(tmp_path / filename)
+    metrics.write_textfile(path)
+    metrics.reset()
+
+    lines = open(path).read().splitlines()
+    families = {}
+    for line in lines:
+        if line.startswith('# HELP '):
+            families[line.split()[2]] = None
+        elif line.startswith('# TYPE '):
+            _, _, name, kind = line.split()
+            assert name in families and kind == 'gauge'
+            families[name] = kind
+        elif not line.startswith('#'):
+            assert line.split('{')[0] in families
+    assert families['pip_list_phase_seconds'] == 'gauge'
+    assert (lines[-1] == '# EOF') == filename.endswith('.om')
+    assert 'pip_list_phase_bytes{phase="redis"} 10' in lines
@@ -0,0 +1,58 @@
+import pytest
+
+import storage
+from conftest import write_wheel
+from popularity import PACKAGES_KEY, VERSIONS_KEY, package_users, top_packages
+
+core = pytest.importorskip('core')
+
+
+def test_index_follows_every_upload(users):
+    storage.upload_packages(users, 'alice', ['a==1', 'b==1'])
+    storage.upload_packages(users, 'alice', ['a==1', 'c==1'], profile='web')
+    storage.upload_packages(users, 'svc', ['a==2', 'b==1'])
+    assert top_packages(users, 2) == [('a', 3), ('b', 2)]
+    assert dict(top_packages(users, 10, versions=True)) == {'a==1': 2, 'a==2': 1, 'b==1': 2, 'c==1': 1}
+    assert package_users(users, 'a') == ['alice', 'alice/web', 'svc']
+    assert package_users(users, 'a', '2') == ['svc']
+
+    # Repeating an upload changes nothing, and packages no list uses leave the index.
+    storage.upload_packages(users, 'svc', ['a==2', 'b==1'])
+    storage.upload_packages(users, 'svc', ['a==1'])
+    assert dict(top_packages(users, 10, versions=True)) == {'a==1': 3, 'b==1': 1, 'c==1': 1}
+    assert package_users(users, 'b') == ['alice']
+
+    incremental = users.zrange(PACKAGES_KEY, 0, -1, withscores=True), users.zrange(VERSIONS_KEY, 0, -1, withscores=True)
+    users.delete(PACKAGES_KEY, 'pipindex:package:a')
+    assert core.PackageManager.rebuild_index() == 3
+    assert (users.zrange(PACKAGES_KEY, 0, -1, withscores=True),
+            users.zrange(VERSIONS_KEY, 0, -1, withscores=True)) == incremental
+    assert core.PackageManager.get_package_users('A') == ['alice', 'alice/web', 'svc']
+
+
+def test_prefetch_popular(users, tmp_path, monkeypatch):
+    index = tmp_path / 'index'
+    index.mkdir()
+    write_wheel(index, 'pkga', '1.0')
+    write_wheel(index, 'pkgb', '1.0')
+    monkeypatch.setenv('PIP_NO_INDEX', '1')
+    monkeypatch.setenv('PIP_FIND_LINKS', str(index))
+    monkeypatch.setattr(core, 'wheelhouse_dir', None)
+    monkeypatch.setattr(core, 'wheel_cache_dir', None)
+    storage.upload_packages(users, 'alice', ['pkga==1.0', 'pkgb==1.0', 'gone==1.0'])
+    storage.upload_packages(users, 'svc', ['pkga==1.0', 'pkgb==1.0'])
+
+    with pytest.raises(ValueError):
+        core.PackageManager.prefetch_popular()
+
+    monkeypatch.setattr(core, 'wheel_cache_dir', str(tmp_path / 'cache'))
+    result = core.PackageManager.prefetch_popular(2, progress_callback=lambda message: None)
+    assert sorted(result['fetched']) == ['pkga==1.0', 'pkgb==1.0'] and result['failed'] == []
+    cache = core.WheelCache(str(tmp_path / 'cache'))
+    assert sorted(cache.entries) == ['pkga==1.0', 'pkgb==1.0']
+
+    wheelhouse = tmp_path / 'wheelhouse'
+    result = core.PackageManager.prefetch_popular(3, str(wheelhouse), progress_callback=lambda message: None)
+    assert result['failed'] == ['gone==1.0']
+    assert sorted(path.name for path in wheelhouse.iterdir()) == ['pkga-1.0-py3-none-any.whl',
+                                                                  'pkgb-1.0-py3-none-any.whl']
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+import scanner
+
+
+@pytest.fixture
+def site(tmp_path):
+    """
+    A site directory with one distribution of every metadata layout.
+    """
+    scanner.clear_cache()
+    (tmp_path / 'Wheel_Pkg-1.0.dist-info').mkdir()
+    (tmp_path / 'odd-name-here.dist-info').mkdir()
+    (tmp_path / 'odd-name-here.dist-info' / 'METADATA').write_text('Name: odd.name\nVersion: 2.0\n\nName: body\n')
+    (tmp_path / 'egg_dir-3.0-py3.11.egg-info').mkdir()
+    (tmp_path / 'egg_dir-3.0-py3.11.egg-info' / 'PKG-INFO').write_text('Metadata-Version: 1.0\nName: egg-dir\n'
+                                                                       'Version: 3.0\n')
+    (tmp_path / 'egg_file-4.0.egg-info').write_text('Name: egg_file\nVersion: 4.0\n')
+    (tmp_path / 'broken.dist-info').mkdir()
+    (tmp_path / 'module.py').write_text('')
+    yield tmp_path
+    scanner.clear_cache()
+
+
+def test_scan_directory_reads_every_layout(site):
+    assert sorted(scanner.scan_directory(str(site))) == [
+        ('egg-dir', '3.0'), ('egg-file', '4.0'), ('odd-name', '2.0'), ('wheel-pkg', '1.0')]
+
+
+def test_scan_directory_is_memoized_by_mtime(site):
+    path = str(site)
+    first = scanner.scan_directory(path)
+    mtime = os.stat(path).st_mtime_ns
+
+    # Editing an entry leaves the directory mtime alone, so the cached result is kept.
+    (site / 'egg_file-4.0.egg-info').write_text('Name: egg_file\nVersion: 5.0\n')
+    assert scanner.scan_directory(path) is first
+
+    (site / 'new-1.0.dist-info').mkdir()
+    os.utime(path, ns=(mtime, mtime))
+    assert scanner.scan_directory(path) is first
+
+    os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+    assert ('new', '1.0') in scanner.scan_directory(path)
+    assert ('egg-file', '5.0') in scanner.scan_directory(path)
+
+
+def test_scan_environment_prefers_the_first_path(site, tmp_path_factory):
+    other = tmp_path_factory.mktemp('other')
+    (other / 'wheel_pkg-9.0.dist-info').mkdir()
+    (other / 'extra-1.0.dist-info').mkdir()
+    assert scanner.scan_environment([str(site), str(other / 'missing'), str(other)]) == [
+        'egg-dir==3.0', 'egg-file==4.0', 'extra==1.0', 'odd-name==2.0', 'wheel-pkg==1.0']
@@ -0,0 +1,165 @@
+import pytest
+
+import codec
+import storage
+from popularity import top_packages
+
+HISTORY = [
+    ['a==1', 'b==1'],
+    ['a==2', 'b==1', 'c==1'],
+    ['a==2', 'c==1'],
+    ['a==3', 'b==5', 'c==1'],
+]
+
+
+def register(redis_client, username):
+    redis_client.hset(storage.USERS_KEY, username, 'password hash')
+
+
+def upload_history(redis_client, username='alice'):
+    return [storage.upload_packages(redis_client, username, packages)['version'] for packages in HISTORY]
+
+
+def test_upload_writes_only_changes(redis_client):
+    assert storage.upload_packages(redis_client, 'alice', ['a==1', 'b==1']) == \
+        {'changed': 2, 'removed': 0, 'version': 1}
+    assert storage.upload_packages(redis_client, 'alice', ['a==1', 'b==1']) is None
+    assert storage.upload_packages(redis_client, 'alice', ['a==2', 'c==1']) == \
+        {'changed': 2, 'removed': 1, 'version': 2}
+    assert storage.load_packages(redis_client, 'alice') == ['a==2', 'c==1']
+    assert storage.list_profiles(redis_client, 'alice') == [storage.DEFAULT_PROFILE]
+
+
+def test_profiles_are_separate(redis_client):
+    storage.upload_packages(redis_client, 'alice', ['a==1'])
+    storage.upload_packages(redis_client, 'alice', ['b==1'], profile='web')
+    assert storage.load_packages(redis_client, 'alice') == ['a==1']
+    assert storage.load_packages(redis_client, 'alice', 'web') == ['b==1']
+    assert storage.list_profiles(redis_client, 'alice') == [storage.DEFAULT_PROFILE, 'web']
+
+
+def test_snapshots_are_rebuilt_from_reverse_deltas(redis_client):
+    versions = upload_history(redis_client)
+    assert [snapshot for snapshot, _ in storage.list_snapshots(redis_client, 'alice')] == versions
+    for version, packages in zip(versions, HISTORY):
+        assert storage.load_packages(redis_client, 'alice', snapshot=version) == packages
+
+    assert storage.diff_snapshots(redis_client, 'alice', 1, None) == \
+        {'added': {'c': '1'}, 'removed': {}, 'changed': {'a': ['1', '3'], 'b': ['1', '5']}}
+    assert storage.diff_snapshots(redis_client, 'alice', 3, 2) == \
+        {'added': {'b': '1'}, 'removed': {}, 'changed': {}}
+
+
+def test_snapshot_stores_only_the_changed_fields(redis_client):
+    packages = [f"package-{index}==1.0" for index in range(1000)]
+    storage.upload_packages(redis_client, 'alice', packages)
+    storage.upload_packages(redis_client, 'alice', packages[:-1] + ['package-999==2.0'])
+
+    assert redis_client.hlen(storage.packages_key('alice')) == 1000
+    assert list(redis_client.hgetall(storage.snapshot_key('alice', storage.DEFAULT_PROFILE, 1)).values()) == \
+        ['=1.0']
+    assert not redis_client.exists(storage.snapshot_key('alice', storage.DEFAULT_PROFILE, 2))
+    assert storage.load_packages(redis_client, 'alice', snapshot=1) == storage.to_lines(storage.to_mapping(packages))
+
+
+def test_history_limit_drops_the_oldest_snapshots(redis_client, monkeypatch):
+    monkeypatch.setattr(storage, 'history_limit', 2)
+    upload_history(redis_client)
+    assert [snapshot for snapshot, _ in storage.list_snapshots(redis_client, 'alice')] == [3, 4]
+    assert redis_client.keys(storage.snapshot_key('alice', storage.DEFAULT_PROFILE, '*')) == \
+        [storage.snapshot_key('alice', storage.DEFAULT_PROFILE, 3)]
+    assert storage.load_packages(redis_client, 'alice', snapshot=3) == HISTORY[2]
+
+
+@pytest.mark.parametrize('snapshot', [0, 99])
+def test_unknown_snapshot_is_an_error(redis_client, snapshot):
+    upload_history(redis_client)
+    with pytest.raises(ValueError, match='Unknown snapshot'):
+        storage.diff_snapshots(redis_client, 'alice', snapshot, None)
+    with pytest.raises(ValueError, match='Unknown snapshot'):
+        storage.load_packages(redis_client, 'alice', snapshot=snapshot)
+
+
+def test_full_copy_snapshots_are_converted(redis_client):
+    upload_history(redis_client)
+    # The layout of the first release with snapshots: a full copy per version.
+    for version, packages in enumerate(HISTORY, 1):
+        key = storage.snapshot_key('alice', storage.DEFAULT_PROFILE, version)
+        redis_client.delete(key)
+        redis_client.hset(key, mapping=codec.encode_mapping(redis_client, storage.to_mapping(packages)))
+    redis_client.hdel(storage.meta_key('alice'), 'snapshots')
+
+    for version, packages in enumerate(HISTORY, 1):
+        assert storage.load_packages(redis_client, 'alice', snapshot=version) == packages
+    assert redis_client.hget(storage.meta_key('alice'), 'snapshots') == storage.SNAPSHOT_DELTAS
+    assert not redis_client.exists(storage.snapshot_key('alice', storage.DEFAULT_PROFILE, len(HISTORY)))
+
+
+def test_apply_delta(redis_client):
+    storage.upload_packages(redis_client, 'alice', ['a==1', 'b==1'])
+    base_etag = redis_client.hget(storage.meta_key('alice'), 'etag')
+
+    result = storage.apply_delta(redis_client, 'alice', {'a': '2', 'c': '1'}, base_etag,
+                                 {'a': '2', 'c': '1'}, {'a': '1', 'b': '1'})
+    assert result == {'changed': 2, 'removed': 1, 'version': 2}
+    assert storage.load_packages(redis_client, 'alice') == ['a==2', 'c==1']
+    assert storage.load_packages(redis_client, 'alice', snapshot=1) == ['a==1', 'b==1']
+    assert dict(top_packages(redis_client, 10)) == {'a': 1, 'c': 1}
+
+    # The stored list moved on since `base_etag`, so nothing is written.
+    assert storage.apply_delta(redis_client, 'alice', {'d': '1'}, base_etag, {'d': '1'}, {}) is None
+    assert storage.load_packages(redis_client, 'alice') == ['a==2', 'c==1']
+
+
+def test_migrate_legacy_string_list(redis_client):
+    register(redis_client, 'alice')
+    redis_client.set('alice', 'a==1\nb==2\n')
+
+    assert storage.load_packages(redis_client, 'alice') == ['a==1', 'b==2']
+    assert not redis_client.exists('alice')
+    assert storage.list_snapshots(redis_client, 'alice')[0][0] == 1
+    assert storage.diff_snapshots(redis_client, 'alice', 1, None) == {'added': {}, 'removed': {}, 'changed': {}}
+    assert storage.migrate_legacy(redis_client, 'alice') is False
+
+
+def test_migrate_legacy_leaves_other_keys_alone(redis_client):
+    codec.intern_names(redis_client, ['foo'])
+    storage.upload_packages(redis_client, 'bob', ['foo==1'])
+    redis_client.set('carol', 'a==1\n')
+    # A username naming the shared id counter, registered by an older version.
+    register(redis_client, codec.SEQ_KEY)
+
+    assert storage.load_packages(redis_client, codec.SEQ_KEY) == []
+    assert storage.load_packages(redis_client, 'carol') == []
+    assert redis_client.get(codec.SEQ_KEY) == '1'
+    assert redis_client.get('carol') == 'a==1\n'
+
+    codec.clear_cache()
+    storage.upload_packages(redis_client, 'dave', ['newpkg==1'])
+    assert storage.load_packages(redis_client, 'dave') == ['newpkg==1']
+    assert storage.load_packages(redis_client, 'bob') == ['foo==1']
+
+
+@pytest.mark.parametrize('name', ['', 'alice:meta', 'alice:profiles', 'x/web'])
+def test_names_that_collide_with_other_keys_are_rejected(name):
+    with pytest.raises(ValueError):
+        storage.check_name(name)
+    if name:
+        with pytest.raises(ValueError):
+            storage.packages_key('alice', name)
+
+
+def test_iter_package_batches(redis_client):
+    packages = [f"pkg{index}=={index}" for index in range(10)]
+    storage.upload_packages(redis_client, 'alice', packages)
+    batches = list(storage.iter_package_batches(redis_client, 'alice', batch_size=3))
+    assert [len(batch) for batch in batches] == [3, 3, 3, 1]
+    assert sorted(line for batch in batches for line in batch) == sorted(packages)
+    assert storage.count_packages(redis_client, 'alice') == 10
+    assert list(storage.iter_package_batches(redis_client, 'bob')) == []
+
+
+def test_iter_package_batches_migrates_legacy_lists(redis_client):
+    register(redis_client, 'alice')
+    redis_client.set('alice', 'a==1\nb==2\n')
+    assert list(storage.iter_package_batches(redis_client, 'alice')) == [['a==1', 'b==2']]
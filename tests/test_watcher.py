@@ -0,0 +1,92 @@
+import os
+import types
+
+import pytest
+
+import watcher
+from watcher import SiteWatcher, watch
+
+
+def touch(path, seconds):
+    """
+    Move a directory's mtime forward, as an install would.
+    """
+    mtime = os.stat(path).st_mtime_ns + seconds * 10 ** 9
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_site_watcher_reports_only_changes(tmp_path):
+    site, user_site = tmp_path / 'site', tmp_path / 'user'
+    site.mkdir()
+    user_site.mkdir()
+    (site / 'a-1.0.dist-info').mkdir()
+    (site / 'b.egg-info').write_text('Name: b\nVersion: 1.0\n')
+    (user_site / 'a-9.0.dist-info').mkdir()
+    site_watcher = SiteWatcher([str(site), str(user_site)])
+    assert site_watcher.scan() == {'a': '1.0', 'b': '1.0'}
+    assert site_watcher.poll() == ({}, {})
+
+    (site / 'a-1.0.dist-info').rename(site / 'a-2.0.dist-info')
+    (site / 'c-1.0.dist-info').mkdir()
+    (site / '~d-1.0.dist-info').mkdir()
+    touch(site, 1)
+    assert site_watcher.poll() == ({'a': '2.0', 'c': '1.0'}, {'a': '1.0'})
+
+    # Metadata rewritten in place leaves the directory mtime alone.
+    (site / 'b.egg-info').write_text('Name: b\nVersion: 2.0\n')
+    touch(site / 'b.egg-info', 1)
+    assert site_watcher.poll() == ({'b': '2.0'}, {'b': '1.0'})
+
+    (site / 'a-2.0.dist-info').rmdir()
+    touch(site, 2)
+    assert site_watcher.poll() == ({'a': '9.0'}, {'a': '2.0'})
+    assert site_watcher.location('a') == str(user_site / 'a-9.0.dist-info')
+    assert site_watcher.poll() == ({}, {})
+
+
+class ScriptedWatcher:
+    """
+    Returns the next installed packages of `states` on every poll.
+    """
+
+    def __init__(self, states):
+        self.states = states
+        self.current = {}
+
+    def packages(self):
+        return dict(self.current)
+
+    def poll(self):
+        old, self.current = self.current, self.states.pop(0) if self.states else self.current
+        return ({name: version for name, version in self.current.items() if old.get(name) != version},
+                {name: version for name, version in old.items() if self.current.get(name) != version})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(watcher, 'time', types.SimpleNamespace(sleep=sleep, monotonic=lambda: now[0]))
+    return now
+
+
+def test_watch_debounces_and_batches_changes(clock):
+    states = [
+        {'x': '1'}, {'x': '1'}, {'x': '1'},                                  # t=1..3: pushed at t=3
+        {'x': '1', 'y': '1'}, {'x': '1'}, {'x': '1'}, {'x': '1'},            # t=4..7: cancels out
+        {'x': '2'}, {'x': '3'}, {'x': '4'}, {'x': '5'}, {'x': '6'},          # t=8..12: never quiet
+        {'x': '7'}, {'x': '8'},                                              # t=13: max_delay, t=14: pending
+    ]
+    pushes = []
+    count = watch(ScriptedWatcher(states), lambda *push: pushes.append((clock[0],) + push), interval=1.0,
+                  debounce=2.0, max_delay=5.0, should_stop=lambda: clock[0] >= 14, progress_callback=lambda _: None)
+
+    assert count == 3
+    assert pushes == [
+        (3.0, {'x': '1'}, {'x': '1'}, {}),
+        (13.0, {'x': '7'}, {'x': '7'}, {'x': '1'}),
+        (14.0, {'x': '8'}, {'x': '8'}, {'x': '7'}),
+    ]
@@ -0,0 +1,108 @@
+import os
+
+import pytest
+
+import wheelcache
+from conftest import write_wheel
+from wheelcache import WheelCache, parse_wheel_filename
+
+
+@pytest.fixture
+def wheels(tmp_path):
+    path = tmp_path / 'wheels'
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def python(monkeypatch):
+    """
+    A stand-in interpreter that installs only pure-Python and manylinux x86_64 CPython 3.11 wheels.
+    """
+    monkeypatch.setitem(wheelcache._supported_tags, '/fake/python',
+                        {'py3-none-any', 'cp311-cp311-manylinux_2_17_x86_64'})
+    return '/fake/python'
+
+
+def test_parse_wheel_filename():
+    assert parse_wheel_filename('Foo_Bar-1.0-1-py2.py3-none-any.whl') == \
+        ('foo-bar', '1.0', 'py2.py3-none-any', {'py2-none-any', 'py3-none-any'})
+    assert parse_wheel_filename('foo-1.0.tar.gz') is None
+    assert parse_wheel_filename('foo-1.0-py3.whl') is None
+
+
+def test_lookup_picks_a_wheel_the_interpreter_supports(tmp_path, wheels, python):
+    cache = WheelCache(str(tmp_path / 'cache'))
+    for tag in ('cp312-cp312-win_amd64', 'cp311-cp311-manylinux_2_17_x86_64'):
+        path = wheels / f"native-1.0-{tag}.whl"
+        path.write_bytes(tag.encode())
+        assert cache.add(str(path))
+    assert not cache.add(str(wheels / 'native-1.0.tar.gz'))
+
+    assert cache.lookup('native==1.0', python)['filename'] == 'native-1.0-cp311-cp311-manylinux_2_17_x86_64.whl'
+    assert cache.lookup('native==2.0', python) is None
+    del cache.entries['native==1.0']['cp311-cp311-manylinux_2_17_x86_64']
+    assert cache.lookup('native==1.0', python) is None
+
+
+def test_fetch_and_stats_survive_a_reload(tmp_path, wheels, python):
+    cache = WheelCache(str(tmp_path / 'cache'))
+    cache.add(write_wheel(wheels, 'pkg', '1.0'))
+    destination = tmp_path / 'destination'
+    destination.mkdir()
+
+    fetched = cache.fetch('pkg==1.0', str(destination), python)
+    assert fetched == str(destination / 'pkg-1.0-py3-none-any.whl')
+    assert wheelcache.file_sha256(fetched) == cache.lookup('pkg==1.0', python)['sha256']
+    assert cache.fetch('other==1.0', str(destination), python) is None
+    cache.save()
+
+    summary = WheelCache(str(tmp_path / 'cache')).summary()
+    assert summary['hits'] == summary['misses'] == 1
+    assert summary['hit_rate'] == 0.5
+    assert summary['bytes_saved'] == summary['bytes'] == os.path.getsize(fetched)
+
+
+def test_evict_removes_the_least_recently_used_wheels(tmp_path, wheels, python):
+    cache = WheelCache(str(tmp_path / 'cache'))
+    for index, name in enumerate(['old', 'used', 'new']):
+        path = wheels / f"{name}-1.0-py3-none-any.whl"
+        path.write_bytes(b'x' * 100 + name.encode())
+        cache.add(str(path))
+        cache.entries[f"{name}==1.0"]['py3-none-any']['last_used'] = index
+    # The same bytes under a second name share one blob.
+    (wheels / 'alias-1.0-py3-none-any.whl').write_bytes(b'x' * 100 + b'old')
+    cache.add(str(wheels / 'alias-1.0-py3-none-any.whl'))
+    cache.entries['alias==1.0']['py3-none-any']['last_used'] = 3
+    cache.fetch('used==1.0', str(tmp_path), python)
+
+    old_blob = cache.blob_path(cache.entries['old==1.0']['py3-none-any']['sha256'])
+    new_blob = cache.blob_path(cache.entries['new==1.0']['py3-none-any']['sha256'])
+    cache.max_bytes = 210
+    cache.save()
+    # Dropping `old` frees nothing while `alias` still uses its blob, so `new` goes too.
+    assert sorted(cache.entries) == ['alias==1.0', 'used==1.0']
+    assert os.path.exists(old_blob) and not os.path.exists(new_blob)
+    assert sorted(WheelCache(str(tmp_path / 'cache')).entries) == ['alias==1.0', 'used==1.0']
+
+
+def test_concurrent_saves_are_merged(tmp_path, wheels, python):
+    first, second = WheelCache(str(tmp_path / 'cache')), WheelCache(str(tmp_path / 'cache'))
+    first.add(write_wheel(wheels, 'one', '1.0'))
+    second.add(write_wheel(wheels, 'two', '1.0'))
+    first.fetch('one==1.0', str(tmp_path), python)
+    second.fetch('missing==1.0', str(tmp_path), python)
+    first.save()
+    second.save()
+    first.save()
+
+    reloaded = WheelCache(str(tmp_path / 'cache'))
+    assert sorted(reloaded.entries) == ['one==1.0', 'two==1.0']
+    assert (reloaded.stats['hits'], reloaded.stats['misses']) == (1, 1)
+
+    # Evicting the least recently used `two` elsewhere removes its blob, so `first` drops its entry too.
+    reloaded.max_bytes = reloaded.summary()['bytes'] - 1
+    reloaded.save()
+    first.save()
+    assert sorted(first.entries) == ['one==1.0']
+    assert sorted(WheelCache(str(tmp_path / 'cache')).entries) == ['one==1.0']
@@ -0,0 +1,193 @@
+"""
+Change detection for the site-packages directories of an environment.
+
+`SiteWatcher.poll()` only stats the directories on the path. When the mtime
+of one changed (a distribution was installed, upgraded or removed), its
+entries are listed again and only the `*.dist-info` / `*.egg-info` entries
+that were added are read; a `name-version.dist-info` entry is never read
+again, as its name already tells its version. Entries whose name does not
+carry the version (e.g. `name.egg-info`) are stat'ed on every poll instead,
+as their metadata can be rewritten in place.
+"""
+import os
+import time
+
+from installer import normalize_name
+from scanner import read_distribution
+
+
+def _versioned(entry_name):
+    return entry_name.endswith('.dist-info') and entry_name[:-len('.dist-info')].count('-') == 1
+
+
+def _read_entry(entry):
+    name, version = read_distribution(entry)
+    return (normalize_name(name), version) if name and version else (None, None)
+
+
+class SiteWatcher:
+    def __init__(self, paths):
+        self.paths = [os.path.abspath(path or os.curdir) for path in paths]
+        # directory -> (mtime, {entry name: (entry mtime, name, version)})
+        self._directories = {}
+        # name -> (version, metadata path) of the distribution that wins on the path
+        self.installed = {}
+
+    def packages(self):
+        """
+        Return the dict of name -> version of the installed distributions.
+        """
+        return {name: version for name, (version, _) in self.installed.items()}
+
+    def location(self, name):
+        return self.installed[name][1]
+
+    def scan(self):
+        """
+        Read every directory on the path and return the installed packages.
+        """
+        self._directories.clear()
+        for path in self.paths:
+            self._scan_directory(path)
+        self.installed = self._combine()
+        return self.packages()
+
+    def poll(self):
+        """
+        Check the path for changes. Returns the (added, removed) dicts of name -> version
+        since the previous call, where an upgrade appears in both; both are empty when
+        nothing changed.
+        """
+        changed = False
+        for path in self.paths:
+            changed = self._poll_directory(path) or changed
+        if not changed:
+            return {}, {}
+
+        installed = self._combine()
+        old = {name: version for name, (version, _) in self.installed.items()}
+        new = {name: version for name, (version, _) in installed.items()}
+        self.installed = installed
+        added = {name: version for name, version in new.items() if old.get(name) != version}
+        removed = {name: version for name, version in old.items() if new.get(name) != version}
+        return added, removed
+
+    def _poll_directory(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return self._directories.pop(path, None) is not None
+
+        known = self._directories.get(path)
+        if known is None or known[0] != mtime:
+            return self._scan_directory(path, mtime)
+
+        changed = False
+        entries = known[1]
+        for entry_name, (entry_mtime, _, _) in list(entries.items()):
+            if _versioned(entry_name):
+                continue
+            try:
+                current = os.stat(os.path.join(path, entry_name)).st_mtime_ns
+            except OSError:
+                return self._scan_directory(path, mtime)
+            if current != entry_mtime:
+                entries[entry_name] = (current, *self._read(path, entry_name))
+                changed = True
+        return changed
+
+    def _scan_directory(self, path, mtime=None):
+        """
+        List a directory and read the entries that are new or changed. Returns True when
+        the directory's distributions differ from the previous scan.
+        """
+        known = self._directories.get(path, (None, {}))[1]
+        entries = {}
+        try:
+            if mtime is None:
+                mtime = os.stat(path).st_mtime_ns
+            with os.scandir(path) as found:
+                for entry in found:
+                    # pip moves the metadata of packages it is removing to `~`-prefixed temporary names.
+                    if not entry.name.endswith(('.dist-info', '.egg-info')) or entry.name.startswith('~'):
+                        continue
+                    previous = known.get(entry.name)
+                    if previous and _versioned(entry.name):
+                        entries[entry.name] = previous
+                        continue
+                    entry_mtime = None if _versioned(entry.name) else entry.stat().st_mtime_ns
+                    if previous and previous[0] == entry_mtime:
+                        entries[entry.name] = previous
+                    else:
+                        entries[entry.name] = (entry_mtime, *_read_entry(entry))
+        except OSError:
+            return self._directories.pop(path, None) is not None
+
+        self._directories[path] = (mtime, entries)
+        return entries != known
+
+    @staticmethod
+    def _read(path, entry_name):
+        with os.scandir(path) as found:
+            for entry in found:
+                if entry.name == entry_name:
+                    return _read_entry(entry)
+        return None, None
+
+    def _combine(self):
+        """
+        Merge the directories in path order; like the import system, the first
+        distribution found for a name wins.
+        """
+        installed = {}
+        for path in self.paths:
+            if path not in self._directories:
+                continue
+            for entry_name, (_, name, version) in sorted(self._directories[path][1].items()):
+                if name and version:
+                    installed.setdefault(name, (version, os.path.join(path, entry_name)))
+        return installed
+
+
+def watch(watcher, push, interval=1.0, debounce=2.0, max_delay=30.0, should_stop=lambda: False,
+          progress_callback=print):
+    """
+    Poll `watcher` every `interval` seconds and push the accumulated changes.
+
+    Changes are batched until the environment has been quiet for `debounce`
+    seconds (or changes kept coming for `max_delay` seconds), then
+    `push(packages, added, removed)` is called with the complete new dict of
+    name -> version and the difference to the previous push. Changes that
+    cancel out (e.g. an install undone before the push) are never sent.
+    Stops once `should_stop()` is true or on Ctrl+C, pushing the pending
+    changes first, and returns the number of pushes.
+    """
+    state = {'pushed': watcher.packages(), 'pushes': 0}
+
+    def flush():
+        current = watcher.packages()
+        pushed = state['pushed']
+        added = {name: version for name, version in current.items() if pushed.get(name) != version}
+        removed = {name: version for name, version in pushed.items() if current.get(name) != version}
+        if added or removed:
+            push(current, added, removed)
+            state['pushed'] = current
+            state['pushes'] += 1
+
+    first_change = last_change = None
+    try:
+        while not should_stop():
+            time.sleep(interval)
+            added, removed = watcher.poll()
+            now = time.monotonic()
+            if added or removed:
+                progress_callback(f"Detected {len(added)} installed and {len(removed)} removed distributions.")
+                first_change = first_change or now
+                last_change = now
+            if last_change is not None and (now - last_change >= debounce or now - first_change >= max_delay):
+                first_change = last_change = None
+                flush()
+    except KeyboardInterrupt:
+        watcher.poll()
+    flush()
+    return state['pushes']
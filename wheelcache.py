@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from installer import normalize_name, packaging_module
+
+_SUPPORTED_TAGS_SCRIPT = (
+    "import json\n"
+    "try:\n"
+    "    from packaging import tags\n"
+    "except ImportError:\n"
+    "    from pip._vendor.packaging import tags\n"
+    "print(json.dumps([str(tag) for tag in tags.sys_tags()]))\n"
+)
+
+# interpreter -> set of "python-abi-platform" tags
+_supported_tags = {}
+
+
+def supported_tags(python=None):
+    """
+    Return the wheel tags the `python` interpreter (default: this one) can install.
+    """
+    if python not in _supported_tags:
+        if python is None:
+            _supported_tags[python] = {str(tag) for tag in packaging_module('tags').sys_tags()}
+        else:
+            result = subprocess.run([python, '-c', _SUPPORTED_TAGS_SCRIPT], capture_output=True, text=True, check=True)
+            _supported_tags[python] = set(json.loads(result.stdout))
+    return _supported_tags[python]
+
+
+def parse_wheel_filename(filename):
+    """
+    Split `name-version(-build)?-python-abi-platform.whl` into its normalized name, version,
+    compressed `python-abi-platform` tag and the set of tags it expands to. Returns None
+    for other file names.
+    """
+    parts = filename[:-len('.whl')].split('-')
+    if not filename.endswith('.whl') or len(parts) not in (5, 6):
+        return None
+    python_tag, abi_tag, platform_tag = parts[-3:]
+    tags = {
+        f"{python}-{abi}-{platform}"
+        for python in python_tag.split('.')
+        for abi in abi_tag.split('.')
+        for platform in platform_tag.split('.')
+    }
+    return normalize_name(parts[0]), parts[1], f"{python_tag}-{abi_tag}-{platform_tag}", tags
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as wheel:
+        for block in iter(lambda: wheel.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class WheelCache:
+    """
+    Content-addressed store of wheels shared by all restores on this machine.
+
+    Wheels are stored once per sha256 under `blobs/` and looked up through
+    `index.json`, which maps `name==version` to the wheels built for each
+    python-abi-platform tag. The store is kept under `max_bytes` by evicting
+    the least recently used wheels.
+    """
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, 'index.json')
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok=True)
+        data = self._read_index()
+        # "name==version" -> {"python-abi-platform": {sha256, size, filename, last_used}}
+        self.entries = data.get('entries', {})
+        self.stats = data.get('stats', {'hits': 0, 'misses': 0, 'bytes_saved': 0})
+        # The stats as last read or written, so `save()` adds only this process' counts to the file's.
+        self._saved_stats = dict(self.stats)
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as index:
+                return json.load(index)
+        except (OSError, ValueError):
+            return {}
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, 'blobs', sha256[:2], sha256)
+
+    def lookup(self, requirement, python=None):
+        """
+        Return the index entry of a cached wheel for a pinned `name==version` requirement
+        that the `python` interpreter can install, or None.
+        """
+        wheels = self.entries.get(requirement)
+        if wheels:
+            tags = supported_tags(python)
+            for entry in wheels.values():
+                if parse_wheel_filename(entry['filename'])[3] & tags:
+                    return entry
+        return None
+
+    def fetch(self, requirement, destination, python=None):
+        """
+        Copy the cached wheel for `requirement` into the destination directory.
+
+        Returns the path of the copied wheel, or None on a cache miss.
+        """
+        entry = self.lookup(requirement, python)
+        if entry is None or not os.path.exists(self.blob_path(entry['sha256'])):
+            self.stats['misses'] += 1
+            return None
+        return self._copy(entry, destination)
+
+    def fetch_hash(self, sha256, destination):
+        """
+        Copy the cached wheel with the given sha256 into the destination directory, e.g. to
+        install a lock entry whose wheel was built locally. Returns the path of the copied
+        wheel, or None when no cached wheel has that hash.
+        """
+        sha256 = sha256.lower()
+        if os.path.exists(self.blob_path(sha256)):
+            for wheels in self.entries.values():
+                for entry in wheels.values():
+                    if entry['sha256'] == sha256:
+                        return self._copy(entry, destination)
+        return None
+
+    def _copy(self, entry, destination):
+        target = os.path.join(destination, entry['filename'])
+        if not os.path.exists(target):
+            try:
+                os.link(self.blob_path(entry['sha256']), target)
+            except OSError:
+                shutil.copyfile(self.blob_path(entry['sha256']), target)
+        entry['last_used'] = time.time()
+        self.stats['hits'] += 1
+        self.stats['bytes_saved'] += entry['size']
+        return target
+
+    def add(self, path):
+        """
+        Store a wheel file in the cache. Returns False for files that are not wheels.
+        """
+        parsed = parse_wheel_filename(os.path.basename(path))
+        if parsed is None:
+            return False
+        name, version, tag, _ = parsed
+        wheels = self.entries.setdefault(f"{name}=={version}", {})
+        if tag in wheels and os.path.exists(self.blob_path(wheels[tag]['sha256'])):
+            return True
+
+        sha256 = file_sha256(path)
+        blob = self.blob_path(sha256)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            shutil.copyfile(path, blob + '.tmp')
+            os.replace(blob + '.tmp', blob)
+        wheels[tag] = {
+            'sha256': sha256,
+            'size': os.path.getsize(blob),
+            'filename': os.path.basename(path),
+            'last_used': time.time(),
+        }
+        return True
+
+    def add_directory(self, directory):
+        """
+        Store every wheel of a directory, e.g. a wheelhouse after a restore.
+        """
+        for filename in os.listdir(directory):
+            if filename.endswith('.whl'):
+                self.add(os.path.join(directory, filename))
+
+    def evict(self):
+        """
+        Remove the least recently used wheels until the cache fits in `max_bytes`.
+        """
+        wheels = [(entry['last_used'], requirement, tag, entry)
+                  for requirement, tags in self.entries.items() for tag, entry in tags.items()]
+        sizes = {}
+        referenced = {}
+        for _, _, _, entry in wheels:
+            sizes[entry['sha256']] = entry['size']
+            referenced[entry['sha256']] = referenced.get(entry['sha256'], 0) + 1
+        total = sum(sizes.values())
+
+        for _, requirement, tag, entry in sorted(wheels, key=lambda wheel: wheel[0]):
+            if total <= self.max_bytes:
+                break
+            del self.entries[requirement][tag]
+            if not self.entries[requirement]:
+                del self.entries[requirement]
+            referenced[entry['sha256']] -= 1
+            if not referenced[entry['sha256']]:
+                total -= entry['size']
+                try:
+                    os.remove(self.blob_path(entry['sha256']))
+                except FileNotFoundError:
+                    pass
+
+    def save(self):
+        """
+        Merge the index with the one on disk, evict and write it back.
+
+        Several restores can share the cache, so the index is re-read under an
+        exclusive lock and the entries and stats saved by the others since it was
+        read are kept; otherwise their wheels would stay in `blobs/` without an
+        entry, out of reach of the eviction.
+        """
+        with open(os.path.join(self.root, 'index.lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            data = self._read_index()
+            for requirement, tags in data.get('entries', {}).items():
+                for tag, entry in tags.items():
+                    current = self.entries.setdefault(requirement, {}).setdefault(tag, entry)
+                    if current['sha256'] == entry['sha256']:
+                        current['last_used'] = max(current['last_used'], entry['last_used'])
+            # Entries whose blob another process evicted meanwhile are dropped.
+            for requirement, tags in list(self.entries.items()):
+                for tag, entry in list(tags.items()):
+                    if not os.path.exists(self.blob_path(entry['sha256'])):
+                        del tags[tag]
+                if not tags:
+                    del self.entries[requirement]
+            stored = data.get('stats', {})
+            self.stats = {key: stored.get(key, 0) + value - self._saved_stats.get(key, 0)
+                          for key, value in self.stats.items()}
+            self._saved_stats = dict(self.stats)
+
+            self.evict()
+            temporary = self.index_path + f".{os.getpid()}.tmp"
+            with open(temporary, 'w') as index:
+                json.dump({'entries': self.entries, 'stats': self.stats}, index)
+            os.replace(temporary, self.index_path)
+
+    def summary(self):
+        """
+        Return the hit rate, bytes saved and size of the cache.
+        """
+        lookups = self.stats['hits'] + self.stats['misses']
+        sizes = {entry['sha256']: entry['size'] for tags in self.entries.values() for entry in tags.values()}
+        return {
+            'hits': self.stats['hits'],
+            'misses': self.stats['misses'],
+            'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+            'bytes_saved': self.stats['bytes_saved'],
+            'wheels': len(sizes),
+            'bytes': sum(sizes.values()),
+        }